@@ -4,35 +4,132 @@ import pandas as pd
 from datetime import datetime
 import plotly.express as px
 from dotenv import load_dotenv
+from collections import OrderedDict
 import os
+import threading
 
 load_dotenv()
 # Define the base URL of the FastAPI application
 BASE_URL = os.getenv('BASE_URL')
+# Seconds a fetched list or statistic is reused before it is revalidated with the server
+CACHE_TTL = int(os.getenv('CLIENT_CACHE_TTL', '300'))
+# Total size of the response bodies kept for ETag revalidation; the least recently used are dropped first
+ETAG_CACHE_MAX_BYTES = int(os.getenv('CLIENT_ETAG_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
 
 api_key_input = st.text_input("Enter API Key", type="password")
 
 
+# One keep-alive session shared by every rerun and browser session, so requests reuse pooled connections
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Last response seen per URL as (ETag, JSON body, next page URL), bounded by the size of the bodies.
+# Shared by every browser session, whose reruns run on threads of their own.
+class EtagCache:
+    def __init__(self, max_bytes=ETAG_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            self._entries.move_to_end(url)
+            return entry[:3]
+
+    def put(self, url, etag, data, next_url, size):
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._bytes -= old[3]
+            if size > self.max_bytes:
+                return
+            self._entries[url] = (etag, data, next_url, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+
+
+@st.cache_resource
+def get_etag_cache():
+    return EtagCache()
+
+
+# Validating costs a request, so a key that passed is remembered for the rest of the browser session
 def validate_api_key(api_key):
-    headers = {"api-key": api_key}
-    response = requests.get(f"{BASE_URL}/validate_key/", headers=headers)
-    return response.status_code == 200
+    validated = st.session_state.setdefault("validated_keys", set())
+    if api_key not in validated:
+        headers = {"api-key": api_key}
+        response = get_session().get(f"{BASE_URL}/validate_key/", headers=headers)
+        if response.status_code != 200:
+            return False
+        validated.add(api_key)
+    return True
 
 
 # Helper functions for API communication
+# GET a JSON document. A response seen before is revalidated with If-None-Match, and a 304 reuses
+# the stored body instead of downloading it again. Returns the body and the rel="next" URL.
+def get_json(url, params=None):
+    url = requests.Request("GET", url, params=params).prepare().url
+    etag_cache = get_etag_cache()
+    cached = etag_cache.get(url)
+    response = get_session().get(url, headers={"If-None-Match": cached[0]} if cached else None)
+    if response.status_code == 304 and cached:
+        return cached[1], cached[2]
+    response.raise_for_status()
+    data = response.json()
+    next_url = response.links.get("next", {}).get("url")
+    if response.headers.get("ETag"):
+        etag_cache.put(url, response.headers["ETag"], data, next_url, len(response.content))
+    return data, next_url
+
+
+# Collect every page of a keyset-paginated list endpoint by following its rel="next" links.
+# Cached for CACHE_TTL so widget interactions do not re-download the catalog.
+@st.cache_data(ttl=CACHE_TTL, show_spinner="Loading catalog...")
+def get_all_pages(url):
+    items, url = get_json(url, {"limit": 1000})
+    items = list(items)
+    while url:
+        page, url = get_json(url)
+        items.extend(page)
+    return items
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_cached_json(url, params=None):
+    return get_json(url, params)[0]
+
+
+# Drop cached lists and statistics after a change, so the next rerun fetches fresh data
+def invalidate_data():
+    st.cache_data.clear()
+
+
 def get_authors():
-    response = requests.get(f"{BASE_URL}/authors/")
-    if response.status_code == 200:
-        return response.json()
-    else:
+    try:
+        return get_all_pages(f"{BASE_URL}/authors/")
+    except requests.RequestException:
         st.error("Failed to fetch authors.")
         return []
 
 
 def add_author(api_key, name):
     headers = {"api-key": api_key}
-    response = requests.post(f"{BASE_URL}/authors/", json={"name": name}, headers=headers)
+    response = get_session().post(f"{BASE_URL}/authors/", json={"name": name}, headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success(f"Author '{name}' added successfully!")
     else:
         st.error(f"Failed to add author: {response.json().get('detail', 'Unknown error')}")
@@ -40,8 +137,9 @@ def add_author(api_key, name):
 
 def update_author(api_key, author_id, name):
     headers = {"api-key": api_key}
-    response = requests.put(f"{BASE_URL}/authors/{author_id}", json={"name": name}, headers=headers)
+    response = get_session().put(f"{BASE_URL}/authors/{author_id}", json={"name": name}, headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success(f"Author '{name}' updated successfully!")
     else:
         st.error(f"Failed to update author: {response.json().get('detail', 'Unknown error')}")
@@ -49,26 +147,28 @@ def update_author(api_key, author_id, name):
 
 def delete_author(api_key, author_id):
     headers = {"api-key": api_key}
-    response = requests.delete(f"{BASE_URL}/authors/{author_id}", headers=headers)
+    response = get_session().delete(f"{BASE_URL}/authors/{author_id}", headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success("Author deleted successfully!")
     else:
         st.error(f"Failed to delete author: {response.json().get('detail', 'Unknown error')}")
 
 
+# Books come with their author embedded (?expand=author), joined by the server
 def get_books():
-    response = requests.get(f"{BASE_URL}/books/")
-    if response.status_code == 200:
-        return response.json()
-    else:
+    try:
+        return get_all_pages(f"{BASE_URL}/books/?expand=author")
+    except requests.RequestException:
         st.error("Failed to fetch books.")
         return []
 
 
 def add_book(api_key, book_data):
     headers = {"api-key": api_key}
-    response = requests.post(f"{BASE_URL}/books/", json=book_data, headers=headers)
+    response = get_session().post(f"{BASE_URL}/books/", json=book_data, headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success(f"Book '{book_data['title']}' added successfully!")
     else:
         st.error(f"Failed to add book: {response.json().get('detail', 'Unknown error')}")
@@ -76,8 +176,9 @@ def add_book(api_key, book_data):
 
 def update_book(api_key, book_id, book_data):
     headers = {"api-key": api_key}
-    response = requests.put(f"{BASE_URL}/books/{book_id}", json=book_data, headers=headers)
+    response = get_session().put(f"{BASE_URL}/books/{book_id}", json=book_data, headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success(f"Book '{book_data['title']}' updated successfully!")
     else:
         st.error(f"Failed to update book: {response.json().get('detail', 'Unknown error')}")
@@ -85,8 +186,9 @@ def update_book(api_key, book_id, book_data):
 
 def delete_book(api_key, book_id):
     headers = {"api-key": api_key}
-    response = requests.delete(f"{BASE_URL}/books/{book_id}", headers=headers)
+    response = get_session().delete(f"{BASE_URL}/books/{book_id}", headers=headers)
     if response.status_code == 200:
+        invalidate_data()
         st.success("Book deleted successfully!")
     else:
         st.error(f"Failed to delete book: {response.json().get('detail', 'Unknown error')}")
@@ -137,11 +239,10 @@ def books_dashboard(api_key):
     # Display existing books
     st.subheader("Existing Books")
     books = get_books()
-    authors = get_authors()
+    authors = get_authors()  # Only needed for the author pickers below
 
-    author_id_to_name = {author['id']: author['name'] for author in authors}
     for book in books:
-        book['author'] = author_id_to_name.get(book['author_id'], 'Unknown')
+        book['author'] = book['author']['name'] if book.get('author') else 'Unknown'
         book['genres'] = ', '.join(book['genres'])  # Display genres as a comma-separated list of names
         del book['author_id']
 
@@ -218,32 +319,33 @@ def books_dashboard(api_key):
 
 # Visualizations Dashboard
 
+def get_stats(endpoint, params=None):
+    try:
+        return get_cached_json(f"{BASE_URL}/stats/{endpoint}", params)
+    except requests.RequestException:
+        st.error("Failed to fetch statistics.")
+        return None
+
+
 def visualizations_dashboard():
     st.title("Visualizations Dashboard")
 
-    # Fetch the books and authors data
-    books = get_books()
-    authors = get_authors()
-
-    if books:
-        # Convert books to a DataFrame
-        df_books = pd.DataFrame(books)
+    # Fetch the catalog summary; the charts are aggregated server-side
+    summary = get_stats("summary")
 
-        if 'author_id' in df_books.columns:
-            # Map author_id to author names
-            author_id_to_name = {author['id']: author['name'] for author in authors}
-            df_books['author'] = df_books['author_id'].map(author_id_to_name)
-            df_books.drop('author_id', axis=1, inplace=True)
+    if summary and summary['book_count'] and summary['min_year'] is not None:
+        authors = get_authors()
+        author_name_to_id = {author['name']: author['id'] for author in authors}
 
         # Sidebar filters
         st.sidebar.title("Filters")
 
         # Filter by Author
-        selected_author = st.sidebar.selectbox("Select Author", options=["All"] + list(author_id_to_name.values()))
+        selected_author = st.sidebar.selectbox("Select Author", options=["All"] + list(author_name_to_id))
 
         # Filter by Published Year
-        min_year = int(df_books['published_year'].min())
-        max_year = int(df_books['published_year'].max())
+        min_year = int(summary['min_year'])
+        max_year = int(summary['max_year'])
         selected_year = st.sidebar.slider("Select Published Year", min_value=min_year, max_value=max_year,
                                           value=(min_year, max_year))
 
@@ -258,21 +360,23 @@ def visualizations_dashboard():
         # Apply Filters Button
         if st.sidebar.button("Apply Filters") or not filters_applied:
             # Apply filters if any are set
-            filtered_books = df_books.copy()  # Default to showing all data if no filters applied
+            params = {}
 
             if filters_applied:
                 if selected_author != "All":
-                    filtered_books = filtered_books[filtered_books['author'] == selected_author]
+                    params['author_id'] = author_name_to_id[selected_author]
+
+                params['year_min'], params['year_max'] = selected_year
+                params['rating_min'], params['rating_max'] = selected_rating
 
-                filtered_books = filtered_books[(filtered_books['published_year'] >= selected_year[0]) & (
-                        filtered_books['published_year'] <= selected_year[1])]
-                filtered_books = filtered_books[(filtered_books['average_rating'] >= selected_rating[0]) & (
-                        filtered_books['average_rating'] <= selected_rating[1])]
+            books_by_year = pd.DataFrame(get_stats("books-by-year", params) or [],
+                                         columns=['published_year', 'count']).rename(columns={'count': 'Count'})
+            books_by_rating = pd.DataFrame(get_stats("books-by-rating", {**params, "bucket": 0.01}) or [],
+                                           columns=['average_rating', 'count']).rename(columns={'count': 'Count'})
 
             # Visualization 1: Books by Year
-            if not filtered_books.empty:
+            if not books_by_year.empty:
                 st.subheader(f"Books by Year")
-                books_by_year = filtered_books.groupby('published_year').size().reset_index(name='Count')
                 fig_years = px.bar(
                     books_by_year,
                     x='published_year',
@@ -299,7 +403,6 @@ def visualizations_dashboard():
 
                 # Visualization 2: Books by Average Rating
                 st.subheader(f"Books by Average Rating")
-                books_by_rating = filtered_books.groupby('average_rating').size().reset_index(name='Count')
                 fig_ratings = px.bar(
                     books_by_rating,
                     x='average_rating',
@@ -1,19 +1,150 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
+from collections import Counter
+from ratelimit import TokenBucket
+import hashlib
+import hmac
+import math
 import os
+import secrets
+import threading
+import time
 
 load_dotenv()
-API_KEY = os.getenv("API_KEYS")
 API_KEY_NAME = "api-key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
+# .env file holding the comma-separated API_KEYS list written by auth/generate_key.py. It is re-read
+# when it changes; without the file (or without API_KEYS in it) the process environment is used.
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+API_KEYS_RELOAD_INTERVAL = float(os.getenv("API_KEYS_RELOAD_INTERVAL", "1"))  # Seconds between file checks
+# Per-key token bucket on the write routes: sustained writes per second and burst size
+WRITE_RATE_LIMIT = float(os.getenv("WRITE_RATE_LIMIT", "20"))
+WRITE_RATE_BURST = float(os.getenv("WRITE_RATE_BURST", "40"))
 
-def get_api_key(api_key: str = Depends(api_key_header)):
-    if api_key != API_KEY:
+
+def parse_keys(value):
+    return {key.strip() for key in (value or "").split(",") if key.strip()}
+
+
+# Short, stable identifier for a key that is safe to show in stats and logs
+def fingerprint(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+# Set of valid API keys, held as HMAC digests under a per-process secret. A lookup digests the
+# presented key and probes a dict, so it is O(1) and its timing depends only on a digest the caller
+# cannot predict, never on how many leading characters of a real key matched.
+class KeyRegistry:
+    def __init__(self, path=API_KEYS_FILE, reload_interval=API_KEYS_RELOAD_INTERVAL,
+                 rate=WRITE_RATE_LIMIT, burst=WRITE_RATE_BURST):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.rate = rate
+        self.burst = burst
+        self._secret = secrets.token_bytes(32)
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._file_stamp = None
+        self._checked = 0.0
+        self._reloads = 0
+        self._rejected = 0
+        self._counters = {}
+        self._buckets = {}
+        self.reload()
+
+    def _digest(self, key):
+        return hmac.new(self._secret, key.encode(), hashlib.sha256).digest()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        values = dotenv_values(self.path) if os.path.isfile(self.path) else {}
+        keys = parse_keys(values["API_KEYS"] if values.get("API_KEYS") is not None else os.getenv("API_KEYS"))
+        digests = {self._digest(key): fingerprint(key) for key in keys}
+        with self._lock:
+            self._digests = digests
+            self._file_stamp = self._stamp()
+            self._reloads += 1
+            # Revoked keys lose their bucket; their counters stay for the stats
+            active = set(digests.values())
+            self._buckets = {key_id: bucket for key_id, bucket in self._buckets.items() if key_id in active}
+
+    # Pick up edits to the key file without a restart; stat() at most once per reload interval
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        if self._stamp() != self._file_stamp:
+            self.reload()
+
+    # Returns the key's fingerprint, or None when it is not a valid key
+    def identify(self, key):
+        self._refresh()
+        key_id = self._digests.get(self._digest(key)) if key else None
+        with self._lock:
+            if key_id is None:
+                self._rejected += 1
+            else:
+                self._counters.setdefault(key_id, Counter())["requests"] += 1
+        return key_id
+
+    # Take a write token for the key. Returns 0 when allowed, otherwise the seconds to wait.
+    def acquire_write(self, key_id):
+        with self._lock:
+            bucket = self._buckets.get(key_id)
+            if bucket is None:
+                bucket = self._buckets[key_id] = TokenBucket(self.rate, self.burst)
+            counters = self._counters.setdefault(key_id, Counter())
+        wait = bucket.try_acquire()
+        with self._lock:
+            counters["throttled" if wait else "writes"] += 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._digests),
+                "reloads": self._reloads,
+                "rejected": self._rejected,
+                "write_rate_limit": self.rate,
+                "write_rate_burst": self.burst,
+                "per_key": {key_id: dict(counters) for key_id, counters in self._counters.items()},
+            }
+
+
+key_registry = KeyRegistry()
+
+
+def _authenticate(api_key):
+    key_id = key_registry.identify(api_key)
+    if key_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API Key",
         )
+    return key_id
+
+
+async def get_api_key(api_key: str = Depends(api_key_header)):
+    _authenticate(api_key)
     return api_key
 
+
+# Same as get_api_key, plus the per-key write rate limit (429 with Retry-After once the bucket is empty)
+async def get_write_api_key(api_key: str = Depends(api_key_header)):
+    wait = key_registry.acquire_write(_authenticate(api_key))
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Write rate limit exceeded for this API key",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+    return api_key
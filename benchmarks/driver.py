@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from benchmarks.latency import summarize
+from benchmarks.synthetic import FIRST_NAMES, LAST_NAMES, WORDS, GENRES
+
+API_KEY = "benchmark-key"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _book(rng, author_id, tag):
+    return {"title": f"Driver {tag}", "author_id": author_id, "book_link": f"driver/{tag}",
+            "genres": rng.sample(GENRES[:20], 3), "average_rating": round(rng.uniform(1, 5), 2),
+            "published_year": rng.randint(1900, 2024)}
+
+
+# A generated author's name with one letter dropped, as a user might misspell it
+def _misspelled_author(rng):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    cut = rng.randrange(len(name))
+    return name[:cut] + name[cut + 1:]
+
+
+# One scenario per route. Each builds a request from the rng and the shared context (catalog bounds and
+# ids created by earlier write scenarios); `heavy` scenarios read the whole catalog and run a few times only.
+def scenarios():
+    def book_id(ctx, rng):
+        return rng.randint(1, ctx["max_book_id"])
+
+    def author_id(ctx, rng):
+        return rng.randint(1, ctx["max_author_id"])
+
+    def created(kind):
+        def take(ctx, rng):
+            return ctx[kind].pop() if ctx[kind] else 0
+        return take
+
+    def remember(kind):
+        def store(ctx, response):
+            if response.status_code == 200:
+                ctx[kind].append(response.json()["id"])
+        return store
+
+    def remember_bulk(kind):
+        def store(ctx, response):
+            if response.status_code == 200:
+                ctx[kind] += [item["id"] for item in response.json()["items"] if item.get("id")]
+        return store
+
+    key = {"api-key": API_KEY}
+    return [
+        # Reads
+        ("books.page", "GET", "/api/books/", lambda c, r: {"params": {"limit": 100, "after": book_id(c, r)}}),
+        ("books.page.expand", "GET", "/api/books/",
+         lambda c, r: {"params": {"limit": 100, "after": book_id(c, r), "expand": "author"}}),
+        ("books.page.filtered", "GET", "/api/books/",
+         lambda c, r: {"params": {"limit": 100, "genre": r.choice(GENRES[:10]), "year_min": r.randint(1950, 2015),
+                                  "rating_min": 3.5, "after": book_id(c, r)}}),
+        ("books.ids", "GET", "/api/books/",
+         lambda c, r: {"params": {"ids": ",".join(str(book_id(c, r)) for _ in range(50))}}),
+        ("books.detail", "GET", "/api/books/{book_id}", lambda c, r: {"path": {"book_id": book_id(c, r)}}),
+        ("books.similar", "GET", "/api/books/{book_id}/similar",
+         lambda c, r: {"path": {"book_id": book_id(c, r)}, "params": {"k": 10}}),
+        ("authors.page", "GET", "/api/authors/", lambda c, r: {"params": {"limit": 100, "after": author_id(c, r)}}),
+        ("authors.lookup", "GET", "/api/authors/lookup", lambda c, r: {"params": {"name": _misspelled_author(r)}}),
+        ("authors.books", "GET", "/api/authors/{author_id}/books",
+         lambda c, r: {"path": {"author_id": author_id(c, r)}, "params": {"limit": 100}}),
+        ("genres", "GET", "/api/genres/", lambda c, r: {}),
+        ("changes.page", "GET", "/api/changes/",
+         lambda c, r: {"params": {"since": r.randint(c["change_horizon"], c["max_change_seq"]), "limit": 100}}),
+        ("changes.poll", "GET", "/api/changes/", lambda c, r: {"params": {"since": c["max_change_seq"]}}),
+        ("search", "GET", "/api/search/", lambda c, r: {"params": {"q": " ".join(r.sample(WORDS, 2))}}),
+        ("stats.summary", "GET", "/api/stats/summary", lambda c, r: {"params": {"year_min": r.randint(1900, 2020)}}),
+        ("stats.books_by_year", "GET", "/api/stats/books-by-year",
+         lambda c, r: {"params": {"genre": r.choice(GENRES[:20])}}),
+        ("stats.books_by_rating", "GET", "/api/stats/books-by-rating",
+         lambda c, r: {"params": {"bucket": 0.1, "year_min": r.randint(1900, 2020)}}),
+        ("validate_key", "GET", "/api/validate_key/", lambda c, r: {"headers": key}),
+        ("system.pool", "GET", "/api/system/pool", lambda c, r: {}),
+        ("system.cache", "GET", "/api/system/cache", lambda c, r: {}),
+        ("system.snapshot", "GET", "/api/system/snapshot", lambda c, r: {}),
+        ("system.similar", "GET", "/api/system/similar", lambda c, r: {}),
+        ("system.authors", "GET", "/api/system/authors", lambda c, r: {}),
+        ("system.changes", "GET", "/api/system/changes", lambda c, r: {}),
+        ("system.keys", "GET", "/api/system/keys", lambda c, r: {"headers": key}),
+        ("metrics", "GET", "/metrics", lambda c, r: {}),
+        ("openapi", "GET", "/openapi.json", lambda c, r: {}),
+        ("docs", "GET", "/docs", lambda c, r: {}),
+        ("docs.oauth2_redirect", "GET", "/docs/oauth2-redirect", lambda c, r: {}),
+        ("redoc", "GET", "/redoc", lambda c, r: {}),
+        # Writes, in an order where updates and deletes find the rows created before them
+        ("authors.create", "POST", "/api/authors/",
+         lambda c, r: {"headers": key, "json": {"name": f"Driver Author {r.getrandbits(48)}"}}, remember("authors")),
+        ("authors.update", "PUT", "/api/authors/{author_id}",
+         lambda c, r: {"headers": key, "path": {"author_id": r.choice(c["authors"] or [0])},
+                       "json": {"name": f"Driver Author {r.getrandbits(48)}"}}),
+        ("books.create", "POST", "/api/books/",
+         lambda c, r: {"headers": key, "json": _book(r, author_id(c, r), r.getrandbits(48))}, remember("books")),
+        ("books.update", "PUT", "/api/books/{book_id}",
+         lambda c, r: {"headers": key, "path": {"book_id": r.choice(c["books"] or [0])},
+                       "json": _book(r, author_id(c, r), r.getrandbits(48))}),
+        ("books.delete", "DELETE", "/api/books/{book_id}", lambda c, r: {"headers": key, "path": {"book_id": created("books")(c, r)}}),
+        ("authors.delete", "DELETE", "/api/authors/{author_id}",
+         lambda c, r: {"headers": key, "path": {"author_id": created("authors")(c, r)}}),
+        ("books.bulk", "POST", "/api/books/bulk",
+         lambda c, r: {"headers": key, "json": [_book(r, author_id(c, r), r.getrandbits(48)) for _ in range(100)]},
+         remember_bulk("bulk_books")),
+        ("books.bulk_delete", "POST", "/api/books/bulk/delete",
+         lambda c, r: {"headers": key, "json": [created("bulk_books")(c, r) for _ in range(100)]}),
+        ("authors.bulk", "POST", "/api/authors/bulk",
+         lambda c, r: {"headers": key, "json": [{"name": f"Driver Author {r.getrandbits(48)}"} for _ in range(100)]},
+         remember_bulk("bulk_authors")),
+        ("authors.bulk_delete", "POST", "/api/authors/bulk/delete",
+         lambda c, r: {"headers": key, "json": [created("bulk_authors")(c, r) for _ in range(100)]}),
+        ("import", "POST", "/api/import",
+         lambda c, r: {"headers": {**key, "content-type": "application/x-ndjson"}, "params": {"format": "ndjson"},
+                       "content": "".join(json.dumps({**_book(r, None, r.getrandbits(48)), "author": "Driver Import"}) + "\n"
+                                          for _ in range(100))}),
+        # Whole-catalog reads
+        ("books.stream", "GET", "/api/books/", lambda c, r: {"params": {"stream": "ndjson"}}, None, True),
+        ("authors.stream", "GET", "/api/authors/", lambda c, r: {"params": {"stream": "ndjson"}}, None, True),
+        ("export.ndjson", "GET", "/api/export", lambda c, r: {"params": {"format": "ndjson"}}, None, True),
+        ("export.csv", "GET", "/api/export", lambda c, r: {"params": {"format": "csv"}}, None, True),
+        ("export.parquet", "GET", "/api/export", lambda c, r: {"params": {"format": "parquet"}}, None, True),
+    ]
+
+
+# Routes of the app that no scenario covers, so a new endpoint cannot silently go unmeasured
+def uncovered_routes(app, scenario_list):
+    covered = {(method, path) for _, method, path, *_ in scenario_list}
+    missing = []
+    for route in app.routes:
+        for method in sorted(getattr(route, "methods", None) or []):
+            if method != "HEAD" and (method, route.path) not in covered:
+                missing.append(f"{method} {route.path}")
+    return missing
+
+
+async def run_scenario(client, scenario, ctx, requests, concurrency, seed):
+    name, method, path, build, *rest = scenario
+    on_response = rest[0] if rest else None
+    rng = random.Random(f"{seed}-{name}")
+    latencies, statuses = [], {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            options = build(ctx, rng)
+            url = path.format(**options.pop("path", {}))
+            started = time.perf_counter()
+            response = await client.request(method, url, **options)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if on_response is not None:
+                on_response(ctx, response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "method": method,
+        "path": path,
+        "throughput_rps": round(requests / elapsed, 1),
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        **summarize(latencies),
+    }
+
+
+# The similarity index loads in the background on startup. Measuring before it is ready would time 503s and
+# every other route against a build competing for the CPU.
+async def wait_for_similar_index(client, timeout=600):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        stats = (await client.get("/api/system/similar")).json()
+        if stats["loaded"] or not stats["enabled"]:
+            return
+        await asyncio.sleep(0.1)
+    print("The similarity index did not load in time", file=sys.stderr)
+
+
+async def drive(client, ctx, args):
+    await wait_for_similar_index(client)
+    results = {}
+    for scenario in scenarios():
+        name, heavy = scenario[0], len(scenario) > 5 and scenario[5]
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        requests, concurrency = (args.heavy_requests, 1) if heavy else (args.requests, args.concurrency)
+        results[name] = await run_scenario(client, scenario, ctx, requests, concurrency, args.seed)
+        print(f"{name:24} {results[name]['throughput_rps']:>9} req/s  p50 {results[name]['p50_ms']} ms  "
+              f"p99 {results[name]['p99_ms']} ms  {results[name]['statuses']}", file=sys.stderr)
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run_asgi(ctx, args):
+    import httpx
+    from main import app
+    missing = uncovered_routes(app, scenarios())
+    if missing:
+        print(f"Routes without a scenario: {', '.join(missing)}", file=sys.stderr)
+    transport = httpx.ASGITransport(app=app)  # Sends no lifespan events, so run startup and shutdown here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            return await drive(client, ctx, args)
+
+
+async def _run_uvicorn(ctx, args):
+    import httpx
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        cwd=os.getcwd(), env={**os.environ, "PYTHONPATH": REPO_ROOT})
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600, limits=limits) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/openapi.json")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            return await drive(client, ctx, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print per-route changes against an earlier results file
+def compare(baseline, results):
+    for name, result in results["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if not before or not before.get("p50_ms") or not result.get("p50_ms"):
+            continue
+        change = (result["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+        print(f"{name:24} {before['throughput_rps']:>9} -> {result['throughput_rps']:>9} req/s ({change:+.1f}%)  "
+              f"p99 {before['p99_ms']} -> {result['p99_ms']} ms")
+
+
+def main(args):
+    database = os.path.abspath(args.db)
+    if not os.path.isfile(database):
+        sys.exit(f"{database} not found; build one with python -m benchmarks.generate")
+    # Point the app at the database before it is imported; write scenarios modify that database
+    os.environ["DATABASE_URL"] = database
+    os.environ["API_KEYS"] = API_KEY
+    os.environ["API_KEYS_FILE"] = os.path.join(tempfile.mkdtemp(), ".env")  # Only the benchmark key is valid
+    os.environ["WRITE_RATE_LIMIT"] = os.environ["WRITE_RATE_BURST"] = "1000000"
+
+    from database import create_database
+    conn, _ = create_database(database)  # Migrated up front, as the app would on startup, so the change log exists
+    try:
+        max_book_id = conn.execute("SELECT MAX(id) FROM books").fetchone()[0] or 1
+        max_author_id = conn.execute("SELECT MAX(id) FROM authors").fetchone()[0] or 1
+        books = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        change_horizon = conn.execute("SELECT seq FROM changes_horizon WHERE id = 0").fetchone()[0]
+        max_change_seq = max(conn.execute("SELECT MAX(seq) FROM changes").fetchone()[0] or 0, change_horizon)
+    finally:
+        conn.close()
+    ctx = {"max_book_id": max_book_id, "max_author_id": max_author_id, "change_horizon": change_horizon,
+           "max_change_seq": max_change_seq, "books": [], "authors": [], "bulk_books": [], "bulk_authors": []}
+
+    runner = _run_asgi if args.target == "asgi" else _run_uvicorn
+    routes = asyncio.run(runner(ctx, args))
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "target": args.target,
+            "workers": args.workers if args.target == "uvicorn" else None,
+            "books": books,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "routes": routes,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive every route of the API at fixed concurrency")
+    parser.add_argument("--db", default="benchmarks/data/books.db", help="database built by benchmarks.generate")
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi",
+                        help="call the app in-process or through a local uvicorn server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--heavy-requests", type=int, default=2, help="requests per whole-catalog route")
+    parser.add_argument("--only", nargs="+", help="only run scenarios whose name starts with one of these")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON, e.g. benchmarks/results/<name>.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    main(parser.parse_args())
@@ -0,0 +1,19 @@
+# Latency summaries shared by the load, write and per-route benchmarks
+
+
+# The latency at `fraction` of the sorted values, in milliseconds
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 2)
+
+
+# Request count and p50 / p95 / p99 of a list of latencies in seconds
+def summarize(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.latency import summarize
+
+API_KEY = "benchmark-key"
+
+
+# Mixed workload against the app in-process: keyset page reads at random cursors plus bulk writes
+async def _drive(app, books, concurrency, duration, write_ratio, write_size):
+    import httpx
+
+    latencies = {"read": [], "write": []}
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    write_counter = iter(range(10 ** 9))
+
+    async def worker(client):
+        rng = random.Random()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if rng.random() < write_ratio:
+                kind = "write"
+                batch = next(write_counter)
+                payload = [{"title": f"Load {batch}-{i}", "author_id": 1, "book_link": f"load/{batch}/{i}",
+                            "genres": ["Fiction", "Benchmark"], "average_rating": 4.0, "published_year": 2000}
+                           for i in range(write_size)]
+                response = await client.post("/api/books/bulk", json=payload, headers={"api-key": API_KEY})
+            else:
+                kind = "read"
+                response = await client.get("/api/books/", params={"limit": 100, "after": rng.randrange(books)})
+            latencies[kind].append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)  # Errors show up as 500s in the report
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    return {
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 1),
+        "statuses": statuses,
+        "read": summarize(latencies["read"]),
+        "write": summarize(latencies["write"]),
+    }
+
+
+# Run one mode in this process: build a synthetic database, start the app and drive it
+def run_mode(args):
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)  # books.db is resolved relative to the working directory
+    os.environ["API_KEYS"] = API_KEY
+    os.environ["API_KEYS_FILE"] = os.path.join(directory, ".env")  # Use API_KEYS above, not the project .env
+    os.environ["WRITE_RATE_LIMIT"] = os.environ["WRITE_RATE_BURST"] = "1000000"  # Measure the database, not the limiter
+    os.environ["DB_EXECUTOR_SIZE"] = "0" if args.mode == "threadpool" else str(args.executor_size)
+    os.environ["METRICS_ENABLED"] = "1" if args.metrics == "on" else "0"
+
+    from database import bulk_insert, create_database
+    from benchmarks.synthetic import synthetic_records
+    conn, _ = create_database()
+    bulk_insert(conn, synthetic_records(args.books), rebuild_indexes=True)
+    conn.close()
+
+    from main import app
+    result = asyncio.run(_drive(app, args.books, args.concurrency, args.duration, args.write_ratio, args.write_size))
+    return {"mode": args.mode, "metrics": args.metrics, **result}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the async database path against the shared threadpool")
+    parser.add_argument("--mode", choices=["executor", "threadpool", "compare"], default="compare")
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    parser.add_argument("--write-size", type=int, default=200, help="books per bulk write")
+    parser.add_argument("--executor-size", type=int, default=8)
+    parser.add_argument("--metrics", choices=["on", "off"], default="on", help="request and SQL instrumentation")
+    parser.add_argument("--compare", choices=["executor", "metrics"], default="executor",
+                        help="with --mode compare: threadpool vs executor, or instrumentation off vs on")
+    args = parser.parse_args()
+
+    if args.mode != "compare":
+        print(json.dumps(run_mode(args)))
+    else:
+        # Each run uses a fresh interpreter, since the executor and metrics are configured at import time
+        if args.compare == "executor":
+            runs = [("threadpool", args.metrics), ("executor", args.metrics)]
+        else:
+            runs = [("executor", "off"), ("executor", "on")]
+        for mode, instrumentation in runs:
+            options = {**vars(args), "mode": mode, "metrics": instrumentation}
+            options.pop("compare")
+            command = [sys.executable, "-m", "benchmarks.load"] + [
+                f"--{name.replace('_', '-')}={value}" for name, value in options.items()]
+            output = subprocess.run(command, capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    env={**os.environ, "PYTHONPATH": os.getcwd()})
+            print(output.stdout.strip().splitlines()[-1])
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from metrics import InstrumentedConnection, MetricsMiddleware
+from benchmarks.synthetic import synthetic_records
+
+
+# Cost of the SQL instrumentation per statement: a short indexed page read, plain vs instrumented
+def statement_overhead(iterations, path):
+    query = "SELECT id, title FROM books WHERE id > ? ORDER BY id LIMIT 10"
+    results = {}
+    for factory in (sqlite3.Connection, InstrumentedConnection):
+        conn = sqlite3.connect(path, factory=factory)
+        for _ in range(1000):
+            conn.execute(query, (1,)).fetchall()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            conn.execute(query, (1,)).fetchall()
+        results[factory.__name__] = round((time.perf_counter() - started) / iterations * 1e6, 2)
+        conn.close()
+    return {"statement_us": results}
+
+
+# Cost of the middleware per request, around an app that answers immediately
+def middleware_overhead(iterations):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    async def run(handler):
+        scope = {"type": "http", "method": "GET", "path": "/"}
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await handler(dict(scope), receive, send)
+        return round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+    return {"request_us": {"bare": asyncio.run(run(app)), "instrumented": asyncio.run(run(MetricsMiddleware(app)))}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-statement and per-request cost of metrics")
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    from database import bulk_insert, create_database
+    path = os.path.join(tempfile.mkdtemp(), "books.db")
+    conn, _ = create_database(path)
+    bulk_insert(conn, synthetic_records(10_000))
+    conn.close()
+    print({**statement_overhead(args.iterations, path), **middleware_overhead(args.iterations)})
+    print("End to end: python -m benchmarks.load --mode compare --compare metrics")
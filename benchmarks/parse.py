@@ -0,0 +1,43 @@
+import argparse
+import json
+import os
+import time
+from books_scraper import parse_genres, parse_shelf
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Saved pages in the markup the scraper's selectors expect: a 50-book shelf page and a book detail page
+PAGES = {"shelf": ("shelf.html", parse_shelf), "book": ("book.html", parse_genres)}
+
+
+def run(iterations):
+    results = {}
+    for name, (filename, parse) in PAGES.items():
+        with open(os.path.join(FIXTURES, filename), encoding="utf-8") as f:
+            html = f.read()
+        items = len(parse(html))
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            parse(html)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        results[name] = {
+            "bytes": len(html.encode("utf-8")),
+            "items": items,
+            "pages_per_second": round(iterations / sum(timings), 1),
+            "p50_ms": round(timings[len(timings) // 2] * 1000, 2),
+            "p99_ms": round(timings[min(len(timings) - 1, int(0.99 * len(timings)))] * 1000, 2),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scraper's HTML parsing on saved pages")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+    results = run(args.iterations)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,90 @@
+import argparse
+import re
+import sqlite3
+import sys
+from database import LINKED_BOOKS, create_database, name_trigrams, normalize_author_name
+from routers.books import _books_query, select_books
+from routers.filters import BookFilters
+
+# A plan step reading the whole books table (or all of one of its indexes), under its name or an alias. A walk
+# of an id range with no other key counts as well: it checks the filters on every row it passes, so a
+# selective filter reads the whole table from the first page on.
+FULL_SCAN = re.compile(r"^SCAN (books|b)\b"
+                       r"|^SEARCH (books|b) USING INTEGER PRIMARY KEY \(rowid[<>]=?\?( AND rowid[<>]=?\?)?\)$")
+
+# Pages of the unfiltered listing walk the ids by design: every row they read is returned, up to the LIMIT
+ID_WALKS = {"books"}
+
+
+def make_filters(author_id=None, year_min=None, year_max=None, rating_min=None, rating_max=None, genre=None,
+                 genre_match="any"):
+    return BookFilters(author_id, year_min, year_max, rating_min, rating_max, genre, genre_match)
+
+
+# The queries behind the list, lookup and sync endpoints, built with the same code the routers use, as
+# {name: (sql, params)}. Aggregates over the whole catalog scan by design and are left out.
+def hot_queries(conn):
+    author_id = conn.execute("SELECT MIN(id) FROM authors").fetchone()[0] or 1
+    genres = [row[0] for row in conn.execute("SELECT name FROM genres ORDER BY id LIMIT 2")] or ["Fantasy"]
+    queries = {}
+    for name, filters in {
+        "books": make_filters(),
+        "books by author": make_filters(author_id=author_id),
+        "books by year": make_filters(year_min=1990, year_max=1991),
+        "books by rating": make_filters(rating_min=4.5, rating_max=4.6),
+        "books by genre": make_filters(genre=genres[:1]),
+        "books by all genres": make_filters(genre=genres, genre_match="all"),
+    }.items():
+        sql, params = _books_query(conn, 0, filters)
+        queries[name] = (sql + " LIMIT ?", params + [101])
+    queries["books by ids"] = _books_query(conn, None, make_filters(), ids=[1, 2, 3])
+    queries["book"] = (select_books("author") + " WHERE books.id = ?", [1])
+    queries["author books"] = (select_books(None) + " WHERE books.author_id = ? AND books.id > ? "
+                               "ORDER BY books.id LIMIT ?", [author_id, 0, 101])
+    queries["book ids by link"] = ("SELECT book_link, id FROM books WHERE book_link IN (?, ?)" + LINKED_BOOKS,
+                                   ["a", "b"])
+    queries["stats by author"] = ("SELECT COUNT(*), SUM(CAST(average_rating * 1000000 AS INTEGER)), "
+                                  "COUNT(average_rating) FROM books WHERE 1 AND author_id = ?",
+                                  [author_id])
+    queries["stats by year"] = ("SELECT published_year, COUNT(*) FROM books WHERE published_year IS NOT NULL "
+                                "AND published_year >= ? AND published_year <= ? GROUP BY published_year",
+                                [1990, 1991])
+    queries["search"] = ("SELECT f.rowid, b.title FROM books_fts f JOIN books b ON b.id = f.rowid "
+                         "WHERE books_fts MATCH ? ORDER BY bm25(books_fts) LIMIT ?", ['"harry"*', 101])
+    queries["authors by normalized name"] = ("SELECT normalized_name, MIN(id) FROM authors "
+                                             "WHERE normalized_name IN (?) GROUP BY normalized_name",
+                                             [normalize_author_name("J.R.R. Tolkien")])
+    queries["author trigram posting"] = ("SELECT author_id FROM author_trigrams WHERE trigram = ?",
+                                         [sorted(name_trigrams("tolkien"))[0]])
+    queries["changes"] = ("SELECT seq, entity, entity_id, op, changed_at FROM changes WHERE seq > ? "
+                          "ORDER BY seq LIMIT ?", [0, 101])
+    return queries
+
+
+# EXPLAIN QUERY PLAN every hot query: {name: (plan lines, full scans of books)}
+def check_plans(conn):
+    results = {}
+    for name, (sql, params) in hot_queries(conn).items():
+        details = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        results[name] = (details, [detail for detail in details if FULL_SCAN.match(detail) and name not in ID_WALKS])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a hot query's plan reads the whole books table")
+    parser.add_argument("--db", default="books.db", help="database to check (migrated to the current schema first)")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only the regressions")
+    args = parser.parse_args()
+
+    create_database(args.db)[0].close()
+    conn = sqlite3.connect(args.db)
+    failed = 0
+    for name, (details, scans) in check_plans(conn).items():
+        if scans or args.verbose:
+            print(f"{'FAIL' if scans else 'ok'}  {name}")
+            for detail in details:
+                print(f"      {detail}")
+        failed += bool(scans)
+    conn.close()
+    print(f"{failed} of the hot queries read the whole books table" if failed else "No hot query scans books")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from models.book import Book
+from routers.books import BOOK_COLUMNS, rows_to_books
+from routers.caching import _encode_stdlib, encode_json
+
+BOOK_LIST = TypeAdapter(List[Book])
+
+# The whole list built by SQLite itself, in the field order of the Book model. json_group_array does not
+# honour the subquery's ORDER BY, so genres can come out of position order and the body differs.
+SQLITE_JSON = f"""
+    SELECT json_group_array(json_object(
+        'title', title, 'author_id', author_id, 'book_link', book_link,
+        'genres', json((SELECT json_group_array(g.name) FROM book_genres bg JOIN genres g ON g.id = bg.genre_id
+                        WHERE bg.book_id = books.id ORDER BY bg.position)),
+        'average_rating', average_rating, 'published_year', published_year, 'id', id))
+    FROM (SELECT * FROM books ORDER BY id LIMIT ?) books
+"""
+
+
+# What a route with response_model=List[Book] does: validate every element, dump it, run it through
+# jsonable_encoder and encode with the standard library
+def fastapi_response_model(items):
+    books = BOOK_LIST.validate_python(items)
+    return _encode_stdlib(jsonable_encoder(BOOK_LIST.dump_python(books, mode="json")))
+
+
+def pydantic_dump_json(items):
+    return BOOK_LIST.dump_json(BOOK_LIST.validate_python(items))
+
+
+# Every path starts from the dicts rows_to_books builds; building them is timed once, separately
+PATHS = {
+    "response_model": fastapi_response_model,
+    "dicts+json": _encode_stdlib,
+    "dicts+encode_json": encode_json,
+    "pydantic_dump_json": pydantic_dump_json,
+}
+
+
+def run(path, rows_count, repeat):
+    conn = sqlite3.connect(path)
+    query = f"SELECT {BOOK_COLUMNS} FROM books ORDER BY books.id LIMIT ?"
+    rows = conn.execute(query, (rows_count,)).fetchall()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = rows_to_books(conn, rows)
+        timings.append(time.perf_counter() - started)
+    build_ms = round(min(timings) * 1000, 1)
+    reference = fastapi_response_model(items)
+
+    results = {}
+    for name, encode in PATHS.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = encode(items)
+            timings.append(time.perf_counter() - started)
+        results[name] = {"ms": round(min(timings) * 1000, 1), "bytes": len(body), "identical": body == reference}
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = conn.execute(SQLITE_JSON, (rows_count,)).fetchone()[0].encode("utf-8")
+        timings.append(time.perf_counter() - started)
+    # Includes the query and the genre lookups the Python paths get from rows_to_books
+    results["sqlite_json_group_array"] = {"ms": round(min(timings) * 1000, 1), "bytes": len(body),
+                                          "identical": body == reference}
+    conn.close()
+    return {"rows": len(rows), "rows_to_books_ms": build_ms, "paths": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ways of turning book rows into a JSON response body")
+    parser.add_argument("--db", help="database to read (defaults to a generated catalog of --rows books)")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        from benchmarks.generate import generate
+        path = os.path.join(tempfile.mkdtemp(), "books.db")
+        generate(path, args.rows)
+    print(json.dumps(run(path, args.rows, args.repeat), indent=2))
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from routers.caching import DataVersions
+from routers.similar import SimilarityIndex
+
+
+def _percentile(timings, fraction):
+    return round(timings[min(len(timings) - 1, int(fraction * len(timings)))] * 1000, 3)
+
+
+def _wait(index):
+    while index.stats()["rebuilding"]:
+        time.sleep(0.05)
+    if not index.stats()["loaded"]:
+        raise SystemExit("the similarity index failed to load")
+
+
+# Build, save and reload the index, then time queries for random books and compare their results with an
+# exhaustive scan of the catalog (recall: share of the exact top-k similarity scores the index returned)
+def run(path, queries, k, seed):
+    index_path = os.path.join(tempfile.mkdtemp(), "books.similar.npz")  # Leave any index saved beside --db alone
+    index = SimilarityIndex(path, DataVersions(path))
+    index.index_path = index_path
+    index.refresh()
+    _wait(index)
+    reloaded = SimilarityIndex(path, index.versions)
+    reloaded.index_path = index_path
+    started = time.perf_counter()
+    reloaded.refresh()
+    _wait(reloaded)
+    load_seconds = time.perf_counter() - started
+
+    conn = sqlite3.connect(path)
+    max_id = conn.execute("SELECT MAX(id) FROM books").fetchone()[0]
+    rng = random.Random(seed)
+    timings, found, expected = [], 0, 0
+    for _ in range(queries):
+        book_id = rng.randint(1, max_id)
+        book = conn.execute("SELECT average_rating, published_year FROM books WHERE id = ?", (book_id,)).fetchone()
+        if book is None:
+            continue
+        genres = [row[0] for row in conn.execute("SELECT genre_id FROM book_genres WHERE book_id = ?", (book_id,))]
+        started = time.perf_counter()
+        ranked, _ = reloaded.similar(book_id, genres, book[0], book[1], k)
+        timings.append(time.perf_counter() - started)
+
+        with reloaded._lock:
+            query = np.unique(np.array(genres, dtype=np.int64))
+            positions = np.flatnonzero(reloaded._alive[:reloaded._size] & (reloaded._ids[:reloaded._size] != book_id))
+            scores = reloaded._jaccard(positions, query)
+            exact = sorted(scores[scores > 0].tolist(), reverse=True)[:k]
+        returned = [score for _, score in ranked]
+        found += sum(min(returned.count(score), exact.count(score)) for score in set(exact))
+        expected += len(exact)
+    conn.close()
+
+    timings.sort()
+    stats = reloaded.stats()
+    return {
+        "build_seconds": index.stats()["build_seconds"],
+        "load_seconds": round(load_seconds, 3),
+        "file_bytes": stats["file_bytes"],
+        "memory_bytes": stats["bytes"],
+        "queries": len(timings),
+        "p50_ms": _percentile(timings, 0.5),
+        "p99_ms": _percentile(timings, 0.99),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "full_scans": stats["scans"],
+        "recall": round(found / expected, 4) if expected else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the similar-books index and measure its queries")
+    parser.add_argument("--db", help="database to read (defaults to a generated catalog of --books books)")
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        from benchmarks.generate import generate
+        path = os.path.join(tempfile.mkdtemp(), "books.db")
+        generate(path, args.books)
+    else:
+        from database import create_database
+        create_database(path)[0].close()  # Bring an older database up to the current schema
+    print(json.dumps(run(path, args.queries, args.k, args.seed), indent=2))
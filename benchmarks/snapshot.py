@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from routers import stats
+from routers import snapshot
+from routers.caching import DataVersions
+from routers.filters import BookFilters
+from routers.snapshot import CatalogSnapshot
+
+# Filter combinations the visualizations dashboard sends, from the unfiltered catalog to a single author
+SCENARIOS = {
+    "all": {},
+    "years": {"year_min": 1950, "year_max": 2000},
+    "years+ratings": {"year_min": 1950, "year_max": 2000, "rating_min": 3.5, "rating_max": 4.5},
+    "genre": {"genre": ["Fantasy"]},
+    "genres_all": {"genre": ["Fantasy", "Romance"], "genre_match": "all"},
+    "author": {"author_id": 7},
+}
+QUERIES = {
+    "summary": lambda conn, filters: stats._summary(conn, filters),
+    "books-by-year": lambda conn, filters: stats._books_by_year(conn, filters),
+    "books-by-rating": lambda conn, filters: stats._books_by_rating(conn, filters, 0.1),
+}
+
+
+def make_filters(author_id=None, year_min=None, year_max=None, rating_min=None, rating_max=None, genre=None,
+                 genre_match="any"):
+    return BookFilters(author_id, year_min, year_max, rating_min, rating_max, genre, genre_match)
+
+
+def _median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return round(timings[len(timings) // 2] * 1000, 3)
+
+
+def run(path, repeat):
+    catalog = CatalogSnapshot(path, DataVersions(path))
+    snapshot.catalog_snapshot = stats.catalog_snapshot = catalog
+    catalog.refresh()
+    while catalog.stats()["rebuilding"]:
+        time.sleep(0.05)
+    if not catalog.stats()["loaded"]:
+        raise SystemExit("the snapshot failed to load")
+
+    conn = sqlite3.connect(path)
+    results = {}
+    for scenario, params in SCENARIOS.items():
+        filters = make_filters(**params)
+        for name, query in QUERIES.items():
+            with_snapshot = _median_ms(lambda: query(conn, filters), repeat)
+            snapshot.SNAPSHOT_ENABLED = False
+            sql = _median_ms(lambda: query(conn, filters), max(1, repeat // 10))
+            snapshot.SNAPSHOT_ENABLED = True
+            results[f"{scenario} {name}"] = {"snapshot_ms": with_snapshot, "sqlite_ms": sql}
+    conn.close()
+    return {"snapshot": catalog.stats(), "queries": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the columnar snapshot with SQLite on the statistics queries")
+    parser.add_argument("--db", help="database to read (defaults to a generated catalog of --books books)")
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        from benchmarks.generate import generate
+        path = os.path.join(tempfile.mkdtemp(), "books.db")
+        generate(path, args.books)
+    else:
+        from database import create_database
+        create_database(path)[0].close()  # Bring an older database up to the current schema
+    print(json.dumps(run(path, args.repeat), indent=2))
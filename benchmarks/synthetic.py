@@ -0,0 +1,55 @@
+import random
+
+# A realistic spread of genre names; popularity falls off with the position in this list
+GENRES = [
+    "Fiction", "Fantasy", "Young Adult", "Classics", "Romance", "Science Fiction", "Mystery", "Thriller",
+    "Historical Fiction", "Audiobook", "Contemporary", "Literature", "Adventure", "Novels", "Horror",
+    "Nonfiction", "Paranormal", "Magic", "Dystopia", "Humor", "Childrens", "Middle Grade", "Suspense",
+    "Crime", "Biography", "Memoir", "History", "Philosophy", "Poetry", "Drama", "Short Stories",
+    "Graphic Novels", "Comics", "Teen", "Post Apocalyptic", "Mystery Thriller", "Historical", "War",
+    "Self Help", "Psychology", "Science", "Travel", "Sports", "Music", "Art", "Religion", "Spirituality",
+    "Business", "Economics", "Politics", "Cookbooks", "Chick Lit", "Urban Fantasy", "Epic Fantasy",
+    "High Fantasy", "Space Opera", "Cyberpunk", "Steampunk", "Gothic", "Westerns",
+]
+WORDS = [
+    "shadow", "night", "king", "queen", "fire", "winter", "house", "secret", "garden", "river", "storm",
+    "crown", "blood", "star", "city", "war", "heart", "stone", "glass", "wind", "road", "island", "song",
+    "game", "light", "dark", "silent", "last", "lost", "golden", "broken", "hidden", "wild", "iron",
+]
+FIRST_NAMES = ["Anna", "John", "Maria", "James", "Li", "Amara", "Sofia", "Omar", "Yuki", "Elena", "Noah",
+               "Priya", "Lucas", "Zoe", "Ivan", "Chen", "Leila", "Mateo", "Grace", "Kofi"]
+LAST_NAMES = ["Smith", "Garcia", "Okafor", "Tanaka", "Novak", "Kowalski", "Haddad", "Silva", "Nguyen",
+              "Fischer", "Rossi", "Khan", "Dubois", "Larsen", "Moreau", "Ivanova", "Park", "Mensah"]
+
+
+# Zipf-like weights: a few authors write many books and a few genres tag most of them
+def _zipf_weights(n, s=1.1):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def author_names(count, rng):
+    names = []
+    for i in range(count):
+        names.append(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}")
+    return names
+
+
+# Yield `books` bulk-loader records (see database.bulk_insert) with deterministic content for a seed
+def synthetic_records(books, authors=None, seed=42):
+    rng = random.Random(seed)
+    authors = author_names(authors or max(1, books // 8), rng)
+    author_weights = _zipf_weights(len(authors))
+    genre_weights = _zipf_weights(len(GENRES), s=0.9)
+    author_picks = rng.choices(authors, weights=author_weights, k=books)
+
+    for i in range(books):
+        genre_count = rng.randint(3, 8)
+        genres = list(dict.fromkeys(rng.choices(GENRES, weights=genre_weights, k=genre_count)))
+        yield {
+            "title": " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5))),
+            "author": author_picks[i],
+            "book_link": f"https://example.org/book/show/{i}",
+            "genres": genres,
+            "average_rating": round(min(5.0, max(1.0, rng.gauss(3.95, 0.35))), 2),
+            "published_year": int(min(2024, max(1800, rng.gauss(2005, 18)))),
+        }
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from benchmarks.latency import summarize
+
+
+def _insert(conn, writer, sequence):
+    from database import set_book_genres
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO books (title, author_id, book_link, average_rating, published_year) "
+                   "VALUES (?, 1, ?, 4.0, 2000)", (f"Write {writer}-{sequence}", f"write/{writer}/{sequence}"))
+    set_book_genres(cursor, cursor.lastrowid, ["Fiction", "Benchmark"])
+
+
+# Every writer has its own connection and commits each write on its own, as the handlers used to
+def _run_direct(writers, writes):
+    from database import _open_pooled_connection
+    latencies, errors = [], []
+
+    def writer(number):
+        conn = _open_pooled_connection()
+        for sequence in range(writes):
+            started = time.perf_counter()
+            try:
+                _insert(conn, number, sequence)
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+        conn.close()
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, errors, writers * writes - len(errors)
+
+
+# Every writer awaits its own write on a shared group-commit queue
+def _run_queue(writers, writes, max_batch, linger):
+    from database import WriteQueue
+    write_queue = WriteQueue(max_batch=max_batch, linger=linger)
+    latencies, errors = [], []
+
+    async def writer(number):
+        for sequence in range(writes):
+            started = time.perf_counter()
+            try:
+                await write_queue.write(_insert, number, sequence)
+            except sqlite3.Error as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    async def main():
+        await asyncio.gather(*(writer(number) for number in range(writers)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    write_queue.close()
+    return elapsed, latencies, errors, write_queue.stats()["transactions"]
+
+
+def run(mode, writers, writes, max_batch, linger):
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)  # Pooled connections open books.db in the working directory
+    from database import create_database
+    conn, cursor = create_database()
+    cursor.execute("INSERT INTO authors (name) VALUES ('Benchmark Author')")
+    conn.commit()
+    conn.close()
+
+    if mode == "direct":
+        elapsed, latencies, errors, transactions = _run_direct(writers, writes)
+    else:
+        elapsed, latencies, errors, transactions = _run_queue(writers, writes, max_batch, linger)
+    return {
+        "mode": mode,
+        "writers": writers,
+        "writes_per_second": round(len(latencies) / elapsed, 1),
+        "transactions": transactions,
+        "errors": len(errors),
+        **{key: value for key, value in summarize(latencies).items() if key != "requests"},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark N concurrent writers: one commit per write vs group commit")
+    parser.add_argument("--mode", choices=["direct", "queue", "both"], default="both")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--writes", type=int, default=200, help="writes per writer")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--linger", type=float, default=0.0)
+    parser.add_argument("--synchronous", choices=["OFF", "NORMAL", "FULL"], default="NORMAL")
+    args = parser.parse_args()
+
+    os.environ["DB_SYNCHRONOUS"] = args.synchronous  # Read when database.py is first imported
+    modes = ["direct", "queue"] if args.mode == "both" else [args.mode]
+    for writers in args.writers:
+        for mode in modes:
+            print(run(mode, writers, args.writes, args.max_batch, args.linger))
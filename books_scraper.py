@@ -1,19 +1,265 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlparse
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from database import normalize_author_name
+from ratelimit import TokenBucket
 
-books_dict = {}
-authors = []
+BASE_URL = "https://www.goodreads.com"
+SHELF_URL = f"{BASE_URL}/shelf/show/popular"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/58.0.3029.110 Safari/537.3"
+}
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
-def scrape_books():
-    url = "https://www.goodreads.com/shelf/show/popular"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-                      "Chrome/58.0.3029.110 Safari/537.3"
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()  # Raise an exception if the request failed
-    soup = BeautifulSoup(response.text, 'html.parser')
+# Directory for cached responses and the file recording crawl progress, overridable through the environment
+SCRAPE_CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR", ".scrape_cache")
+SCRAPE_CHECKPOINT = os.getenv("SCRAPE_CHECKPOINT", ".scrape_checkpoint.json")
+
+
+# Write a JSON document atomically, so an interrupted run never leaves a truncated file behind
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# On-disk HTTP response cache. Each URL maps to a body file plus a metadata file holding the
+# ETag / Last-Modified validators and the time the response was last confirmed fresh.
+class HttpCache:
+    def __init__(self, directory=SCRAPE_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.html")
+
+    def meta(self, url):
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def body(self, url):
+        _, body_path = self._paths(url)
+        with open(body_path, encoding="utf-8") as f:
+            return f.read()
+
+    # Seconds since the cached response was fetched or revalidated, None when the URL is not cached
+    def age(self, url):
+        meta = self.meta(url)
+        return time.time() - meta["fetched_at"] if meta else None
+
+    # Conditional request headers for a cached URL
+    def validators(self, url):
+        meta = self.meta(url) or {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url, response):
+        meta_path, body_path = self._paths(url)
+        with open(body_path, "w", encoding="utf-8") as f:
+            f.write(response.text)
+        _write_json(meta_path, {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        })
+
+    # Record that the server confirmed the cached copy is still current (304 Not Modified)
+    def touch(self, url):
+        meta_path, _ = self._paths(url)
+        meta = self.meta(url)
+        meta["fetched_at"] = time.time()
+        _write_json(meta_path, meta)
+
+
+# Progress of an interrupted crawl: the parsed shelf and the genres of every detail page done so far
+class Checkpoint:
+    def __init__(self, path=SCRAPE_CHECKPOINT, save_every=20):
+        self.path = path
+        self.save_every = save_every
+        self.entries = None
+        self.genres = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("entries")
+            self.genres = data.get("genres", {})
+
+    def save(self):
+        with self._lock:
+            _write_json(self.path, {"entries": self.entries, "genres": self.genres})
+            self._pending = 0
+
+    def set_entries(self, entries):
+        self.entries = entries
+        self.save()
+
+    def record(self, link, genres):
+        with self._lock:
+            self.genres[link] = genres
+            self._pending += 1
+            due = self._pending >= self.save_every
+        if due:
+            self.save()
+
+    # Forget the progress once the crawl has been written to the database
+    def clear(self):
+        self.entries, self.genres = None, {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Counters for a crawl, reported as pages/sec and total wall time
+class FetchStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.pages = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "errors": self.errors,
+            "not_modified": self.not_modified,
+            "skipped": self.skipped,
+            "wall_time_seconds": round(elapsed, 3),
+            "pages_per_second": round(self.pages / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+# Concurrent page fetcher: one keep-alive session shared by a bounded thread pool, a per-host
+# concurrency cap, a token-bucket rate limit and retries with jittered exponential backoff
+class Fetcher:
+    def __init__(self, max_workers=8, per_host=4, rate=4.0, burst=4, retries=3, backoff=0.5,
+                 timeout=(5, 30), session=None, cache=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.bucket = TokenBucket(rate, burst)
+        self.stats = FetchStats()
+        self.session = session or requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _backoff_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        # Full jitter: a random delay up to the exponential cap, so retries from many workers spread out
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    # Fetch a single page. Returns the response; raises after the last failed attempt.
+    def fetch(self, url, headers=None):
+        slot = self._host_slot(url)
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            response = None
+            try:
+                with slot:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    self.stats.record(pages=1, bytes=len(response.content))
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    self.stats.record(errors=1)
+                    raise
+            if attempt == self.retries:
+                self.stats.record(errors=1)
+                response.raise_for_status()
+            self.stats.record(retries=1)
+            time.sleep(self._backoff_delay(attempt, response))
+
+    # Fetch a page body, revalidating a cached copy with If-None-Match / If-Modified-Since when possible
+    def get(self, url):
+        if self.cache is None:
+            return self.fetch(url).text
+        response = self.fetch(url, headers=self.cache.validators(url))
+        if response.status_code == 304:
+            self.stats.record(not_modified=1)
+            self.cache.touch(url)
+            return self.cache.body(url)
+        self.cache.store(url, response)
+        return response.text
+
+    # Fetch many pages concurrently. Returns {url: html}, with the exception in place of pages that failed.
+    # on_result(url, html_or_exception) is called as each page completes.
+    def get_many(self, urls, on_result=None):
+        def fetch_one(url):
+            try:
+                return self.get(url)
+            except requests.RequestException as e:
+                return e
+
+        pages = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(fetch_one, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                pages[url] = future.result()
+                if on_result is not None:
+                    on_result(url, pages[url])
+        return pages
+
+    def close(self):
+        self.session.close()
+
+
+# Parse the shelf page into one entry per book: title, author, absolute link, rating and year strings
+def parse_shelf(html, base_url=BASE_URL):
+    soup = BeautifulSoup(html, 'html.parser')
+    entries = []
 
     # Iterate over all book divs and collect titles, authors, and links
     for book_div in soup.find_all('div', class_='elementList'):
@@ -22,9 +268,6 @@ def scrape_books():
         info_tag = book_div.find('span', class_='greyText smallText')
 
         if title_tag and author_tag:
-            title = title_tag.text.strip()
-            author = author_tag.text.strip()
-            full_link = f"https://www.goodreads.com{title_tag['href']}"
             avg_rating, published = None, None
 
             if info_tag:
@@ -36,20 +279,75 @@ def scrape_books():
                     elif part.startswith('published'):
                         published = part.split('published')[-1].strip()
 
-            genre_response = requests.get(full_link, headers=headers)
-            genre_soup = BeautifulSoup(genre_response.text, 'html.parser')
-            genres = [genre.get_text(strip=True) for genre in
-                      genre_soup.find_all('span', class_='BookPageMetadataSection__genreButton')]
-
-            books_dict[(title, author)] = {
-                "link": full_link,
-                "genres": genres,
+            entries.append({
+                "title": title_tag.text.strip(),
+                "author": author_tag.text.strip(),
+                "link": urljoin(base_url, title_tag['href']),
                 "avg_rating": avg_rating,
                 "published": published
-            }
-            if author not in authors:
-                authors.append(author)
-    return books_dict, authors
+            })
+    return entries
+
+
+# Parse the genre names from a book detail page
+def parse_genres(html):
+    genre_soup = BeautifulSoup(html, 'html.parser')
+    return [genre.get_text(strip=True) for genre in
+            genre_soup.find_all('span', class_='BookPageMetadataSection__genreButton')]
+
+
+# Scrape the shelf and the genres of every book on it.
+# In incremental mode (known_links given, usually the book_links already in books.db) detail pages whose
+# cached copy is younger than max_age seconds are not fetched at all; their genres come back as None,
+# meaning "unchanged". A checkpoint lets an interrupted crawl resume with the pages it already has.
+def scrape_books(fetcher=None, shelf_url=SHELF_URL, known_links=None, max_age=7 * 24 * 3600, checkpoint=None):
+    books_dict = {}
+    authors = {}  # Normalized name -> first spelling seen, which every other spelling of the author is stored as
+    fetcher = fetcher or Fetcher()
+
+    if checkpoint is not None and checkpoint.entries is not None:
+        entries = checkpoint.entries
+    else:
+        entries = parse_shelf(fetcher.get(shelf_url), base_url=shelf_url)
+        if checkpoint is not None:
+            checkpoint.set_entries(entries)
+
+    genres_by_link = dict(checkpoint.genres) if checkpoint is not None else {}
+    to_fetch = []
+    for entry in entries:
+        link = entry["link"]
+        if link in genres_by_link:
+            continue
+        if known_links is not None and link in known_links and fetcher.cache is not None:
+            age = fetcher.cache.age(link)
+            if age is not None and age < max_age:
+                genres_by_link[link] = None
+                fetcher.stats.record(skipped=1)
+                continue
+        to_fetch.append(link)
+
+    def on_result(link, page):
+        if not isinstance(page, Exception):
+            genres_by_link[link] = parse_genres(page)
+            if checkpoint is not None:
+                checkpoint.record(link, genres_by_link[link])
+
+    fetcher.get_many(to_fetch, on_result=on_result)
+    if checkpoint is not None:
+        checkpoint.save()
+
+    for entry in entries:
+        author = authors.setdefault(normalize_author_name(entry["author"]) or entry["author"], entry["author"])
+        books_dict[(entry["title"], author)] = {
+            "link": entry["link"],
+            "genres": genres_by_link.get(entry["link"]),  # None when unchanged or the page failed
+            "avg_rating": entry["avg_rating"],
+            "published": entry["published"]
+        }
+
+    print(f"Scrape finished: {fetcher.stats.summary()}")
+    return books_dict, list(authors.values())
 
 
-print(scrape_books())
+if __name__ == "__main__":
+    print(scrape_books())
@@ -1,18 +1,553 @@
+import asyncio
+import json
+import math
+import os
+import queue
 import sqlite3
+import threading
+import time
+import unicodedata
+import urllib.parse
+import weakref
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from dotenv import load_dotenv
 
+try:
+    import numpy as np
+except ImportError:  # Optional: fuzzy author lookups then go to SQLite every time
+    np = None
 
-# Function to establish a connection to the SQLite database
-def get_db_connection():
-    conn = sqlite3.connect('books.db')
-    conn.row_factory = sqlite3.Row  # This allows the rows returned to behave like dictionaries
+load_dotenv()
+
+# Where the data lives and how it is opened:
+#   rw:       the file at DATABASE_URL, read and written (default)
+#   snapshot: the file at DATABASE_URL opened read-only and immutable, for read replicas serving a file made with
+#             `python database.py snapshot`: no locks, no WAL, pages read straight from the memory-mapped file.
+#             Writes are refused with DatabaseReadOnly.
+#   memory:   a shared-cache in-memory database for tests and benchmarks, seeded from DATABASE_URL when that file
+#             exists; nothing is written back to it
+DATABASE_URL = os.getenv("DATABASE_URL", "books.db")
+DB_MODE = os.getenv("DB_MODE", "rw")
+if DB_MODE not in ("rw", "snapshot", "memory"):
+    raise ValueError(f"DB_MODE must be rw, snapshot or memory, not {DB_MODE!r}")
+# Bytes of a snapshot mapped into memory; SQLite caps it at its compile-time maximum (2 GiB unless raised)
+DB_SNAPSHOT_MMAP_SIZE = int(os.getenv("DB_SNAPSHOT_MMAP_SIZE", str(1 << 40)))
+
+# Tuning knobs for pooled connections, overridable through the environment / .env
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))  # Negative values are KiB, positive values are pages
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # FULL fsyncs on every commit, NORMAL only at checkpoints
+# Threads dedicated to database work (0 falls back to the shared anyio threadpool) and how many more
+# jobs may wait for one before requests are turned away with 503
+DB_EXECUTOR_SIZE = int(os.getenv("DB_EXECUTOR_SIZE", str(DB_POOL_SIZE)))
+DB_EXECUTOR_QUEUE = int(os.getenv("DB_EXECUTOR_QUEUE", "64"))
+DB_RETRY_AFTER = int(os.getenv("DB_RETRY_AFTER", "1"))
+# Streaming responses (?stream= lists, exports) read from one cursor for as long as the client takes to download
+# them, so instead of pooled connections they get connections of their own, at most DB_STREAM_LIMIT at a time
+DB_STREAM_LIMIT = int(os.getenv("DB_STREAM_LIMIT", "4"))
+# Group commit: at most DB_WRITE_BATCH queued writes share one transaction, and the writer waits up to
+# DB_WRITE_LINGER seconds for more to arrive before committing (by default it only takes what queued up
+# during the previous commit). DB_WRITE_QUEUE bounds the backlog.
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "256"))
+DB_WRITE_LINGER = float(os.getenv("DB_WRITE_LINGER", "0"))
+DB_WRITE_QUEUE = int(os.getenv("DB_WRITE_QUEUE", "1024"))
+# Trigram similarity (0-1) an existing author needs for /api/authors/lookup to return it by default, and for
+# the ingest path to reuse it for a name it has not seen; 1 only reuses authors whose normalized name is equal
+AUTHOR_LOOKUP_SIMILARITY = float(os.getenv("AUTHOR_LOOKUP_SIMILARITY", "0.3"))
+INGEST_AUTHOR_SIMILARITY = float(os.getenv("INGEST_AUTHOR_SIMILARITY", "1"))
+# Seconds a delete stays in the change feed before compaction may drop it (0 keeps tombstones forever)
+CHANGES_RETENTION = float(os.getenv("CHANGES_RETENTION", str(7 * 24 * 3600)))
+
+
+# In-memory databases by name, each held open by one connection for the life of the process: SQLite drops a
+# shared-cache memory database as soon as its last connection closes
+_memory_databases = {}
+_memory_lock = threading.Lock()
+
+
+def _memory_uri(path):
+    name = os.path.splitext(os.path.basename(path))[0] or "books"
+    return f"file:{name}?mode=memory&cache=shared"
+
+
+def _memory_database(path):
+    with _memory_lock:
+        if path not in _memory_databases:
+            keeper = sqlite3.connect(_memory_uri(path), uri=True, check_same_thread=False)
+            if os.path.exists(path):
+                source = sqlite3.connect(path)
+                try:
+                    source.backup(keeper)
+                finally:
+                    source.close()
+            _memory_databases[path] = keeper
+    return _memory_uri(path)
+
+
+# Open a connection to the database at `path` (default DATABASE_URL) in `mode` (default DB_MODE); keyword
+# arguments go to sqlite3.connect. Every connection of the app, including the ones the in-memory indexes load
+# from, is opened here.
+def connect(path=None, mode=None, **kwargs):
+    path = path or DATABASE_URL
+    mode = mode or DB_MODE
+    if mode == "memory":
+        conn = sqlite3.connect(_memory_database(path), uri=True, **kwargs)
+        # Shared-cache connections lock whole tables against each other; let readers see uncommitted rows
+        # instead of failing with "database table is locked" while the writer is in a transaction
+        conn.execute("PRAGMA read_uncommitted=ON")
+    elif mode == "snapshot":
+        uri = f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, **kwargs)
+        conn.execute(f"PRAGMA mmap_size={DB_SNAPSHOT_MMAP_SIZE}")
+    else:
+        conn = sqlite3.connect(path, uri=path.startswith("file:"), **kwargs)
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
 
-def create_database():
-    # Set up the SQLite database
-    conn = sqlite3.connect('books.db')
-    cursor = conn.cursor()
+# Connection class of the pooled, stream and writer connections. Plain sqlite3 connections unless the app
+# installs another one, e.g. main.py installs metrics' instrumented connection when metrics are enabled.
+_connection_factory = sqlite3.Connection
+
+
+def set_connection_factory(factory):
+    global _connection_factory
+    _connection_factory = factory
+
+
+# Open a long-lived connection tuned for concurrent readers and a single writer
+def _open_pooled_connection():
+    conn = connect(
+        timeout=DB_POOL_TIMEOUT,
+        check_same_thread=False,  # Pooled connections are handed to whichever worker thread needs one
+        cached_statements=DB_STATEMENT_CACHE_SIZE,  # Prepared statements survive between requests
+        factory=_connection_factory,
+    )
+    conn.row_factory = sqlite3.Row
+    if DB_MODE == "rw":
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+# Bounded pool of reusable SQLite connections. Connections are created lazily up to `size`;
+# once all of them are checked out, callers block for up to `timeout` seconds for one to come back.
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO keeps the hottest page caches in use
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checked_out = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = _open_pooled_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise DatabaseBusy()  # 503 with Retry-After, like a saturated executor
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_time += time.perf_counter() - started
+        with self._lock:
+            self._checked_out += 1
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()  # Never hand a half-finished transaction to the next request
+        with self._lock:
+            self._checked_out -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.execute("PRAGMA optimize")  # Refresh planner statistics the queries run here would use
+            except sqlite3.Error:
+                pass
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "database": DATABASE_URL,
+                "mode": DB_MODE,
+                "size": self.size,
+                "created": self._created,
+                "checked_out": self._checked_out,
+                "idle": self._idle.qsize(),
+                "waits": self._waits,
+                "wait_time_seconds": round(self._wait_time, 6),
+            }
+
+
+pool = ConnectionPool()
+
+
+# A connection held by one streaming response. Closing it (also by leaving `with`) gives its slot back; so does
+# garbage collection, for a response whose body was never iterated.
+class StreamConnection:
+    def __init__(self, conn, release):
+        self.conn = conn
+        self._close = weakref.finalize(self, _close_stream, conn, release)
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _close_stream(conn, release):
+    try:
+        conn.close()
+    finally:
+        release()
+
+
+# Hands out stream connections, refusing with DatabaseBusy (503) once DB_STREAM_LIMIT are open, so slow
+# downloads can only hold up other downloads and never the pool every other request depends on
+class StreamConnections:
+    def __init__(self, limit=DB_STREAM_LIMIT):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._open = 0
+        self._opened = 0
+        self._rejected = 0
+
+    def open(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise DatabaseBusy()
+        try:
+            conn = _open_pooled_connection()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._open += 1
+            self._opened += 1
+        return StreamConnection(conn, self._release)
+
+    def _release(self):
+        with self._lock:
+            self._open -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "open": self._open, "opened": self._opened, "rejected": self._rejected}
+
+
+stream_connections = StreamConnections()
+
+
+# Raised when the database executor already has as many jobs running and queued as it accepts
+class DatabaseBusy(Exception):
+    def __init__(self, retry_after=DB_RETRY_AFTER):
+        super().__init__("Database is saturated, retry later")
+        self.retry_after = retry_after
+
+
+# Raised for writes when the database is a read-only snapshot (DB_MODE=snapshot)
+class DatabaseReadOnly(Exception):
+    def __init__(self):
+        super().__init__("This server answers from a read-only snapshot of the database; writes are not accepted")
+
+
+# Runs blocking sqlite3 work for async handlers on a dedicated, bounded set of threads, so database
+# calls never compete with the rest of the app for the shared threadpool. Jobs beyond
+# `workers + max_queue` are rejected immediately with DatabaseBusy instead of piling up.
+# This is how routers reach the pool, rather than a FastAPI dependency yielding a connection: such a
+# connection stays checked out for the whole request, awaits and response encoding included, and its
+# queries would run on the event loop thread of the async handlers.
+class DatabaseExecutor:
+    def __init__(self, workers=DB_EXECUTOR_SIZE, max_queue=DB_EXECUTOR_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db") if workers else None
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._in_flight = 0
+        self._queue_time = 0.0
+
+    def _timed(self, submitted_at, fn, args):
+        with self._lock:
+            self._queue_time += time.perf_counter() - submitted_at
+        return fn(*args)
+
+    def _done(self, _):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    # Run fn(*args) on a database thread and await its result
+    async def call(self, fn, *args):
+        if self._executor is None:
+            from starlette.concurrency import run_in_threadpool
+            return await run_in_threadpool(fn, *args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise DatabaseBusy()
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+        future = self._executor.submit(self._timed, time.perf_counter(), fn, args)
+        # Released when the job finishes or is cancelled, even if the awaiting request went away
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    # Run fn(conn, *args) with a pooled connection on a database thread
+    async def run(self, fn, *args):
+        return await self.call(_with_connection, fn, args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "queue_time_seconds": round(self._queue_time, 6),
+            }
+
+
+def _with_connection(fn, args):
+    with pool.connection() as conn:
+        return fn(conn, *args)
+
+
+_EXHAUSTED = object()
+
+
+# Drive a blocking generator (e.g. one reading from a cursor) from async code, one step per executor job
+async def iterate_in_db(generator):
+    try:
+        while True:
+            item = await db_executor.call(next, generator, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                break
+            yield item
+    finally:
+        try:
+            await db_executor.call(generator.close)
+        except DatabaseBusy:
+            generator.close()  # Only closes the stream's connection; not worth failing over
+
+
+db_executor = DatabaseExecutor()
+
+
+_STOP = object()
+
+
+# Single writer per process with group commit. Mutations are queued and applied by one thread on its
+# own connection: it takes the write lock once (BEGIN IMMEDIATE), runs each queued job in a savepoint
+# and commits the whole group together. A job that raises is rolled back on its own and its caller gets
+# the exception, while the rest of the group still commits. Across worker processes, the SQLite write
+# lock and busy timeout serialize the writers; each one commits whole groups rather than single rows.
+class WriteQueue:
+    def __init__(self, max_batch=DB_WRITE_BATCH, linger=DB_WRITE_LINGER, max_pending=DB_WRITE_QUEUE):
+        self.max_batch = max_batch
+        self.linger = linger
+        self._jobs = queue.Queue(max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._transactions = 0
+        self._writes = 0
+        self._failed = 0
+        self._largest_batch = 0
+        self._commit_time = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    # Queue fn(conn, *args) and await its own result. fn must not commit; the writer does.
+    async def write(self, fn, *args):
+        if DB_MODE == "snapshot":
+            raise DatabaseReadOnly()
+        if self._thread is None:
+            self._start()
+        future = Future()
+        try:
+            self._jobs.put_nowait((fn, args, future))
+        except queue.Full:
+            raise DatabaseBusy()
+        return await asyncio.wrap_future(future)
 
+    # Block for the first job, then gather whatever else arrives within the linger time
+    def _collect(self):
+        job = self._jobs.get()
+        if job is _STOP:
+            return None
+        batch = [job]
+        deadline = time.perf_counter() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                job = self._jobs.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if job is _STOP:
+                self._jobs.put(job)  # Stop after committing this batch
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = _open_pooled_connection()
+        conn.isolation_level = None  # Transactions are managed explicitly below
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    break
+                self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    def _apply(self, conn, batch):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue  # The caller went away before its turn
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    outcomes.append((future, True, fn(conn, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    outcomes.append((future, False, e))
+                conn.execute("RELEASE write_job")
+            conn.execute("COMMIT")
+        except Exception as e:
+            # The lock could not be taken or the commit failed: nothing in the group was written
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(future, False, e) for _, _, future in batch if not future.cancelled()]
+        with self._lock:
+            self._transactions += 1
+            self._writes += len(outcomes)
+            self._failed += sum(1 for _, ok, _ in outcomes if not ok)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._commit_time += time.perf_counter() - started
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        if self._thread is not None:
+            self._jobs.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "linger_seconds": self.linger,
+                "pending": self._jobs.qsize(),
+                "transactions": self._transactions,
+                "writes": self._writes,
+                "failed": self._failed,
+                "largest_batch": self._largest_batch,
+                "commit_time_seconds": round(self._commit_time, 6),
+            }
+
+
+db_writer = WriteQueue()
+
+
+# Secondary indexes that only speed up reads. They can be dropped around a large bulk load and rebuilt
+# afterwards; the unique index on book_link stays because upserts depend on it.
+SECONDARY_INDEXES = {
+    # Author / year / rating filters and the aggregation endpoints
+    "idx_books_author_id": "books (author_id)",
+    "idx_books_published_year": "books (published_year)",
+    "idx_books_average_rating": "books (average_rating)",
+    # Covering index so genre filters and per-genre counts never touch the books table
+    "idx_book_genres_genre": "book_genres (genre_id, book_id)",
+}
+
+
+def create_secondary_indexes(cursor):
+    for name, definition in SECONDARY_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def drop_secondary_indexes(cursor):
+    for name in SECONDARY_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+# Migration 1: the schema as create_database used to build it. Every statement is idempotent, so databases
+# created before schema_version existed are brought up to date by it as well.
+def _baseline_schema(cursor):
     # Create a table to store book information
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS books (
@@ -29,63 +564,990 @@ def create_database():
     cursor.execute('''
             CREATE TABLE IF NOT EXISTS authors (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE
+                name TEXT UNIQUE,
+                normalized_name TEXT
             )
         ''')
-    conn.commit()
-    return conn, cursor
+    create_author_index(cursor)
+
+    # A scraped book is identified by its link: collapse duplicates left by earlier non-idempotent runs
+    # (keeping the oldest row) so re-runs can upsert. Books added without a link are not constrained.
+    cursor.execute('''
+        DELETE FROM books
+        WHERE book_link IS NOT NULL AND book_link != ''
+          AND id NOT IN (SELECT MIN(id) FROM books WHERE book_link IS NOT NULL AND book_link != '' GROUP BY book_link)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_books_book_link ON books (book_link)
+        WHERE book_link IS NOT NULL AND book_link != ''
+    ''')
+
+    # Normalized genres: one row per genre name and a join table ordered by position within each book
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS genres (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_genres (
+            book_id INTEGER NOT NULL,
+            genre_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (book_id, genre_id),
+            FOREIGN KEY (book_id) REFERENCES books(id),
+            FOREIGN KEY (genre_id) REFERENCES genres(id)
+        ) WITHOUT ROWID
+    ''')
+    create_secondary_indexes(cursor)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_delete_genres AFTER DELETE ON books
+        BEGIN
+            DELETE FROM book_genres WHERE book_id = old.id;
+        END
+    ''')
+    migrate_genres(cursor)
+    create_search_index(cursor)
+    create_change_log(cursor)
+
+
+# Migration 2: rows breaking the foreign keys, left by deletes made while they were not enforced. Books of a
+# deleted author get a placeholder author under the old id (merge-authors can fold it into the right one);
+# genre links and trigrams of rows that no longer exist are dropped.
+def _repair_foreign_keys(cursor):
+    cursor.execute('''
+        INSERT INTO authors (id, name)
+        SELECT DISTINCT author_id, 'Unknown author ' || author_id FROM books
+        WHERE author_id IS NOT NULL AND author_id NOT IN (SELECT id FROM authors)
+    ''')
+    index_new_authors(cursor)
+    cursor.execute('DELETE FROM book_genres WHERE book_id NOT IN (SELECT id FROM books) '
+                   'OR genre_id NOT IN (SELECT id FROM genres)')
+    cursor.execute('DELETE FROM author_trigrams WHERE author_id NOT IN (SELECT id FROM authors)')
+    violations = cursor.execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        tables = sorted({row[0] for row in violations})
+        raise RuntimeError(f"{len(violations)} rows still break foreign keys in {', '.join(tables)}")
+
+
+# Migration 3: table and index statistics for the query planner, which otherwise guesses how selective the
+# year, rating and author indexes are. PRAGMA optimize on close (see ConnectionPool.close) keeps them fresh.
+def _analyze(cursor):
+    cursor.execute('ANALYZE')
+
+
+# Migration 4: per-table change counters, see create_table_versions
+def _table_versions(cursor):
+    create_table_versions(cursor)
+
+
+# Forward-only schema migrations as (version, name, migrate(cursor)), applied in order by create_database.
+# Each one runs in its own BEGIN IMMEDIATE transaction together with its schema_version row: it is applied
+# completely or not at all, workers starting together apply it once, and the write lock is only held for
+# one step at a time (in WAL mode readers carry on meanwhile, also while an index is being built). Add new
+# steps at the end; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "baseline schema", _baseline_schema),
+    (2, "repair foreign keys", _repair_foreign_keys),
+    (3, "analyze", _analyze),
+    (4, "table versions", _table_versions),
+]
+
+
+def schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+# Apply the migrations the database has not seen yet. Returns the versions applied.
+def apply_migrations(conn):
+    if schema_version(conn) >= MIGRATIONS[-1][0]:
+        return []  # Up to date: no write lock taken
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # Transactions are managed explicitly below
+    applied = []
+    try:
+        for version, name, migrate in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone() is None:
+                    migrate(conn.cursor())
+                    conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+                    applied.append(version)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+# Open the database, creating it or bringing its schema up to date first. A snapshot cannot be migrated, so
+# one made by an older version is refused instead.
+def create_database(path=None, mode=None):
+    conn = connect(path, mode)
+    if (mode or DB_MODE) == 'snapshot':
+        try:
+            version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+        except sqlite3.OperationalError:
+            version = 0
+        if version < MIGRATIONS[-1][0]:
+            conn.close()
+            raise RuntimeError(f"The snapshot has schema version {version}, this version of the app needs "
+                               f"{MIGRATIONS[-1][0]}: take a new snapshot of the upgraded database")
+    else:
+        apply_migrations(conn)
+    return conn, conn.cursor()
+
 
+# Copy the database to `output` with SQLite's online backup API, for instance to serve it with DB_MODE=snapshot.
+# The copy is a consistent image of one moment: with pages=-1 it is taken in a single step, a read transaction
+# that writers do not wait for in WAL mode. Copying `pages` pages per step instead releases the database between
+# steps, but every write from another connection restarts the copy. The file is written beside `output` and
+# renamed into place, in rollback-journal mode so no -wal/-shm files are needed to open it read-only.
+# Returns the number of pages copied.
+def backup_database(output, path=None, pages=-1):
+    source = connect(path)
+    temporary = output + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    target = sqlite3.connect(temporary)
+    try:
+        source.backup(target, pages=pages)
+        target.execute('PRAGMA journal_mode=DELETE')
+        copied = target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    os.replace(temporary, output)
+    return copied
 
-def insert_authors(authors, cursor):
-    author_ids = {}
 
-    for author in authors:
-        cursor.execute('''
-            INSERT OR IGNORE INTO authors (name)
-            VALUES (?)
-        ''', (author,))
-        cursor.execute('SELECT id FROM authors WHERE name = ?', (author,))
-        author_ids[author] = cursor.fetchone()[0]
+# Strip whitespace, drop empty names and duplicates while keeping the original order
+def normalize_genres(genres):
+    seen = set()
+    names = []
+    for genre in genres:
+        name = genre.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
 
-    return author_ids
 
+# Fold an author name to the form duplicates share: case, accents and punctuation are dropped and runs of
+# initials are joined, so "J.R.R. Tolkien", "J. R. R. Tolkien" and "jrr tolkien" all become "jrr tolkien".
+# Memoized: bulk loads and crawls see the same few thousand names in batch after batch.
+@lru_cache(maxsize=65536)
+def normalize_author_name(name):
+    folded = unicodedata.normalize('NFKD', name.casefold().replace("'", '').replace('\u2019', ''))
+    text = ''.join(ch if ch.isalnum() else ' ' for ch in folded if not unicodedata.combining(ch))
+    words = []
+    initials = ''
+    for word in text.split():
+        if len(word) == 1:
+            initials += word
+            continue
+        if initials:
+            words.append(initials)
+            initials = ''
+        words.append(word)
+    if initials:
+        words.append(initials)
+    return ' '.join(words)
 
-def insert_books(books_dict, author_ids, cursor):
+
+# Trigrams of a normalized name, each word padded like pg_trgm does ("  j", " jr", "jrr", "rr ", ...)
+def name_trigrams(normalized):
+    trigrams = set()
+    for word in normalized.split():
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+# Replace the genres of a book, creating missing genre rows. Returns the stored genre names in order.
+def set_book_genres(cursor, book_id, genres):
+    names = normalize_genres(genres)
+    cursor.execute('DELETE FROM book_genres WHERE book_id = ?', (book_id,))
+    if not names:
+        return []
+
+    cursor.executemany('INSERT OR IGNORE INTO genres (name) VALUES (?)', [(name,) for name in names])
+    placeholders = ', '.join('?' * len(names))
+    cursor.execute(f'SELECT id, name FROM genres WHERE name IN ({placeholders})', names)
+    genre_rows = {name.lower(): (genre_id, name) for genre_id, name in cursor.fetchall()}
+
+    stored = [genre_rows[name.lower()] for name in names]
+    cursor.executemany(
+        'INSERT INTO book_genres (book_id, genre_id, position) VALUES (?, ?, ?)',
+        [(book_id, genre_id, position) for position, (genre_id, _) in enumerate(stored)]
+    )
+    return [name for _, name in stored]
+
+
+# Fetch the ordered genre names for a batch of books in one query: {book_id: [name, ...]}
+def fetch_genres(conn, book_ids):
+    genres = {book_id: [] for book_id in book_ids}
+    if not genres:
+        return genres
+    placeholders = ', '.join('?' * len(genres))
+    rows = conn.execute(f'''
+        SELECT bg.book_id, g.name
+        FROM book_genres bg JOIN genres g ON g.id = bg.genre_id
+        WHERE bg.book_id IN ({placeholders})
+        ORDER BY bg.book_id, bg.position
+    ''', list(genres)).fetchall()
+    for book_id, name in rows:
+        genres[book_id].append(name)
+    return genres
+
+
+# One-shot migration of the legacy comma-joined books.genres column into book_genres.
+# Migrated rows get their genres column cleared, so running it again is a no-op.
+def migrate_genres(cursor):
+    cursor.execute("SELECT id, genres FROM books WHERE genres IS NOT NULL AND genres != ''")
+    for book_id, genres in cursor.fetchall():
+        set_book_genres(cursor, book_id, genres.split(','))
+    cursor.execute("UPDATE books SET genres = NULL WHERE genres IS NOT NULL")
+
+
+# Genre names of a book as a single searchable string, used by the full-text index triggers
+SEARCH_GENRES_SQL = '''
+    (SELECT group_concat(g.name, ' ') FROM book_genres bg JOIN genres g ON g.id = bg.genre_id
+     WHERE bg.book_id = {book_id})
+'''
+
+
+# Triggers keeping books_fts in sync; dropped during bulk loads, which rebuild the index in one pass instead
+SEARCH_TRIGGERS = ("books_fts_insert", "books_fts_update", "books_fts_delete", "books_fts_author_update",
+                   "books_fts_genres_insert", "books_fts_genres_delete")
+
+
+# FTS5 index over book titles, author names and genres, keyed by book id (rowid) and kept in sync by triggers
+def create_search_index(cursor):
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genres,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books
+        BEGIN
+            INSERT INTO books_fts (rowid, title, author, genres)
+            VALUES (new.id, new.title, (SELECT name FROM authors WHERE id = new.author_id),
+                    {SEARCH_GENRES_SQL.format(book_id='new.id')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author_id ON books
+        BEGIN
+            UPDATE books_fts
+            SET title = new.title, author = (SELECT name FROM authors WHERE id = new.author_id)
+            WHERE rowid = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books
+        BEGIN
+            DELETE FROM books_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_author_update AFTER UPDATE OF name ON authors
+        BEGIN
+            UPDATE books_fts SET author = new.name
+            WHERE rowid IN (SELECT id FROM books WHERE author_id = new.id);
+        END
+    ''')
+    for event, row in (('INSERT', 'new'), ('DELETE', 'old')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS books_fts_genres_{event.lower()} AFTER {event} ON book_genres
+            BEGIN
+                UPDATE books_fts SET genres = {SEARCH_GENRES_SQL.format(book_id=row + '.book_id')}
+                WHERE rowid = {row}.book_id;
+            END
+        ''')
+
+    # Index books that existed before the search index was created
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM books_fts)')
+    if not cursor.fetchone()[0]:
+        rebuild_search_index(cursor)
+
+
+# Repopulate the full-text index from the books, authors and genres tables
+def rebuild_search_index(cursor):
+    cursor.execute('DELETE FROM books_fts')
+    cursor.execute(f'''
+        INSERT INTO books_fts (rowid, title, author, genres)
+        SELECT b.id, b.title, a.name, {SEARCH_GENRES_SQL.format(book_id='b.id')}
+        FROM books b LEFT JOIN authors a ON a.id = b.author_id
+    ''')
+    cursor.execute("INSERT INTO books_fts (books_fts) VALUES ('optimize')")
+
+
+# Normalized author names and their trigrams. Rows are indexed from Python (see index_new_authors), since
+# the folding is not expressible in SQL: a NULL normalized_name marks an author that still needs it, and a
+# rename made anywhere, even outside this module, clears it again through a trigger.
+def create_author_index(cursor):
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(authors)').fetchall()]
+    if 'normalized_name' not in columns:
+        cursor.execute('ALTER TABLE authors ADD COLUMN normalized_name TEXT')
+    if 'trigram_count' not in columns:
+        cursor.execute('ALTER TABLE authors ADD COLUMN trigram_count INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_authors_normalized_name ON authors (normalized_name)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS author_trigrams (
+            trigram TEXT NOT NULL,
+            author_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, author_id),
+            FOREIGN KEY (author_id) REFERENCES authors(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_author_trigrams_author ON author_trigrams (author_id)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS authors_delete_trigrams AFTER DELETE ON authors
+        BEGIN
+            DELETE FROM author_trigrams WHERE author_id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS authors_rename_trigrams AFTER UPDATE OF name ON authors
+        WHEN old.name IS NOT new.name
+        BEGIN
+            DELETE FROM author_trigrams WHERE author_id = new.id;
+            UPDATE authors SET normalized_name = NULL, trigram_count = NULL WHERE id = new.id;
+        END
+    ''')
+    index_new_authors(cursor)
+
+
+# Fill in normalized_name, trigram_count and author_trigrams for every author that does not have them yet
+def index_new_authors(cursor):
+    rows = cursor.execute('SELECT id, name FROM authors WHERE normalized_name IS NULL').fetchall()
+    if not rows:
+        return 0
+    trigrams = [(author_id, normalize_author_name(name or '')) for author_id, name in rows]
+    trigrams = [(author_id, normalized, name_trigrams(normalized)) for author_id, normalized in trigrams]
+    cursor.executemany('UPDATE authors SET normalized_name = ?, trigram_count = ? WHERE id = ?',
+                       [(normalized, len(grams), author_id) for author_id, normalized, grams in trigrams])
+    cursor.executemany('INSERT OR IGNORE INTO author_trigrams (trigram, author_id) VALUES (?, ?)',
+                       [(gram, author_id) for author_id, _, grams in trigrams for gram in grams])
+    return len(rows)
+
+
+# An author sharing s of the q query trigrams, out of its own a, scores s / (q + a - s), at most s / q:
+# only authors sharing ceil(threshold * q) trigrams can reach the threshold
+def _min_shared(threshold, trigrams):
+    return max(1, math.ceil(threshold * len(trigrams) - 1e-9))
+
+
+# Authors whose name is at least `threshold` similar to `name`, as (id, name, similarity) best first,
+# answered by SQLite from the author_trigrams table
+def find_similar_authors(conn, name, limit=10, threshold=AUTHOR_LOOKUP_SIMILARITY):
+    trigrams = name_trigrams(normalize_author_name(name))
+    if not trigrams:
+        return []
+    return conn.execute('''
+        SELECT a.id, a.name, m.shared * 1.0 / (? + MAX(a.trigram_count, m.shared) - m.shared) AS score
+        FROM (SELECT author_id, COUNT(*) AS shared FROM author_trigrams
+              WHERE trigram IN (SELECT value FROM json_each(?))
+              GROUP BY author_id HAVING shared >= ?) m
+        JOIN authors a ON a.id = m.author_id
+        WHERE score >= ?
+        ORDER BY score DESC, a.id
+        LIMIT ?
+    ''', (len(trigrams), json.dumps(sorted(trigrams)), _min_shared(threshold, trigrams), threshold,
+          -1 if limit is None else limit)).fetchall()
+
+
+# The same lookup from in-memory posting lists (needs NumPy, otherwise every lookup goes to SQLite). Each
+# trigram's author ids are read from author_trigrams the first time a lookup needs them and kept, which turns
+# the GROUP BY over tens of thousands of postings for common trigrams into a bincount. Whatever is cached is
+# dropped when the `version` a lookup passes changes, so callers pass something that changes with the authors.
+class AuthorTrigramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}
+        self._sizes = None  # trigram_count by author id
+        self.lookups = 0
+        self.resets = 0
+
+    def _reset(self, version):
+        self._version = version
+        self._postings = {}
+        self._sizes = None
+        self.resets += 1
+
+    def _posting(self, conn, trigram):
+        posting = self._postings.get(trigram)
+        if posting is None:
+            posting = np.fromiter((row[0] for row in conn.execute(
+                'SELECT author_id FROM author_trigrams WHERE trigram = ?', (trigram,))), dtype=np.int64)
+            self._postings[trigram] = posting
+        return posting
+
+    # Read the postings of many trigrams ahead of their lookups, with one IN (...) query per chunk of trigrams
+    # rather than one query per trigram
+    def load(self, conn, trigrams, version=None):
+        if np is None:
+            return
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+            for chunk in _chunks(sorted(set(trigrams) - self._postings.keys()), MAX_LOOKUP_PARAMS):
+                postings = {trigram: [] for trigram in chunk}
+                for trigram, author_id in conn.execute('SELECT trigram, author_id FROM author_trigrams WHERE trigram '
+                                                       f'IN ({", ".join("?" * len(chunk))})', chunk):
+                    postings[trigram].append(author_id)
+                self._postings.update((trigram, np.array(ids, dtype=np.int64)) for trigram, ids in postings.items())
+
+    def _load_sizes(self, conn, length):
+        rows = conn.execute('SELECT id, trigram_count FROM authors WHERE trigram_count IS NOT NULL').fetchall()
+        sizes = np.zeros(max(length, max((author_id for author_id, _ in rows), default=0) + 1), dtype=np.int64)
+        if rows:
+            sizes[[author_id for author_id, _ in rows]] = [count for _, count in rows]
+        self._sizes = sizes
+
+    def find(self, conn, name, limit=10, threshold=AUTHOR_LOOKUP_SIMILARITY, version=None):
+        if np is None:
+            return find_similar_authors(conn, name, limit, threshold)
+        candidates, scores = self.rank(conn, name, limit, threshold, version)
+        names = {}
+        for chunk in _chunks(candidates, MAX_LOOKUP_PARAMS):
+            names.update(conn.execute(f'SELECT id, name FROM authors WHERE id IN ({", ".join("?" * len(chunk))})',
+                                      chunk).fetchall())
+        return [(author_id, names[author_id], score) for author_id, score in zip(candidates, scores)
+                if author_id in names]
+
+    # The ids and scores of the matches of find(), without reading their names
+    def rank(self, conn, name, limit=10, threshold=AUTHOR_LOOKUP_SIMILARITY, version=None):
+        if np is None:
+            matches = find_similar_authors(conn, name, limit, threshold)
+            return [author_id for author_id, _, _ in matches], [score for _, _, score in matches]
+        trigrams = name_trigrams(normalize_author_name(name))
+        if not trigrams:
+            return [], []
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+            self.lookups += 1
+            ids = np.concatenate([self._posting(conn, trigram) for trigram in sorted(trigrams)])
+            if not len(ids):
+                return [], []
+            if self._sizes is None or ids.max() >= len(self._sizes):
+                self._load_sizes(conn, int(ids.max()) + 1)
+            shared = np.bincount(ids)
+            candidates = np.flatnonzero(shared >= _min_shared(threshold, trigrams))
+            shared = shared[candidates]
+            sizes = np.maximum(self._sizes[candidates], shared)
+        scores = shared / (len(trigrams) + sizes - shared)
+        keep = scores >= threshold
+        candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((candidates, -scores))[:limit]
+        return candidates[order].tolist(), scores[order].tolist()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": np is not None,
+                "trigrams_cached": len(self._postings),
+                "postings_cached": sum(len(posting) for posting in self._postings.values()),
+                "bytes": sum(posting.nbytes for posting in self._postings.values()) +
+                         (self._sizes.nbytes if self._sizes is not None else 0),
+                "lookups": self.lookups,
+                "resets": self.resets,
+            }
+
+
+author_trigram_index = AuthorTrigramIndex()
+
+
+# Change feed for incremental sync, written by triggers so every path (API handlers, bulk loads, imports,
+# the maintenance commands) records its changes in the same transaction. The log is compacted by key as it
+# is written: an entity keeps only its latest change, an upsert or a delete tombstone, so it never holds
+# more rows than there are entities plus tombstones. Tombstones older than the retention are dropped by
+# compact_changes(), which moves the horizon: clients that last synced before it must start over.
+CHANGE_TRIGGERS = (
+    ('books', 'book', 'INSERT', 'new', 'upsert'),
+    ('books', 'book', 'UPDATE', 'new', 'upsert'),
+    ('books', 'book', 'DELETE', 'old', 'delete'),
+    ('authors', 'author', 'INSERT', 'new', 'upsert'),
+    ('authors', 'author', 'UPDATE OF name', 'new', 'upsert'),  # Not when only the name index columns change
+    ('authors', 'author', 'DELETE', 'old', 'delete'),
+)
+
+
+def create_change_log(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'")
+    created = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            UNIQUE (entity, entity_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_changes_tombstones ON changes (changed_at) WHERE op = \'delete\'')
+    # Highest seq compaction has dropped a tombstone at
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes_horizon (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO changes_horizon (id, seq) VALUES (0, 0)')
+    for table, entity, event, row, op in CHANGE_TRIGGERS:
+        # DELETE then INSERT rather than INSERT OR REPLACE: an OR IGNORE on the statement firing the trigger
+        # would override the REPLACE
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS changes_{entity}_{event.split()[0].lower()} AFTER {event} ON {table}
+            BEGIN
+                DELETE FROM changes WHERE entity = '{entity}' AND entity_id = {row}.id;
+                INSERT INTO changes (entity, entity_id, op) VALUES ('{entity}', {row}.id, '{op}');
+            END
+        ''')
+    if created:
+        # Start the log with every existing entity, so a client can build its replica from since=0
+        for table, entity in (('authors', 'author'), ('books', 'book')):
+            cursor.execute(f"INSERT INTO changes (entity, entity_id, op) SELECT '{entity}', id, 'upsert' FROM {table} "
+                           "ORDER BY id")
+
+
+# Tables with a change counter, and the tables whose rows count as changes to them (a book's genres are part of
+# the book). Triggers bump the counters in the transaction making the change, whichever process or tool makes
+# it, so every worker can tell that its cached responses and in-memory indexes are out of date.
+VERSIONED_TABLES = (
+    ('books', 'books', 'INSERT'),
+    ('books', 'books', 'UPDATE'),
+    ('books', 'books', 'DELETE'),
+    ('books', 'book_genres', 'INSERT'),
+    ('books', 'book_genres', 'UPDATE'),
+    ('books', 'book_genres', 'DELETE'),
+    ('authors', 'authors', 'INSERT'),
+    ('authors', 'authors', 'UPDATE OF name'),  # Not when only the name index columns change
+    ('authors', 'authors', 'DELETE'),
+)
+
+
+def create_table_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Counters start at a random point, so databases built separately do not go through the same versions
+    # (ETags and the saved similar-books index are keyed by them); copies made with `snapshot` share them
+    cursor.executemany('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, abs(random() >> 24))',
+                       [(name,) for name in sorted({name for name, _, _ in VERSIONED_TABLES})])
+    for name, table, event in VERSIONED_TABLES:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS table_versions_{table}_{event.split()[0].lower()} AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{name}';
+            END
+        ''')
+
+
+# The version of table `name` as seen by the cursor's transaction
+def table_version(cursor, name):
+    row = cursor.execute('SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+# Drop tombstones older than `retention` seconds and move the horizon past them. Returns how many were dropped.
+def compact_changes(cursor, retention=CHANGES_RETENTION):
+    if retention <= 0:
+        return 0
+    cutoff = int(time.time() - retention)
+    horizon = cursor.execute("SELECT MAX(seq) FROM changes WHERE op = 'delete' AND changed_at < ?",
+                             (cutoff,)).fetchone()[0]
+    if horizon is None:
+        return 0
+    cursor.execute("DELETE FROM changes WHERE op = 'delete' AND changed_at < ? AND seq <= ?", (cutoff, horizon))
+    dropped = cursor.rowcount
+    cursor.execute('UPDATE changes_horizon SET seq = MAX(seq, ?) WHERE id = 0', (horizon,))
+    return dropped
+
+
+def drop_search_triggers(cursor):
+    for name in SEARCH_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+# Rows written per executemany() call by the bulk loader
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+# Keep IN (...) lookups below SQLite's bound-parameter limit
+MAX_LOOKUP_PARAMS = 900
+
+# Repeated by lookups on book_link so they can use idx_books_book_link, which only covers linked books
+LINKED_BOOKS = " AND book_link != ''"
+
+UPSERT_BOOK_SQL = '''
+    INSERT INTO books (title, author_id, book_link, average_rating, published_year)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (book_link) WHERE book_link IS NOT NULL AND book_link != '' DO UPDATE SET
+        title = excluded.title,
+        author_id = excluded.author_id,
+        average_rating = excluded.average_rating,
+        published_year = excluded.published_year
+'''
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Look up {key: id} for many values of a unique column with a handful of IN (...) queries. `where` adds
+# conditions, e.g. the one of a partial index, which SQLite only uses when the query repeats it.
+def _lookup_ids(cursor, table, column, values, where=''):
+    ids = {}
+    for chunk in _chunks(values, MAX_LOOKUP_PARAMS):
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'SELECT {column}, id FROM {table} WHERE {column} IN ({placeholders}){where}', chunk)
+        ids.update(cursor.fetchall())
+    return ids
+
+
+# "4.34 avg rating" -> 4.34 and "published 2008" -> 2008, as scraped from the shelf page
+def parse_rating(text):
+    return float(text.split()[0]) if text else None
+
+
+def parse_year(text):
+    return int(text.split()[0]) if text else None
+
+
+# Oldest author id for each of many normalized names: {normalized_name: id}
+def _lookup_normalized(cursor, keys):
+    ids = {}
+    for chunk in _chunks(keys, MAX_LOOKUP_PARAMS):
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'SELECT normalized_name, MIN(id) FROM authors WHERE normalized_name IN ({placeholders}) '
+                       'GROUP BY normalized_name', chunk)
+        ids.update(cursor.fetchall())
+    return ids
+
+
+# Resolve author names to ids, creating the authors that do not exist yet: {name: id}.
+# Names are matched on their normalized form first, with one IN (...) query per chunk of distinct names; the
+# first spelling seen is the one stored for a new author. Below a similarity of 1 the still unknown names are
+# also scored against the trigram index, whose postings are read with one IN (...) query per chunk of trigrams
+# (without NumPy, one query per name), and in order against the authors this call creates, as if they were
+# looked up one by one: each joins the most similar author close enough and is created only when there is none.
+def insert_authors(authors, cursor, similarity=INGEST_AUTHOR_SIMILARITY):
+    index_new_authors(cursor)  # Authors added by other tools must be found by their normalized name too
+    keys = {}
+    for name in authors:
+        if name not in keys:
+            keys[name] = normalize_author_name(name) or name  # Names without letters or digits only match exactly
+    key_ids = _lookup_normalized(cursor, list(set(keys.values())))
+
+    missing = {}
+    for name, key in keys.items():
+        if key not in key_ids:
+            missing.setdefault(key, name)
+    joins = {}  # Key of a name -> key of the new author it is similar to
+    if similarity < 1:
+        trigrams = {key: name_trigrams(normalize_author_name(name)) for key, name in missing.items()}
+        index = AuthorTrigramIndex()  # Private to this call, which writes no trigrams until it is done with it
+        index.load(cursor, set().union(*trigrams.values()))
+        created, postings = [], {}  # Keys of the new authors in id order; trigram -> positions in created
+        for key, grams in trigrams.items():
+            ids, scores = index.rank(cursor, missing[key], 1, similarity)
+            score, author_id = (scores[0], ids[0]) if ids else (0, None)
+            joined = None
+            # New authors get ids above every existing one, so on a tie the existing author or the oldest wins
+            for position, shared in sorted(Counter(p for gram in grams for p in postings.get(gram, ())).items()):
+                candidate = shared / (len(grams) + max(len(trigrams[created[position]]), shared) - shared)
+                if candidate >= similarity and candidate > score:
+                    score, joined = candidate, created[position]
+            if joined is not None:
+                joins[key] = joined
+            elif author_id is not None:
+                key_ids[key] = author_id
+            else:
+                for gram in grams:
+                    postings.setdefault(gram, []).append(len(created))
+                created.append(key)
+        missing = {key: missing[key] for key in created}
+    if missing:
+        cursor.executemany('INSERT OR IGNORE INTO authors (name) VALUES (?)', [(name,) for name in missing.values()])
+        index_new_authors(cursor)
+        name_ids = _lookup_ids(cursor, 'authors', 'name', list(missing.values()))
+        key_ids.update((key, name_ids[name]) for key, name in missing.items())
+    key_ids.update((key, key_ids[joined]) for key, joined in joins.items())
+    return {name: key_ids[key] for name, key in keys.items()}
+
+
+# Replace the genres of many books at once: {book_id: [name, ...]}
+def set_books_genres(cursor, genres_by_book):
+    genres_by_book = {book_id: normalize_genres(genres) for book_id, genres in genres_by_book.items()}
+    names = {}
+    for genres in genres_by_book.values():
+        for name in genres:
+            names.setdefault(name.lower(), name)
+    cursor.executemany('INSERT OR IGNORE INTO genres (name) VALUES (?)', [(name,) for name in names.values()])
+    genre_ids = {name.lower(): genre_id for name, genre_id in
+                 _lookup_ids(cursor, 'genres', 'name', list(names.values())).items()}
+
+    cursor.executemany('DELETE FROM book_genres WHERE book_id = ?', [(book_id,) for book_id in genres_by_book])
+    cursor.executemany(
+        'INSERT OR IGNORE INTO book_genres (book_id, genre_id, position) VALUES (?, ?, ?)',
+        [(book_id, genre_ids[name.lower()], position)
+         for book_id, genres in genres_by_book.items()
+         for position, name in enumerate(genres)]
+    )
+
+
+# Upsert one batch of (title, author_id, book_link, average_rating, published_year, genres) rows.
+# Ids are resolved afterwards by link; rows without a link are inserted one by one.
+def _write_book_batch(cursor, rows):
+    linked = [row for row in rows if row[2]]
+    cursor.executemany(UPSERT_BOOK_SQL, [row[:5] for row in linked])
+    book_ids = _lookup_ids(cursor, 'books', 'book_link', [row[2] for row in linked], where=LINKED_BOOKS)
+
+    genres_by_book = {}
+    for row in linked:
+        if row[5] is not None:
+            genres_by_book[book_ids[row[2]]] = row[5]
+    for row in rows:
+        if not row[2]:
+            cursor.execute(UPSERT_BOOK_SQL, row[:5])
+            if row[5] is not None:
+                genres_by_book[cursor.lastrowid] = row[5]
+    set_books_genres(cursor, genres_by_book)
+
+
+# Write one batch of book records, creating missing authors by name
+def write_book_records(cursor, batch):
+    author_ids = insert_authors([record['author'] for record in batch], cursor)
+    _write_book_batch(cursor, [
+        (record['title'], author_ids[record['author']], record.get('book_link') or '',
+         record.get('average_rating'), record.get('published_year'), record.get('genres'))
+        for record in batch
+    ])
+
+
+# Bulk loader: write an iterable of book records in batches inside a single transaction.
+# Each record is a dict with title, author, book_link, genres (list, or None to keep stored genres),
+# average_rating and published_year. With rebuild_indexes the secondary indexes and search triggers are
+# dropped for the duration of the load and rebuilt in one pass at the end, which is much faster for
+# loads that are large compared to the existing table. Returns the number of records written.
+def bulk_insert(conn, records, batch_size=INGEST_BATCH_SIZE, rebuild_indexes=False):
+    cursor = conn.cursor()
+    count = 0
+    try:
+        cursor.execute('BEGIN')
+        if rebuild_indexes:
+            drop_secondary_indexes(cursor)
+            drop_search_triggers(cursor)
+
+        for batch in _chunks(records, batch_size):
+            write_book_records(cursor, batch)
+            count += len(batch)
+
+        if rebuild_indexes:
+            create_secondary_indexes(cursor)
+            create_search_index(cursor)
+            rebuild_search_index(cursor)
+            # Dropping the indexes dropped their planner statistics (see _analyze), and without them SQLite
+            # walks every id instead of reading a year or rating range from its index
+            cursor.execute('ANALYZE')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return count
+
+
+# Convert the scraper output into bulk loader records
+def scraped_records(books_dict):
     for (title, author), info in books_dict.items():
-        cursor.execute('''
-            INSERT INTO books (title, author_id, book_link, genres, average_rating, published_year)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            title,
-            author_ids[author],
-            info['link'],
-            ', '.join(info['genres']),
-            float(info['avg_rating'].split()[0]) if info['avg_rating'] else None,
-            int(info['published'].split()[0]) if info['published'] else None
-        ))
+        yield {
+            'title': title,
+            'author': author,
+            'book_link': info['link'],
+            'genres': info['genres'],
+            'average_rating': parse_rating(info['avg_rating']),
+            'published_year': parse_year(info['published']),
+        }
+
+
+def insert_books(books_dict, author_ids, cursor, batch_size=INGEST_BATCH_SIZE):
+    for batch in _chunks(scraped_records(books_dict), batch_size):
+        _write_book_batch(cursor, [
+            (record['title'], author_ids[record['author']], record['book_link'],
+             record['average_rating'], record['published_year'], record['genres'])
+            for record in batch
+        ])
 
 
 def insert_data(books_dict, authors):
     conn, cursor = create_database()
+    bulk_insert(conn, scraped_records(books_dict))
+    conn.close()
+
+
+def scrape_and_insert(args):
+    from books_scraper import Checkpoint, Fetcher, HttpCache, scrape_books
+
+    if not args.incremental:
+        # Get the scraped data
+        books_dict, authors = scrape_books()
+    else:
+        # Only fetch detail pages that are new or stale, resuming an interrupted crawl if there is one
+        conn, cursor = create_database()
+        cursor.execute("SELECT book_link FROM books WHERE book_link IS NOT NULL AND book_link != ''")
+        known_links = {row[0] for row in cursor.fetchall()}
+        conn.close()
+
+        checkpoint = Checkpoint()
+        books_dict, authors = scrape_books(fetcher=Fetcher(cache=HttpCache()), known_links=known_links,
+                                           max_age=args.max_age * 3600, checkpoint=checkpoint)
+
+    # Insert the data into the database
+    insert_data(books_dict, authors)
 
-    # Insert authors and get their IDs
-    author_ids = insert_authors(authors, cursor)
+    if args.incremental:
+        checkpoint.clear()
 
-    # Insert books using the author IDs
-    insert_books(books_dict, author_ids, cursor)
 
+def compact_change_log(args):
+    conn, cursor = create_database()
+    retention = args.retention * 3600 if args.retention is not None else CHANGES_RETENTION
+    dropped = compact_changes(cursor, retention)
     conn.commit()
     conn.close()
+    print(f"Dropped {dropped} tombstones from the change feed")
 
 
-if __name__ == "__main__":
-    from books_scraper import scrape_books
+def snapshot_database(args):
+    output = args.output or os.path.splitext(DATABASE_URL)[0] + '.snapshot.db'
+    started = time.perf_counter()
+    pages = backup_database(output, pages=args.pages)
+    print(f"Wrote {output}: {pages} pages, {os.path.getsize(output)} bytes in {time.perf_counter() - started:.1f}s")
 
-    # Get the scraped data
-    books_dict, authors = scrape_books()
 
-    # Insert the data into the database
-    insert_data(books_dict, authors)
+def rebuild_search(args):
+    conn, cursor = create_database()
+    rebuild_search_index(cursor)
+    conn.commit()
+    conn.close()
+
+
+# Group authors that are duplicates of each other: equal normalized names, or with a similarity below 1 any
+# pair at least that similar (transitively). Each group keeps the author with the most books (then the oldest)
+# first, followed by the duplicates to fold into it: [[keep_id, duplicate_id, ...], ...]
+def find_duplicate_authors(conn, similarity=1.0):
+    authors = conn.execute('SELECT id, name, normalized_name FROM authors ORDER BY id').fetchall()
+    parent = {author_id: author_id for author_id, _, _ in authors}
+
+    def find(author_id):
+        while parent[author_id] != author_id:
+            parent[author_id] = parent[parent[author_id]]
+            author_id = parent[author_id]
+        return author_id
+
+    index = AuthorTrigramIndex()  # Nothing is written until the groups are known, so its cache stays valid
+    first_by_name = {}
+    for author_id, name, normalized in authors:
+        if normalized:
+            parent[author_id] = find(first_by_name.setdefault(normalized, author_id))
+        if similarity < 1:
+            for match_id, _, _ in index.find(conn, name, None, similarity):
+                parent[find(match_id)] = find(author_id)
+
+    groups = {}
+    for author_id, _, _ in authors:
+        groups.setdefault(find(author_id), []).append(author_id)
+    book_counts = dict(conn.execute('SELECT author_id, COUNT(*) FROM books GROUP BY author_id').fetchall())
+    return [sorted(group, key=lambda author_id: (-book_counts.get(author_id, 0), author_id))
+            for group in groups.values() if len(group) > 1]
+
+
+# Point the books of every duplicate at the author kept for its group and delete the duplicates
+def merge_author_groups(conn, groups):
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('UPDATE books SET author_id = ? WHERE author_id = ?',
+                           [(group[0], duplicate) for group in groups for duplicate in group[1:]])
+        moved = cursor.rowcount
+        cursor.executemany('DELETE FROM authors WHERE id = ?',
+                           [(duplicate,) for group in groups for duplicate in group[1:]])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return moved
+
+
+def merge_authors(args):
+    conn, cursor = create_database()
+    groups = find_duplicate_authors(conn, args.similarity)
+    names = dict(conn.execute('SELECT id, name FROM authors').fetchall())
+    for group in groups:
+        print(f"{names[group[0]]!r} ({group[0]}) <- " + ', '.join(f"{names[i]!r} ({i})" for i in group[1:]))
+    duplicates = sum(len(group) - 1 for group in groups)
+    if args.dry_run:
+        print(f"{duplicates} duplicate authors in {len(groups)} groups (dry run, nothing changed)")
+    else:
+        moved = merge_author_groups(conn, groups)
+        print(f"Merged {duplicates} duplicate authors in {len(groups)} groups, {moved} books repointed")
+    conn.close()
+
 
+COMMANDS = {
+    "scrape": scrape_and_insert,
+    "rebuild-search": rebuild_search,
+    "merge-authors": merge_authors,
+    "compact-changes": compact_change_log,
+    "snapshot": snapshot_database,
+}
 
 
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Book database maintenance")
+    parser.add_argument("command", nargs="?", default="scrape", choices=COMMANDS,
+                        help="scrape: scrape and insert books (default); rebuild-search: rebuild the full-text index; "
+                             "merge-authors: fold duplicate authors into one and repoint their books; "
+                             "compact-changes: drop old delete tombstones from the change feed; "
+                             "snapshot: copy the database to a file to serve with DB_MODE=snapshot")
+    parser.add_argument("--incremental", action="store_true",
+                        help="scrape: reuse the on-disk HTTP cache, skip fresh known books and resume interrupted runs")
+    parser.add_argument("--max-age", type=float, default=168,
+                        help="scrape --incremental: hours before a stored book's detail page is revalidated")
+    parser.add_argument("--similarity", type=float, default=1.0,
+                        help="merge-authors: trigram similarity that makes two authors duplicates "
+                             "(1 only merges equal normalized names)")
+    parser.add_argument("--dry-run", action="store_true", help="merge-authors: list the groups without merging")
+    parser.add_argument("--retention", type=float,
+                        help="compact-changes: hours tombstones are kept (defaults to CHANGES_RETENTION)")
+    parser.add_argument("--output", help="snapshot: file to write (defaults to <DATABASE_URL>.snapshot.db)")
+    parser.add_argument("--pages", type=int, default=-1,
+                        help="snapshot: pages copied per step (-1 copies everything in one read transaction)")
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
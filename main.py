@@ -1,6 +1,13 @@
-from fastapi import FastAPI
-from routers import authors, books, api_key
-from database import create_database
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import authors, books, changes, genres, search, stats, catalog, api_key, system
+from database import DB_MODE, DatabaseBusy, DatabaseReadOnly, create_database, db_executor, db_writer, pool
+from database import set_connection_factory
+from metrics import CONNECTION_FACTORY, METRICS_ENABLED, MetricsMiddleware, metrics
+from routers.caching import versions
+from routers.changes import change_compactor
+from routers.similar import similar_index
+from routers.snapshot import catalog_snapshot
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -12,10 +19,65 @@ app = FastAPI(
 # Include the routers
 app.include_router(authors.router, prefix="/api/authors", tags=["Authors"])
 app.include_router(books.router, prefix="/api/books", tags=["Books"])
+app.include_router(genres.router, prefix="/api/genres", tags=["Genres"])
+app.include_router(search.router, prefix="/api/search", tags=["Search"])
+app.include_router(stats.router, prefix="/api/stats", tags=["Statistics"])
+app.include_router(catalog.router, prefix="/api", tags=["Import / Export"])
+app.include_router(changes.router, prefix="/api/changes", tags=["Changes"])
 app.include_router(api_key.router, prefix="/api/validate_key")
+app.include_router(system.router, prefix="/api/system", tags=["System"])
+
+# Per-route latency, response size and status counts plus requests in flight, served from /metrics;
+# SQL statements are measured on the pooled, stream and writer connections
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+set_connection_factory(CONNECTION_FACTORY)
+
+
+# Request and SQL statement metrics in the Prometheus text exposition format
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Shed load instead of queueing without bound when the database executor is saturated
+@app.exception_handler(DatabaseBusy)
+async def database_busy_handler(request: Request, exc: DatabaseBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+# A read-only snapshot replica serves reads only; writes belong on the primary
+@app.exception_handler(DatabaseReadOnly)
+async def database_read_only_handler(request: Request, exc: DatabaseReadOnly):
+    return JSONResponse(
+        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+        content={"detail": str(exc)},
+        headers={"Allow": "GET, HEAD"},
+    )
 
 
 @app.on_event("startup")
 def startup():
-    # Initialize the database tables
-    create_database()
+    # Initialize the database tables (or check that a snapshot has the current schema)
+    conn, _ = create_database()
+    conn.close()
+    # Load the columnar snapshot for the statistics endpoints and the similar-books index in the background
+    catalog_snapshot.refresh()
+    similar_index.refresh()
+    if DB_MODE != "snapshot":
+        change_compactor.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    # Let running database jobs and queued writes finish, then close the idle pooled connections
+    change_compactor.stop()
+    db_executor.shutdown()
+    db_writer.close()
+    pool.close()
+    versions.close()
+    similar_index.save()  # Keep the updates made since the last save for the next start
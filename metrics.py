@@ -0,0 +1,261 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Instrumentation switch; with METRICS_ENABLED=0 connections are plain sqlite3 connections and no
+# middleware is installed, so nothing is measured at all
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False", "")
+# Statements taking longer than this (execution plus fetching their rows) are logged
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+slow_query_log = logging.getLogger("books.slow_query")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+# Cumulative histogram in the Prometheus sense: a count per upper bound, plus the sum and the total
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Families of labelled histograms, counters and gauges, rendered in the text exposition format.
+# One lock guards every update; each update is a few dict and list operations.
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+
+    def _family(self, name, kind, help_text, label_names):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {"kind": kind, "help": help_text, "labels": label_names, "series": {}}
+        return family
+
+    def histogram(self, name, help_text, label_names, buckets):
+        self._family(name, "histogram", help_text, label_names)["buckets"] = buckets
+
+    def counter(self, name, help_text, label_names=()):
+        self._family(name, "counter", help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        self._family(name, "gauge", help_text, label_names)
+
+    def observe(self, name, labels, value):
+        family = self._families[name]
+        with self._lock:
+            series = family["series"].get(labels)
+            if series is None:
+                series = family["series"][labels] = Histogram(family["buckets"])
+            series.observe(value)
+
+    def inc(self, name, labels=(), amount=1):
+        series = self._families[name]["series"]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, family in self._families.items():
+                lines.append(f"# HELP {name} {family['help']}")
+                lines.append(f"# TYPE {name} {family['kind']}")
+                label_names = family["labels"]
+                for labels, series in family["series"].items():
+                    if family["kind"] != "histogram":
+                        lines.append(f"{name}{_labels(label_names, labels)} {_format(series)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(series.buckets, series.counts):
+                        cumulative += count
+                        bucket_labels = _labels(label_names, labels, 'le="%s"' % bound)
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    bucket_labels = _labels(label_names, labels, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{bucket_labels} {series.count}")
+                    lines.append(f"{name}_sum{_labels(label_names, labels)} {_format(series.sum)}")
+                    lines.append(f"{name}_count{_labels(label_names, labels)} {series.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.histogram("http_request_duration_seconds", "Time to serve a request, by route template",
+                  ("method", "route"), LATENCY_BUCKETS)
+metrics.histogram("http_response_size_bytes", "Response body size, by route template",
+                  ("method", "route"), SIZE_BUCKETS)
+metrics.counter("http_requests_total", "Requests served, by route template and status", ("method", "route", "status"))
+metrics.gauge("http_requests_in_flight", "Requests currently being served")
+metrics.histogram("sql_statement_duration_seconds", "Time to execute a statement and fetch its rows, by fingerprint",
+                  ("statement",), LATENCY_BUCKETS)
+metrics.histogram("sql_statement_rows", "Rows fetched per statement, by fingerprint", ("statement",), ROW_BUCKETS)
+metrics.counter("sql_slow_statements_total", f"Statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)",
+                ("statement",))
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+# Statement fingerprint: literals become ?, IN lists of any length collapse to one form and
+# whitespace is normalized, so every call site maps onto a bounded set of label values
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    sql = _LITERALS.sub("?", sql)
+    sql = _PLACEHOLDER_LISTS.sub("?, ...", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _record_statement(sql, elapsed, rows):
+    statement = fingerprint(sql)
+    metrics.observe("sql_statement_duration_seconds", (statement,), elapsed)
+    metrics.observe("sql_statement_rows", (statement,), rows)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.inc("sql_slow_statements_total", (statement,))
+        slow_query_log.warning("slow query (%.1f ms, %d rows): %s", elapsed * 1000, rows, statement)
+
+
+# Cursor that times each statement from execute() until its rows have been fetched. A statement is
+# recorded once it is exhausted, re-executed, closed or garbage collected, whichever comes first.
+# Iterating the cursor row by row stays at C speed and is not timed; fetch*() calls are.
+class InstrumentedCursor(sqlite3.Cursor):
+    _sql = None
+
+    def _finish(self):
+        if self._sql is not None:
+            _record_statement(self._sql, self._elapsed, self._rows)
+            self._sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql, self._elapsed, self._rows = sql, time.perf_counter() - started, 0
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql, self._elapsed, self._rows = sql, time.perf_counter() - started, 0
+            self._finish()
+
+    def _fetched(self, started, rows, exhausted):
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - started
+            self._rows += rows
+            if exhausted:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+# Connection whose cursors, including the ones behind conn.execute(), are instrumented
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Factory to pass to sqlite3.connect()
+CONNECTION_FACTORY = InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+# ASGI middleware recording latency, response size and status per route template, and requests in flight.
+# The route template (e.g. /api/books/{book_id}) is read from the scope once routing has matched.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        metrics.inc("http_requests_in_flight", (), 1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.inc("http_requests_in_flight", (), -1)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "<unmatched>")
+            metrics.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            metrics.observe("http_response_size_bytes", labels, size)
+            metrics.inc("http_requests_total", labels + (status,))
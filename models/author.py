@@ -20,3 +20,8 @@ class AuthorResponse(BaseModel):
 # Model for an author with id, inheriting from AuthorBase
 class Author(AuthorBase):
     id: int
+
+
+# An author returned by the fuzzy name lookup, with the trigram similarity of its name to the query (0-1)
+class AuthorMatch(Author):
+    similarity: float
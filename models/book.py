@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
+from models.author import Author
 
 
 # Base model for Book with relevant fields
@@ -25,3 +26,14 @@ class BookResponse(BookBase):
 # Model for a book with id, inheriting from BookBase
 class Book(BookBase):
     id: int
+
+
+# Book returned with ?expand=author: the author is embedded instead of only referenced by id.
+# Without the expansion the field is left out of the response entirely.
+class BookWithAuthor(Book):
+    author: Optional[Author] = None
+
+
+# Book returned by /books/{id}/similar with the Jaccard similarity of its genres to the requested book's
+class SimilarBook(Book):
+    similarity: float
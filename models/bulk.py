@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Any, List, Literal, Optional
+
+
+# Outcome of a single element of a bulk request, identified by its position in the body
+class BulkItemResult(BaseModel):
+    index: int
+    status: Literal["created", "updated", "unchanged", "deleted", "conflict", "invalid", "not_found"]
+    id: Optional[int] = None
+    detail: Optional[Any] = None
+
+
+# Model for the response of a bulk request: per-status counts and the per-item outcomes
+class BulkResult(BaseModel):
+    counts: dict
+    items: List[BulkItemResult]
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional, Union
+from models.author import Author
+from models.book import Book
+
+
+# One entry of the change feed: the entity's current state for an upsert, only its id for a delete
+class Change(BaseModel):
+    seq: int
+    entity: Literal["book", "author"]
+    id: int
+    op: Literal["upsert", "delete"]
+    changed_at: int  # Unix time of the change
+    data: Optional[Union[Book, Author]] = None
+
+
+# A page of the change feed. Pass next_since as `since` to continue; has_more says another page is ready.
+class ChangeFeed(BaseModel):
+    since: int
+    next_since: int
+    has_more: bool
+    changes: List[Change]
@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+# Model for a genre together with the number of books tagged with it
+class GenreCount(BaseModel):
+    id: int
+    name: str
+    book_count: int
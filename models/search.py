@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+# Model for a single full-text search hit; lower scores rank higher (bm25)
+class SearchHit(BaseModel):
+    id: int
+    title: str
+    author_id: int
+    author: Optional[str] = None
+    genres: List[str]
+    average_rating: Optional[float] = None
+    published_year: Optional[int] = None
+    score: float
+    snippet: str
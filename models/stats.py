@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+# Model for the overall shape of the (filtered) catalog
+class CatalogSummary(BaseModel):
+    book_count: int
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+    min_rating: Optional[float] = None
+    max_rating: Optional[float] = None
+    average_rating: Optional[float] = None
+
+
+# Model for the number of books published in a year
+class YearCount(BaseModel):
+    published_year: int
+    count: int
+
+
+# Model for the number of books in an average-rating bucket starting at average_rating
+class RatingCount(BaseModel):
+    average_rating: float
+    count: int
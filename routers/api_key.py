@@ -5,5 +5,5 @@ router = APIRouter()
 
 
 @router.get("/")
-def validate_key(api_key: str = Depends(get_api_key)):
+async def validate_key(api_key: str = Depends(get_api_key)):
     return {"message": "API Key is valid"}
@@ -1,75 +1,202 @@
 import sqlite3
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends
-from models.author import Author, AuthorCreate
-from database import get_db_connection
-from auth.security import get_api_key
+from typing import List, Literal, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from models.author import Author, AuthorCreate, AuthorMatch
+from models.book import BookWithAuthor
+from models.bulk import BulkResult
+from database import AUTHOR_LOOKUP_SIMILARITY, author_trigram_index, db_executor, db_writer, index_new_authors
+from auth.security import get_write_api_key
+from routers.bulk import parse_id, run_bulk
+from routers.books import Expand, rows_to_books, select_books
+from routers.caching import cached_json, versions
+from routers.filters import id_list
+from routers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, split_page, next_link_headers, stream_rows
 
 router = APIRouter()
 
 
+def _rows_to_authors(conn, authors):
+    return [{"name": author[1], "id": author[0]} for author in authors]
+
+
 @router.get("/", response_model=List[Author])
-def get_authors():
-    conn = get_db_connection()
+async def get_authors(
+        request: Request,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of authors per page"),
+        after: Optional[int] = Query(None, description="Cursor: only return authors with an id greater than this"),
+        ids: Optional[List[int]] = Depends(id_list),
+        stream: Optional[Literal["ndjson", "json"]] = Query(
+            None, description="Stream every author after the cursor as NDJSON or a chunked JSON array (ignores limit)")
+):
+    if ids is not None:
+        query, params = f"SELECT id, name FROM authors WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY id", ids
+    else:
+        query, params = "SELECT id, name FROM authors WHERE id > ? ORDER BY id", [after if after is not None else 0]
+
+    if stream:
+        return await stream_rows(query, params, _rows_to_authors, stream)
+
+    def build_page(conn):
+        if ids is not None:
+            return _rows_to_authors(conn, conn.execute(query, params).fetchall()), {}
+        authors = conn.execute(query + " LIMIT ?", params + [limit + 1]).fetchall()
+        authors, next_cursor = split_page(authors, limit)
+        return _rows_to_authors(conn, authors), next_link_headers(request, next_cursor)
+
+    return await cached_json(request, ("authors",), build_page)
+
+
+# Authors whose name is close to `name` (case, accents, punctuation and spacing of initials ignored),
+# ranked by trigram similarity
+@router.get("/lookup", response_model=List[AuthorMatch])
+async def lookup_authors(
+        request: Request,
+        name: str = Query(..., min_length=1, max_length=200, description="Author name to look up"),
+        limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of authors returned"),
+        min_similarity: float = Query(AUTHOR_LOOKUP_SIMILARITY, ge=0, le=1,
+                                      description="Lowest trigram similarity (0-1) an author needs to be returned")
+):
+    def build(conn):
+        matches = author_trigram_index.find(conn, name, limit, min_similarity, versions.get(("authors",)))
+        return [{"id": author_id, "name": author_name, "similarity": round(score, 4)}
+                for author_id, author_name, score in matches], {}
+
+    return await cached_json(request, ("authors",), build)
+
+
+# One author's books, a keyset page at a time; answered from idx_books_author_id
+@router.get("/{author_id}/books", response_model=List[BookWithAuthor], response_model_exclude_unset=True)
+async def get_author_books(
+        request: Request,
+        author_id: int,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of books per page"),
+        after: Optional[int] = Query(None, description="Cursor: only return books with an id greater than this"),
+        expand: Expand = Query(None, description="Embed each book's author")
+):
+    def build_page(conn):
+        books = conn.execute(select_books(expand) + " WHERE books.author_id = ? AND books.id > ? "
+                             "ORDER BY books.id LIMIT ?",
+                             (author_id, after if after is not None else 0, limit + 1)).fetchall()
+        books, next_cursor = split_page(books, limit)
+        return rows_to_books(conn, books), next_link_headers(request, next_cursor)
+
+    if not await db_executor.run(_author_exists, author_id):
+        raise HTTPException(status_code=404, detail="Author not found")
+    return await cached_json(request, ("books", "authors"), build_page)
+
+
+def _author_exists(conn, author_id):
+    return conn.execute("SELECT 1 FROM authors WHERE id = ?", (author_id,)).fetchone() is not None
+
+
+def _create_author(conn, author):
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO authors (name) VALUES (?)", (author.name,))
+    author_id = cursor.lastrowid
+    index_new_authors(cursor)
+    return author_id
+
+
+def _rename_author(conn, author_id, author):
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM authors")
-    authors = cursor.fetchall()
-    conn.close()
-    return [{"id": author[0], "name": author[1]} for author in authors]
+    cursor.execute("UPDATE authors SET name = ? WHERE id = ?", (author.name, author_id))
+    renamed = cursor.rowcount
+    index_new_authors(cursor)
+    return renamed
+
+
+def _delete_author(conn, author_id):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM authors WHERE id = ?", (author_id,))
+    return cursor.rowcount
 
 
 @router.post("/", response_model=Author)
-def create_author(
+async def create_author(
         author: AuthorCreate,
-        _: str = Depends(get_api_key)  # Enforce API key
+        _: str = Depends(get_write_api_key)  # Enforce API key
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO authors (name) VALUES (?)", (author.name,))
-        conn.commit()
-        author_id = cursor.lastrowid
-        return Author(id=author_id, name=author.name)
+        author_id = await db_writer.write(_create_author, author)
     except sqlite3.IntegrityError:
-        conn.close()
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"The author '{author.name}' already exists."
         )
-    finally:
-        conn.close()
+    versions.refresh()
+    return Author(id=author_id, name=author.name)
 
 
 @router.put("/{author_id}", response_model=Author)
-def update_author(
+async def update_author(
         author_id: int,
         author: AuthorCreate,
-        _: str = Depends(get_api_key)  # Enforce API key
+        _: str = Depends(get_write_api_key)  # Enforce API key
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE authors SET name = ? WHERE id = ?", (author.name, author_id))
-    if cursor.rowcount == 0:
-        conn.close()
+    try:
+        renamed = await db_writer.write(_rename_author, author_id, author)
+    except sqlite3.IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"The author '{author.name}' already exists."
+        )
+    if not renamed:
         raise HTTPException(status_code=404, detail="Author not found")
-    conn.commit()
-    conn.close()
+    versions.refresh()
     return Author(id=author_id, name=author.name)
 
 
 @router.delete("/{author_id}", response_model=dict)
-def delete_author(
+async def delete_author(
         author_id: int,
-        _: str = Depends(get_api_key)  # Enforce API key
+        _: str = Depends(get_write_api_key)  # Enforce API key
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM authors WHERE id = ?", (author_id,))
-    if cursor.rowcount == 0:
-        conn.close()
+    try:
+        deleted = await db_writer.write(_delete_author, author_id)
+    except sqlite3.IntegrityError:  # Foreign keys keep an author's books from being orphaned
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The author still has books; delete or reassign them first."
+        )
+    if not deleted:
         raise HTTPException(status_code=404, detail="Author not found")
-    conn.commit()
-    conn.close()
+    versions.refresh()
 
     return {"detail": "Author deleted"}
 
+
+def _create_author_item(cursor, author):
+    cursor.execute("INSERT INTO authors (name) VALUES (?)", (author.name,))
+    author_id = cursor.lastrowid
+    index_new_authors(cursor)
+    return "created", author_id
+
+
+# Upsert keyed by name: an author that already exists is reported as unchanged with its id
+def _upsert_author_item(cursor, author):
+    existing = cursor.execute("SELECT id FROM authors WHERE name = ?", (author.name,)).fetchone()
+    if existing is not None:
+        return "unchanged", existing[0]
+    return _create_author_item(cursor, author)
+
+
+def _delete_author_item(cursor, author_id):
+    cursor.execute("DELETE FROM authors WHERE id = ?", (author_id,))
+    return ("deleted" if cursor.rowcount else "not_found"), author_id
+
+
+# Create or upsert many authors from a JSON array or NDJSON body of AuthorCreate objects
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_write_authors(
+        request: Request,
+        mode: Literal["create", "upsert"] = Query("create", description="upsert returns existing authors unchanged"),
+        _: str = Depends(get_write_api_key)  # Enforce API key
+):
+    write_item = _create_author_item if mode == "create" else _upsert_author_item
+    return await run_bulk(request, AuthorCreate.model_validate, write_item)
+
+
+# Delete many authors from a JSON array or NDJSON body of author ids
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_authors(request: Request, _: str = Depends(get_write_api_key)):
+    return await run_bulk(request, parse_id, _delete_author_item)
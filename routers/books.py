@@ -1,82 +1,269 @@
 import sqlite3
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends
-from models.book import Book, BookCreate
-from database import get_db_connection
-from auth.security import get_api_key
+from typing import List, Literal, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from models.book import Book, BookCreate, BookWithAuthor, SimilarBook
+from models.bulk import BulkResult
+from database import LINKED_BOOKS, db_executor, db_writer, fetch_genres, set_book_genres, table_version
+from auth.security import get_write_api_key
+from routers.bulk import parse_id, run_bulk
+from routers.filters import BookFilters, id_list
+from routers.caching import cached_json, versions
+from routers.similar import similar_index
+from routers.snapshot import catalog_snapshot
+from routers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, split_page, next_link_headers, stream_rows
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[Book])
-def get_books():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, author_id, book_link, genres, average_rating, published_year FROM books")
-    books = cursor.fetchall()
-    conn.close()
+BOOK_COLUMNS = "books.id, books.title, books.author_id, books.book_link, books.average_rating, books.published_year"
+# ?expand=author adds the author's name through one join, answered from the authors primary key
+AUTHOR_JOIN = " LEFT JOIN authors ON authors.id = books.author_id"
+
+Expand = Optional[Literal["author"]]
 
-    return [
+
+def rows_to_books(conn, books):
+    genres = fetch_genres(conn, [book[0] for book in books])
+    items = [
         {
-            "id": book[0],
             "title": book[1],
             "author_id": book[2],
             "book_link": book[3],
-            "genres": book[4].split(',') if book[4] else [],  # Split genre names into a list
-            "average_rating": book[5],
-            "published_year": book[6]
+            "genres": genres[book[0]],
+            "average_rating": book[4],
+            "published_year": book[5],
+            "id": book[0]
         }
         for book in books
     ]
+    # Rows selected with the author join carry the author's name as a seventh column
+    for item, book in zip(items, books):
+        if len(book) > 6:
+            item["author"] = {"name": book[6], "id": book[2]} if book[6] is not None else None
+    return items
 
 
-@router.post("/", response_model=Book)
-def create_book(book: BookCreate, _: str = Depends(get_api_key)):
-    conn = get_db_connection()
+def select_books(expand):
+    if expand:
+        return f"SELECT {BOOK_COLUMNS}, authors.name FROM books" + AUTHOR_JOIN
+    return f"SELECT {BOOK_COLUMNS} FROM books"
+
+
+def _books_query(conn, after, filters, expand=None, ids=None):
+    if ids is not None:
+        query = select_books(expand) + f" WHERE books.id IN ({', '.join('?' * len(ids))})"
+        params = list(ids)
+    else:
+        query = select_books(expand) + " WHERE books.id > ?"
+        params = [after if after is not None else 0]
+    filter_sql, filter_params = filters.where(conn, column_prefix="books.")
+    return query + filter_sql + " ORDER BY books.id", params + filter_params
+
+
+# Tables a books response depends on, for cache invalidation
+def _book_tables(expand):
+    return ("books", "authors") if expand else ("books",)
+
+
+@router.get("/", response_model=List[BookWithAuthor], response_model_exclude_unset=True)
+async def get_books(
+        request: Request,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of books per page"),
+        after: Optional[int] = Query(None, description="Cursor: only return books with an id greater than this"),
+        filters: BookFilters = Depends(),
+        ids: Optional[List[int]] = Depends(id_list),
+        expand: Expand = Query(None, description="Embed each book's author"),
+        stream: Optional[Literal["ndjson", "json"]] = Query(
+            None, description="Stream every book after the cursor as NDJSON or a chunked JSON array (ignores limit)")
+):
+    def build_page(conn):
+        query, params = _books_query(conn, after, filters, expand, ids)
+        if ids is not None:
+            return rows_to_books(conn, conn.execute(query, params).fetchall()), {}
+        books = conn.execute(query + " LIMIT ?", params + [limit + 1]).fetchall()
+        books, next_cursor = split_page(books, limit)
+        return rows_to_books(conn, books), next_link_headers(request, next_cursor)
+
+    if stream:
+        query, params = await db_executor.run(_books_query, after, filters, expand, ids)
+        return await stream_rows(query, params, rows_to_books, stream)
+    return await cached_json(request, _book_tables(expand), build_page)
+
+
+@router.get("/{book_id}", response_model=BookWithAuthor, response_model_exclude_unset=True)
+async def get_book(book_id: int, expand: Expand = Query(None, description="Embed the author")):
+    def fetch(conn):
+        book = conn.execute(select_books(expand) + " WHERE books.id = ?", (book_id,)).fetchone()
+        return rows_to_books(conn, [book])[0] if book else None
+
+    book = await db_executor.run(fetch)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
+
+
+# "More like this": the k books whose genres overlap most with this book's, closest in year and best rated first
+@router.get("/{book_id}/similar", response_model=List[SimilarBook])
+async def get_similar_books(
+        request: Request,
+        book_id: int,
+        k: int = Query(10, ge=1, le=DEFAULT_PAGE_SIZE, description="Number of similar books to return")
+):
+    def build(conn):
+        book = conn.execute("SELECT average_rating, published_year FROM books WHERE id = ?", (book_id,)).fetchone()
+        if book is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        result = similar_index.similar(book_id, _genre_ids(conn, book_id), book[0], book[1], k)
+        if result is None:
+            raise HTTPException(status_code=503, detail="The similarity index is loading, retry later",
+                                headers={"Retry-After": "1"})
+        ranked, current = result
+        ids = [similar_id for similar_id, _ in ranked]
+        rows = conn.execute(select_books(None) + f" WHERE books.id IN ({', '.join('?' * len(ids))})",
+                            ids).fetchall()
+        books = {item["id"]: item for item in rows_to_books(conn, rows)}
+        # Books deleted since the index last saw them are skipped
+        similar = [{**books[similar_id], "similarity": round(score, 4)}
+                   for similar_id, score in ranked if similar_id in books]
+        # An index still catching up with a write answers, but that answer is not the current one to cache
+        return similar, {} if current else {"Cache-Control": "no-store"}
+
+    return await cached_json(request, ("books",), build)
+
+
+# Insert a book and its genres; returns the new id and the stored genre names
+def _insert_book(cursor, book):
+    cursor.execute("INSERT INTO books (title, author_id, book_link, average_rating, published_year) "
+                   "VALUES (?, ?, ?, ?, ?)",
+                   (book.title, book.author_id, book.book_link, book.average_rating, book.published_year))
+    book_id = cursor.lastrowid
+    return book_id, set_book_genres(cursor, book_id, book.genres)
+
+
+# Update a book and its genres; returns the stored genre names, or None when the book does not exist
+def _update_book(cursor, book_id, book):
+    cursor.execute(
+        "UPDATE books SET title = ?, author_id = ?, book_link = ?, average_rating = ?, published_year = ? "
+        "WHERE id = ?",
+        (book.title, book.author_id, book.book_link, book.average_rating, book.published_year, book_id))
+    if cursor.rowcount == 0:
+        return None
+    return set_book_genres(cursor, book_id, book.genres)
+
+
+def _genre_ids(cursor, book_id):
+    return [row[0] for row in cursor.execute("SELECT genre_id FROM book_genres WHERE book_id = ?", (book_id,))]
+
+
+# The single-book writes also return the stored genre ids for the similarity index, and the books version
+# before and after the write, so the in-memory indexes only apply it on top of exactly the state it changed
+def _create_book(conn, book):
+    cursor = conn.cursor()
+    before = table_version(cursor, "books")
+    book_id, genres = _insert_book(cursor, book)
+    return book_id, genres, _genre_ids(cursor, book_id), (before, table_version(cursor, "books"))
+
+
+def _replace_book(conn, book_id, book):
     cursor = conn.cursor()
+    before = table_version(cursor, "books")
+    genres = _update_book(cursor, book_id, book)
+    if genres is None:
+        return None, None, None
+    return genres, _genre_ids(cursor, book_id), (before, table_version(cursor, "books"))
+
+
+def _delete_book(conn, book_id):
+    cursor = conn.cursor()
+    before = table_version(cursor, "books")
+    cursor.execute("DELETE FROM books WHERE id = ?", (book_id,))
+    return cursor.rowcount, (before, table_version(cursor, "books"))
+
+
+# Foreign keys are enforced: a book can only point at an existing author
+def _raise_if_unknown_author(error, book):
+    if "FOREIGN KEY" in str(error):
+        raise HTTPException(status_code=422, detail=f"Author {book.author_id} does not exist.")
+
+
+@router.post("/", response_model=Book)
+async def create_book(book: BookCreate, _: str = Depends(get_write_api_key)):
     try:
-        genres = ",".join(book.genres)  # Convert list of genre names to a comma-separated string
-        cursor.execute("INSERT INTO books (title, author_id, book_link, genres, average_rating, published_year) "
-                       "VALUES (?, ?, ?, ?, ?, ?)",
-                       (book.title, book.author_id, book.book_link, genres, book.average_rating, book.published_year))
-        conn.commit()
-        book_id = cursor.lastrowid
-        return Book(id=book_id, **book.dict())
-    except sqlite3.IntegrityError:
-        conn.close()
+        book_id, genres, genre_ids, books_versions = await db_writer.write(_create_book, book)
+    except sqlite3.IntegrityError as e:
+        _raise_if_unknown_author(e, book)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"The book '{book.title}' already exists."
         )
-    finally:
-        conn.close()
+    versions.refresh()
+    catalog_snapshot.upsert(books_versions, book_id, book, genres)
+    similar_index.upsert(books_versions, book_id, book, genre_ids)
+    return Book(id=book_id, **book.dict(exclude={"genres"}), genres=genres)
 
 
 @router.put("/{book_id}", response_model=Book)
-def update_book(book_id: int, book: BookCreate, _: str = Depends(get_api_key)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    genres = ",".join(book.genres)  # Convert list of genre names to a comma-separated string
-    cursor.execute(
-        "UPDATE books SET title = ?, author_id = ?, book_link = ?, genres = ?, average_rating = ?, published_year = ? "
-        "WHERE id = ?",
-        (book.title, book.author_id, book.book_link, genres, book.average_rating, book.published_year, book_id))
-    if cursor.rowcount == 0:
-        conn.close()
+async def update_book(book_id: int, book: BookCreate, _: str = Depends(get_write_api_key)):
+    try:
+        genres, genre_ids, books_versions = await db_writer.write(_replace_book, book_id, book)
+    except sqlite3.IntegrityError as e:
+        _raise_if_unknown_author(e, book)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Another book already uses the link '{book.book_link}'."
+        )
+    if genres is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    conn.commit()
-    conn.close()
-    return Book(id=book_id, **book.dict())
+    versions.refresh()
+    catalog_snapshot.upsert(books_versions, book_id, book, genres)
+    similar_index.upsert(books_versions, book_id, book, genre_ids)
+    return Book(id=book_id, **book.dict(exclude={"genres"}), genres=genres)
 
 
 @router.delete("/{book_id}", response_model=dict)
-def delete_book(book_id: int, _: str = Depends(get_api_key)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM books WHERE id = ?", (book_id,))
-    if cursor.rowcount == 0:
-        conn.close()
+async def delete_book(book_id: int, _: str = Depends(get_write_api_key)):
+    deleted, books_versions = await db_writer.write(_delete_book, book_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Book not found")
-    conn.commit()
-    conn.close()
+    versions.refresh()
+    catalog_snapshot.delete(books_versions, book_id)
+    similar_index.delete(books_versions, book_id)
     return {"detail": "Book deleted"}
+
+
+def _create_book_item(cursor, book):
+    book_id, _ = _insert_book(cursor, book)
+    return "created", book_id
+
+
+# Upsert keyed by book_link: update the book that already has the link, otherwise create it
+def _upsert_book_item(cursor, book):
+    if book.book_link:
+        existing = cursor.execute("SELECT id FROM books WHERE book_link = ?" + LINKED_BOOKS,
+                                  (book.book_link,)).fetchone()
+        if existing is not None:
+            _update_book(cursor, existing[0], book)
+            return "updated", existing[0]
+    return _create_book_item(cursor, book)
+
+
+def _delete_book_item(cursor, book_id):
+    cursor.execute("DELETE FROM books WHERE id = ?", (book_id,))
+    return ("deleted" if cursor.rowcount else "not_found"), book_id
+
+
+# Create or upsert many books from a JSON array or NDJSON body of BookCreate objects
+@router.post("/bulk", response_model=BulkResult)
+async def bulk_write_books(
+        request: Request,
+        mode: Literal["create", "upsert"] = Query("create", description="upsert matches existing books by book_link"),
+        _: str = Depends(get_write_api_key)
+):
+    write_item = _create_book_item if mode == "create" else _upsert_book_item
+    return await run_bulk(request, BookCreate.model_validate, write_item)
+
+
+# Delete many books from a JSON array or NDJSON body of book ids
+@router.post("/bulk/delete", response_model=BulkResult)
+async def bulk_delete_books(request: Request, _: str = Depends(get_write_api_key)):
+    return await run_bulk(request, parse_id, _delete_book_item)
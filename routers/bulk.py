@@ -0,0 +1,65 @@
+import sqlite3
+from collections import Counter
+from fastapi import Request
+from pydantic import ValidationError
+from database import db_writer
+from routers.caching import versions
+from routers.payloads import iter_json_items
+
+# Number of parsed items queued on the writer as one job
+BULK_CHUNK_SIZE = 1000
+
+
+# Write a chunk of validated items. Each item runs in its own savepoint, so a conflicting item is
+# rolled back on its own and reported while the rest of the batch carries on.
+def _write_chunk(conn, chunk, write_item):
+    results = []
+    cursor = conn.cursor()
+    for index, value in chunk:
+        cursor.execute("SAVEPOINT bulk_item")
+        try:
+            status, item_id = write_item(cursor, value)
+            results.append({"index": index, "status": status, "id": item_id})
+        except sqlite3.IntegrityError as e:
+            cursor.execute("ROLLBACK TO bulk_item")
+            results.append({"index": index, "status": "conflict", "detail": str(e)})
+        cursor.execute("RELEASE bulk_item")
+    return results
+
+
+# Run a bulk request: stream items out of the body, validate each with parse_item (raising
+# ValidationError/ValueError for invalid input) and write them with write_item(cursor, value) -> (status, id).
+# Each chunk of items is queued on the single writer and committed as one unit, so a body that is
+# cut off midway keeps the chunks already written (each one moves the versions of the tables it changed,
+# which is what invalidates cached responses).
+async def run_bulk(request: Request, parse_item, write_item):
+    results = []
+    chunk = []
+    try:
+        async for index, raw, error in iter_json_items(request):
+            if error is None:
+                try:
+                    chunk.append((index, parse_item(raw)))
+                except ValidationError as e:
+                    error = e.errors(include_url=False, include_context=False)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                results.append({"index": index, "status": "invalid", "detail": error})
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                results += await db_writer.write(_write_chunk, chunk, write_item)
+                chunk = []
+        if chunk:
+            results += await db_writer.write(_write_chunk, chunk, write_item)
+    finally:
+        versions.refresh()  # Earlier chunks are committed even when the body fails later on
+
+    results.sort(key=lambda result: result["index"])
+    return {"counts": dict(Counter(result["status"] for result in results)), "items": results}
+
+
+# Validate an element of a bulk delete body: a plain integer id
+def parse_id(raw):
+    if isinstance(raw, bool) or not isinstance(raw, int):
+        raise ValueError("Expected an integer id")
+    return raw
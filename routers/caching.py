@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import Request, Response
+from database import DB_MODE, connect, db_executor
+
+try:
+    import orjson
+except ImportError:  # The fast JSON encoder is optional; the standard library produces the same bytes
+    orjson = None
+
+# Total size of cached response bodies kept in memory, overridable through the environment / .env
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Seconds an in-memory copy of a table (the statistics snapshot, the similar-books index) may trail the table's
+# version before it is rebuilt; see VersionLag
+INDEX_STALE_GRACE = float(os.getenv("INDEX_STALE_GRACE", "1"))
+
+
+# Per-table data versions: the counters in the database's table_versions table, which triggers bump in the
+# transaction of every change, whoever makes it (this worker, another one, the CLI, any other client). They are
+# read again whenever PRAGMA data_version on a connection of our own shows that something was committed since
+# the last look, which costs a few microseconds when nothing was.
+class DataVersions:
+    def __init__(self, path=None):
+        self.path = path
+        self._conn = None
+        self._data_version = None
+        self._versions = {}
+        self._changed_at = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.reads = 0
+
+    # Call listener(tables) whenever the versions of some tables are seen to change, e.g. to wake requests
+    # waiting for new data
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _read(self):
+        if self._conn is None:
+            self._conn = connect(self.path, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        # Connections to a shared-cache memory database share one pager, whose data_version they do not bump
+        if data_version == self._data_version and DB_MODE != "memory":
+            return ()
+        try:
+            current = dict(self._conn.execute("SELECT name, version FROM table_versions").fetchall())
+        except sqlite3.OperationalError:
+            return ()  # Not created yet: every table is at version 0 until the migrations have run
+        self._data_version = data_version
+        self.reads += 1
+        changed = tuple(table for table, version in current.items() if self._versions.get(table) != version)
+        now = time.monotonic()
+        self._changed_at.update((table, now) for table in changed)
+        self._versions = current
+        return changed
+
+    # Look at the database now, e.g. right after a write, and tell the listeners what changed
+    def refresh(self):
+        with self._lock:
+            changed = self._read()
+        if changed:
+            for listener in self._listeners:
+                listener(changed)
+
+    def get(self, tables):
+        self.refresh()
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    # time.monotonic() when the current version of `table` was first seen
+    def changed_at(self, table):
+        with self._lock:
+            return self._changed_at.get(table, 0.0)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._data_version = None
+
+
+# How long an in-memory copy of `table` has been behind the table's version. A write in this process commits
+# before its route patches the copy, so being behind for a moment is normal; staying behind means a change the
+# copy is never told about (a bulk write, another worker, the CLI) and it is time to rebuild.
+class VersionLag:
+    def __init__(self, data_versions, table, grace=INDEX_STALE_GRACE):
+        self.versions = data_versions
+        self.table = table
+        self.grace = grace
+        self._since = None
+
+    # Called while the copy is behind: True once it has been for the grace period, counted from when the current
+    # version was first seen or, while writes keep moving the version, from when the copy was first seen behind
+    def expired(self):
+        now = time.monotonic()
+        if self._since is None:
+            self._since = now
+        return now - min(self._since, self.versions.changed_at(self.table)) >= self.grace
+
+    # Called when the copy has caught up or was patched
+    def clear(self):
+        self._since = None
+
+
+# LRU of encoded responses bounded by total body size. Entries remember the data versions they were
+# built from and are discarded on lookup once any of those tables has changed.
+class ResponseCache:
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, etag, body, headers):
+        size = len(body)
+        if size > self.max_bytes // 8:
+            return  # A single huge page would flush everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[2])
+            self._entries[key] = (version, etag, body, headers)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[2])
+                self.evictions += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+            }
+
+
+versions = DataVersions()
+response_cache = ResponseCache()
+
+# Distinguishes this process's ETags from those of other runs, which may encode the same data differently
+_INSTANCE = uuid.uuid4().hex[:8]
+
+
+def _etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+# orjson writes floats below 1e-4 or from 1e16 up without the exponent padding and sign that json.dumps
+# uses (1e-7 vs 1e-07, 1e16 vs 1e+16, 0.00001 vs 1e-05). A body that might contain such a number is
+# re-encoded with json; the patterns can also match inside strings, which only costs the fallback.
+# Both start with a literal so the scan skips ahead instead of trying every digit.
+_ORJSON_EXPONENT = re.compile(rb"e(?<=[0-9]e)[-0-9]")
+_ORJSON_SMALL = b"0.0000"
+
+
+def _encode_stdlib(content):
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+# Encode like FastAPI's JSONResponse so cached and uncached bodies are byte-identical.
+# With orjson installed the same bytes come out several times faster.
+def encode_json(content):
+    if orjson is not None:
+        try:
+            body = orjson.dumps(content)
+        except orjson.JSONEncodeError:  # e.g. integers beyond 64 bits; json.dumps decides
+            return _encode_stdlib(content)
+        if _ORJSON_SMALL not in body and not _ORJSON_EXPONENT.search(body):
+            return body
+    return _encode_stdlib(content)
+
+
+# Serve a JSON read endpoint through the cache. The strong ETag is derived from the URL and the
+# versions of the tables the response depends on, so If-None-Match is answered with 304 from a header compare.
+# On a miss build(conn) runs on the database executor and returns (content, headers). A build whose content
+# may not match the current versions (e.g. answered from an index still catching up) sets
+# "Cache-Control: no-store" in its headers: it is then neither cached nor given an ETag.
+async def cached_json(request: Request, tables, build):
+    key = f"{request.url.netloc}{request.url.path}?{request.url.query}"  # Link headers embed the host
+    version = versions.get(tables)
+    digest = hashlib.blake2b(f"{key}|{version}".encode("utf-8"), digest_size=12).hexdigest()
+    etag = f'"{_INSTANCE}-{digest}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if _etag_matches(request, etag):
+        response_cache.record_not_modified()
+        return Response(status_code=304, headers=cache_headers)
+
+    entry = response_cache.get(key, version)
+    if entry is not None:
+        _, _, body, headers = entry
+    else:
+        content, headers = await db_executor.run(build)
+        body = encode_json(content)
+        if headers.get("Cache-Control") == "no-store":
+            return Response(content=body, media_type="application/json", headers=headers)
+        response_cache.put(key, version, etag, body, headers)
+    return Response(content=body, media_type="application/json", headers={**headers, **cache_headers})
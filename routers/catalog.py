@@ -0,0 +1,300 @@
+import csv
+import io
+import json
+import tempfile
+from collections import deque
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from auth.security import get_write_api_key
+from database import INGEST_BATCH_SIZE, db_executor, db_writer, fetch_genres, iterate_in_db, stream_connections, write_book_records
+from routers.caching import versions
+from routers.payloads import iter_ndjson, iter_text
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional
+    pa = pq = None
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = 5000
+# Genres are flattened into one CSV cell with this separator
+CSV_GENRE_SEPARATOR = "|"
+EXPORT_COLUMNS = ["id", "title", "author_id", "author", "book_link", "genres", "average_rating", "published_year"]
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _require_parquet():
+    if pa is None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Parquet support requires the optional pyarrow package")
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("title", pa.string()),
+        ("author_id", pa.int64()),
+        ("author", pa.string()),
+        ("book_link", pa.string()),
+        ("genres", pa.list_(pa.string())),
+        ("average_rating", pa.float64()),
+        ("published_year", pa.int64()),
+    ])
+
+
+# Pull the catalog (books joined with author names and genres) from the cursor in bounded batches
+def _iter_catalog_batches(stream, batch_size=EXPORT_BATCH_SIZE):
+    with stream as conn:
+        cursor = conn.execute('''
+            SELECT b.id, b.title, b.author_id, a.name, b.book_link, b.average_rating, b.published_year
+            FROM books b LEFT JOIN authors a ON a.id = b.author_id
+            ORDER BY b.id
+        ''')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            genres = fetch_genres(conn, [row[0] for row in rows])
+            yield [
+                {
+                    "id": row[0],
+                    "title": row[1],
+                    "author_id": row[2],
+                    "author": row[3],
+                    "book_link": row[4],
+                    "genres": genres[row[0]],
+                    "average_rating": row[5],
+                    "published_year": row[6]
+                }
+                for row in rows
+            ]
+
+
+def _export_ndjson(stream):
+    for batch in _iter_catalog_batches(stream):
+        yield "".join(json.dumps(book) + "\n" for book in batch)
+
+
+def _export_csv(stream):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _iter_catalog_batches(stream):
+        for book in batch:
+            writer.writerow([CSV_GENRE_SEPARATOR.join(book[column]) if column == "genres" else book[column]
+                             for column in EXPORT_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# Write-only file object collecting what the Parquet writer produces, so it can be yielded and dropped
+class _ParquetSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# One Parquet row group per export batch; each finished row group is flushed to the client
+def _export_parquet(stream):
+    sink = _ParquetSink()
+    schema = _parquet_schema()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in _iter_catalog_batches(stream):
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+@router.get("/export")
+async def export_catalog(format: Literal["csv", "ndjson", "parquet"] = Query("ndjson", description="Output format")):
+    if format == "parquet":
+        _require_parquet()
+    exporters = {"csv": _export_csv, "ndjson": _export_ndjson, "parquet": _export_parquet}
+    # A connection of its own for the whole download, like the list streams (see stream_rows)
+    stream = await db_executor.call(stream_connections.open)
+    return StreamingResponse(
+        iterate_in_db(exporters[format](stream)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="catalog.{format}"'},
+    )
+
+
+def _optional(value, convert):
+    if value is None or value == "":
+        return None
+    return convert(value)
+
+
+# Turn an exported row (any format) into a bulk loader record; authors are matched by name
+def _to_record(row):
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object")
+    title, author = row.get("title"), row.get("author")
+    if not title or not author:
+        raise ValueError("title and author are required")
+    genres = row.get("genres")
+    if isinstance(genres, str):
+        genres = [genre for genre in genres.split(CSV_GENRE_SEPARATOR) if genre]
+    return {
+        "title": title,
+        "author": author,
+        "book_link": row.get("book_link") or "",
+        "genres": list(genres) if genres is not None else None,  # No genres column keeps the stored genres
+        "average_rating": _optional(row.get("average_rating"), float),
+        "published_year": _optional(row.get("published_year"), int),
+    }
+
+
+class _NeedMoreLines(Exception):
+    pass
+
+
+# Line iterator for csv.reader over a body that is still arriving. When the lines run out before the body has
+# ended it raises _NeedMoreLines and puts back the lines of the unfinished record, which the reader (it starts
+# every record afresh) parses again once more text has been added.
+class _LineFeed:
+    def __init__(self):
+        self.lines = deque()
+        self.taken = []
+        self.pending = ""
+        self.ended = False
+
+    def add(self, text):
+        *lines, self.pending = (self.pending + text).split("\n")
+        self.lines.extend(line + "\n" for line in lines)
+
+    def end(self):
+        if self.pending:
+            self.lines.append(self.pending)
+        self.pending, self.ended = "", True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            if self.ended:
+                raise StopIteration
+            self.lines.extendleft(reversed(self.taken))
+            self.taken = []
+            raise _NeedMoreLines()
+        line = self.lines.popleft()
+        self.taken.append(line)
+        return line
+
+    # The non-blank records complete in the text added so far
+    def records(self, reader):
+        while True:
+            try:
+                values = next(reader)
+            except (_NeedMoreLines, StopIteration):
+                return
+            self.taken = []
+            if values and (len(values) > 1 or values[0].strip()):
+                yield values
+
+
+async def _iter_csv_rows(request: Request):
+    async def texts():
+        async for text in iter_text(request):
+            yield text
+        yield None
+
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    header = None
+    async for text in texts():
+        if text is None:
+            feed.end()
+        else:
+            feed.add(text)
+        for values in feed.records(reader):
+            if header is None:
+                header = values
+            else:
+                yield dict(zip(header, values))
+
+
+async def _iter_ndjson_rows(request: Request):
+    async for _, row, error in iter_ndjson(request):
+        yield row if error is None else error
+
+
+# Parquet keeps its metadata in the footer, so the body is spooled to a temporary file first
+async def _iter_parquet_rows(request: Request):
+    with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            parquet_file = pq.ParquetFile(spool)
+        except pa.ArrowInvalid as e:
+            raise HTTPException(status_code=400, detail=f"Invalid Parquet body: {e}")
+        for batch in parquet_file.iter_batches(batch_size=INGEST_BATCH_SIZE):
+            for row in batch.to_pylist():
+                yield row
+
+
+def _write_batch(conn, batch):
+    write_book_records(conn.cursor(), batch)
+
+
+# Load a catalog in any export format. Rows are upserted by book_link in batched transactions,
+# missing authors are created by name and ids from the source are not preserved.
+@router.post("/import")
+async def import_catalog(
+        request: Request,
+        format: Literal["csv", "ndjson", "parquet"] = Query("ndjson", description="Input format"),
+        batch_size: int = Query(INGEST_BATCH_SIZE, ge=1, le=100_000, description="Rows per transaction"),
+        _: str = Depends(get_write_api_key)
+):
+    if format == "parquet":
+        _require_parquet()
+    readers = {"csv": _iter_csv_rows, "ndjson": _iter_ndjson_rows, "parquet": _iter_parquet_rows}
+
+    imported, batches, invalid, errors = 0, 0, 0, []
+    batch = []
+    try:
+        index = 0
+        async for row in readers[format](request):
+            try:
+                if isinstance(row, str):
+                    raise ValueError(row)
+                batch.append(_to_record(row))
+            except ValueError as e:
+                invalid += 1
+                if len(errors) < 20:
+                    errors.append({"index": index, "detail": str(e)})
+            index += 1
+            if len(batch) >= batch_size:
+                await db_writer.write(_write_batch, batch)
+                imported, batches, batch = imported + len(batch), batches + 1, []
+        if batch:
+            await db_writer.write(_write_batch, batch)
+            imported, batches = imported + len(batch), batches + 1
+    finally:
+        versions.refresh()
+
+    return {"imported": imported, "batches": batches, "invalid": invalid, "errors": errors}
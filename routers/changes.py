@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+from fastapi import APIRouter, HTTPException, Query, Response
+from database import CHANGES_RETENTION, compact_changes, db_executor, db_writer
+from models.change import ChangeFeed
+from routers.books import rows_to_books, select_books
+from routers.caching import encode_json, versions
+from routers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+# Longest a request may wait for changes (?wait=), and how often a waiting request looks at the log again,
+# which is how it notices writes made by other processes; writes in this process wake it right away
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "1"))
+# Seconds between the server's compactions of the change feed (0 leaves it to `database.py compact-changes`)
+CHANGES_COMPACT_INTERVAL = float(os.getenv("CHANGES_COMPACT_INTERVAL", "3600"))
+
+router = APIRouter()
+
+
+class ChangesCompacted(Exception):
+    def __init__(self, horizon):
+        super().__init__(f"Changes up to seq {horizon} have been compacted away")
+        self.horizon = horizon
+
+
+# Wakes requests waiting for changes whenever the books or authors version is seen to move
+class ChangeNotifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    def notify(self, tables=("books", "authors")):
+        if "books" not in tables and "authors" not in tables:
+            return
+        with self._lock:
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def wait(self, timeout):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def waiting(self):
+        with self._lock:
+            return len(self._waiters)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+change_notifier = ChangeNotifier()
+versions.subscribe(change_notifier.notify)
+
+
+# Drops old tombstones through the single writer every CHANGES_COMPACT_INTERVAL seconds
+class ChangeCompactor:
+    def __init__(self, interval=CHANGES_COMPACT_INTERVAL, retention=CHANGES_RETENTION):
+        self.interval = interval
+        self.retention = retention
+        self._task = None
+        self.runs = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        if self.interval > 0 and self.retention > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.dropped += await db_writer.write(_compact, self.retention)
+                self.runs += 1
+            except Exception:
+                self.errors += 1  # Locked out or busy: the next run catches up
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {"interval_seconds": self.interval, "retention_seconds": self.retention, "runs": self.runs,
+                "dropped": self.dropped, "errors": self.errors}
+
+
+def _compact(conn, retention):
+    return compact_changes(conn.cursor(), retention)
+
+
+change_compactor = ChangeCompactor()
+
+
+# Read one page of the feed after `since` and the current state of the entities it upserts. Everything is
+# read in one transaction, so the states are exactly the ones the returned changes describe.
+def _read_changes(conn, since, limit):
+    conn.execute("BEGIN")
+    try:
+        horizon = conn.execute("SELECT seq FROM changes_horizon WHERE id = 0").fetchone()[0]
+        if 0 < since < horizon:
+            raise ChangesCompacted(horizon)
+        rows = conn.execute("SELECT seq, entity, entity_id, op, changed_at FROM changes WHERE seq > ? "
+                            "ORDER BY seq LIMIT ?", (since, limit + 1)).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        states = {}
+        book_ids = [row[2] for row in rows if row[1] == "book" and row[3] == "upsert"]
+        author_ids = [row[2] for row in rows if row[1] == "author" and row[3] == "upsert"]
+        if book_ids:
+            books = conn.execute(select_books(None) + f" WHERE books.id IN ({', '.join('?' * len(book_ids))})",
+                                 book_ids).fetchall()
+            states.update((("book", book["id"]), book) for book in rows_to_books(conn, books))
+        if author_ids:
+            authors = conn.execute(f"SELECT id, name FROM authors WHERE id IN ({', '.join('?' * len(author_ids))})",
+                                   author_ids).fetchall()
+            states.update((("author", author_id), {"name": name, "id": author_id}) for author_id, name in authors)
+    finally:
+        conn.execute("COMMIT")
+
+    changes = []
+    for seq, entity, entity_id, op, changed_at in rows:
+        change = {"seq": seq, "entity": entity, "id": entity_id, "op": op, "changed_at": changed_at}
+        if op == "upsert":
+            change["data"] = states.get((entity, entity_id))
+        changes.append(change)
+    return {"since": since, "next_since": rows[-1][0] if rows else since, "has_more": has_more, "changes": changes}
+
+
+# Books and authors changed after `since`, oldest first, each only with its latest change: an upsert carrying
+# the current book or author, or a delete tombstone. Start a replica from since=0, which lists every entity,
+# then keep passing next_since. With ?wait= the request is held until there is at least one change or the
+# wait is over (long polling). A client that last synced before tombstones were compacted away gets 410 and
+# has to start over from since=0.
+@router.get("/", response_model=ChangeFeed)
+async def get_changes(
+        since: int = Query(0, ge=0, description="Only return changes after this seq (0 for the whole catalog)"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of changes"),
+        wait: float = Query(0, ge=0, le=CHANGES_MAX_WAIT,
+                            description="Seconds to wait for a change when there is none yet")
+):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        try:
+            feed = await db_executor.run(_read_changes, since, limit)
+        except ChangesCompacted as e:
+            raise HTTPException(status_code=410, detail=f"{e}; resync from since=0")
+        remaining = deadline - loop.time()
+        if feed["changes"] or remaining <= 0:
+            return Response(content=encode_json(feed), media_type="application/json")
+        await change_notifier.wait(min(remaining, CHANGES_POLL_INTERVAL))
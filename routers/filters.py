@@ -0,0 +1,80 @@
+from typing import List, Literal, Optional
+from fastapi import HTTPException, Query
+from database import normalize_genres
+from routers.pagination import MAX_PAGE_SIZE
+
+
+# Query parameters shared by every endpoint that narrows down the books table.
+# Each filter is answered from an index: author_id, published_year, average_rating or book_genres. SQLite only
+# prefers the year and rating indexes to walking the ids in order when it has their statistics (see _analyze).
+class BookFilters:
+    def __init__(
+            self,
+            author_id: Optional[int] = Query(None, description="Only books by this author"),
+            year_min: Optional[int] = Query(None, description="Earliest published year (inclusive)"),
+            year_max: Optional[int] = Query(None, description="Latest published year (inclusive)"),
+            rating_min: Optional[float] = Query(None, ge=0, le=5, description="Lowest average rating (inclusive)"),
+            rating_max: Optional[float] = Query(None, ge=0, le=5, description="Highest average rating (inclusive)"),
+            genre: Optional[List[str]] = Query(None, description="Only books tagged with these genres"),
+            genre_match: Literal["any", "all"] = Query("any", description="Match any or all of the requested genres")
+    ):
+        self.author_id = author_id
+        self.year_min = year_min
+        self.year_max = year_max
+        self.rating_min = rating_min
+        self.rating_max = rating_max
+        self.genre = genre
+        self.genre_match = genre_match
+
+    # SQL fragment (starting with " AND ...") and parameters restricting books to the filters.
+    # column_prefix lets callers qualify columns when books is aliased in a join.
+    def where(self, conn, column_prefix=""):
+        sql, params = "", []
+        for column, op, value in (
+                ("author_id", "=", self.author_id),
+                ("published_year", ">=", self.year_min),
+                ("published_year", "<=", self.year_max),
+                ("average_rating", ">=", self.rating_min),
+                ("average_rating", "<=", self.rating_max),
+        ):
+            if value is not None:
+                sql += f" AND {column_prefix}{column} {op} ?"
+                params.append(value)
+        if self.genre:
+            genre_sql, genre_params = genre_filter(conn, self.genre, self.genre_match, column_prefix)
+            sql += genre_sql
+            params += genre_params
+        return sql, params
+
+
+# Build the SQL filter for ?genre=..., answered from idx_book_genres_genre.
+# With match="all" a book needs every listed genre, with match="any" at least one of them.
+def genre_filter(conn, genres, match, column_prefix=""):
+    names = normalize_genres(genres)
+    placeholders = ", ".join("?" * len(names))
+    genre_ids = [row[0] for row in
+                 conn.execute(f"SELECT id FROM genres WHERE name IN ({placeholders})", names).fetchall()]
+    if not genre_ids or (match == "all" and len(genre_ids) < len(names)):
+        return " AND 0", []  # An unknown genre can never match
+
+    placeholders = ", ".join("?" * len(genre_ids))
+    subquery = f"SELECT book_id FROM book_genres WHERE genre_id IN ({placeholders})"
+    params = list(genre_ids)
+    if match == "all" and len(genre_ids) > 1:
+        subquery += " GROUP BY book_id HAVING COUNT(*) = ?"
+        params.append(len(genre_ids))
+    return f" AND {column_prefix}id IN ({subquery})", params
+
+
+# ?ids=1,2,3 batch lookups: sorted, de-duplicated ids, at most MAX_PAGE_SIZE of them
+def id_list(ids: Optional[str] = Query(
+        None, description="Comma-separated ids to fetch in one request (ignores limit and the cursor)")):
+    if ids is None:
+        return None
+    try:
+        values = sorted({int(value) for value in ids.split(",") if value.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(values) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids can be requested at once")
+    return values
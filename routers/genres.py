@@ -0,0 +1,22 @@
+from typing import List
+from fastapi import APIRouter, Request
+from models.genre import GenreCount
+from routers.caching import cached_json
+
+router = APIRouter()
+
+
+# Every genre with its number of books, counted from the covering (genre_id, book_id) index
+@router.get("/", response_model=List[GenreCount])
+async def get_genres(request: Request):
+    return await cached_json(request, ("books",), _count_genres)
+
+
+def _count_genres(conn):
+    genres = conn.execute('''
+        SELECT g.id, g.name, COUNT(bg.book_id) AS book_count
+        FROM genres g LEFT JOIN book_genres bg ON bg.genre_id = g.id
+        GROUP BY g.id
+        ORDER BY book_count DESC, g.name
+    ''').fetchall()
+    return [{"id": genre[0], "name": genre[1], "book_count": genre[2]} for genre in genres], {}
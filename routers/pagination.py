@@ -0,0 +1,72 @@
+import json
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from database import db_executor, iterate_in_db, stream_connections
+
+# Page size used when the client does not pass ?limit=
+DEFAULT_PAGE_SIZE = 100
+# Upper bound for ?limit= so a single page can never turn into a full table dump
+MAX_PAGE_SIZE = 1000
+# Number of rows pulled from the cursor per fetchmany() call while streaming
+STREAM_BATCH_SIZE = 500
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+# Split a keyset page fetched with LIMIT limit + 1 into the rows to return and the next cursor
+def split_page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][0]
+    return rows, None
+
+
+# Link (RFC 8288) and X-Next-Cursor headers advertising the next page
+def next_link_headers(request: Request, next_cursor, param="after"):
+    if next_cursor is None:
+        return {}
+    next_url = request.url.include_query_params(**{param: next_cursor})
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": str(next_cursor)}
+
+
+def set_next_link(request: Request, response: Response, next_cursor, param="after"):
+    response.headers.update(next_link_headers(request, next_cursor, param))
+
+
+# Run the query on the stream's connection and encode rows pulled from the cursor in batches,
+# so memory stays flat regardless of table size. to_dicts(conn, rows) turns one batch into dicts.
+def _iter_rows(stream, query, params, to_dicts, fmt, batch_size):
+    with stream as conn:
+        cursor = conn.execute(query, params)
+        first = True
+        if fmt == "json":
+            yield "["
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunk = []
+            for item in to_dicts(conn, rows):
+                encoded = json.dumps(item)
+                if fmt == "json":
+                    chunk.append(encoded if first else "," + encoded)
+                else:
+                    chunk.append(encoded + "\n")
+                first = False
+            yield "".join(chunk)
+        if fmt == "json":
+            yield "]"
+
+
+# Stream the result of a query as NDJSON or as a chunked JSON array. The stream gets a connection of its own
+# before the response starts (or a 503 when DB_STREAM_LIMIT streams are already running), closed when the
+# stream ends; each batch is read on the database executor.
+async def stream_rows(query, params, to_dicts, fmt, batch_size=STREAM_BATCH_SIZE):
+    stream = await db_executor.call(stream_connections.open)
+    return StreamingResponse(
+        iterate_in_db(_iter_rows(stream, query, params, to_dicts, fmt, batch_size)),
+        media_type=STREAM_MEDIA_TYPES[fmt],
+    )
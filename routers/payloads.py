@@ -0,0 +1,103 @@
+import codecs
+import json
+from fastapi import HTTPException, Request
+
+# Content types treated as one JSON document per line; anything else must be a JSON array
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+async def iter_text(request: Request):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in request.stream():
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def iter_ndjson(request: Request):
+    buffer = ""
+    line_number = 0
+    async for text in iter_text(request):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line), None
+                except json.JSONDecodeError as e:
+                    yield line_number, None, f"Invalid JSON: {e.msg}"
+                line_number += 1
+    if buffer.strip():
+        try:
+            yield line_number, json.loads(buffer), None
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e.msg}"
+
+
+# Decode the elements of a top-level JSON array as the bytes arrive. A value is only accepted once the
+# "," or "]" after it is in the buffer (or the body ended), so a number split across chunks is never cut.
+async def _iter_json_array(request: Request):
+    buffer = ""
+    expecting = "["  # "[" before the array, "value" after "[" or ",", "," after a value, "end" after "]"
+    index = 0
+
+    def skip_whitespace(pos):
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    async def chunks():
+        async for text in iter_text(request):
+            yield text, False
+        yield "", True
+
+    async for text, final in chunks():
+        buffer += text
+        pos = 0
+        while True:
+            pos = skip_whitespace(pos)
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if expecting == "[":
+                if char != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array or NDJSON body")
+                expecting, pos = "value", pos + 1
+            elif expecting == "," and char in ",]":
+                expecting, pos = ("value" if char == "," else "end"), pos + 1
+            elif expecting == "value" and char == "]" and index == 0:
+                expecting, pos = "end", pos + 1
+            elif expecting == "value":
+                try:
+                    value, end = _decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise HTTPException(status_code=400, detail="Malformed JSON array body")
+                    break  # Wait for more data
+                following = skip_whitespace(end)
+                if not final and (following == len(buffer) or buffer[following] not in ",]"):
+                    break  # The value may go on in the next chunk: "-1." decodes as -1 before "5e3" arrives
+                yield index, value, None
+                index += 1
+                expecting, pos = ",", end
+            else:
+                raise HTTPException(status_code=400, detail="Malformed JSON array body")
+        buffer = buffer[pos:]
+
+    if expecting != "end":
+        raise HTTPException(status_code=400, detail="Malformed JSON array body")
+
+
+# Iterate over (index, item, error) for every element of a JSON array or NDJSON request body,
+# without buffering the whole payload. error is set, and item None, for NDJSON lines that aren't JSON.
+def iter_json_items(request: Request):
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return iter_ndjson(request)
+    return _iter_json_array(request)
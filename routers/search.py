@@ -0,0 +1,76 @@
+import re
+import sqlite3
+from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from models.search import SearchHit
+from database import db_executor, fetch_genres
+from routers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, set_next_link
+
+router = APIRouter()
+
+# bm25 column weights for books_fts (title, author, genres)
+TITLE_WEIGHT, AUTHOR_WEIGHT, GENRES_WEIGHT = 10.0, 5.0, 1.0
+TERM_PATTERN = re.compile(r"\w+\*?")
+
+
+# Turn free text into an FTS5 query: every term is quoted so user input can't inject query syntax,
+# terms ending in * stay prefix queries and, with prefix=True, so does the last term (search as you type)
+def _fts_query(q, prefix):
+    terms = TERM_PATTERN.findall(q)
+    if not terms:
+        return None
+    parts = []
+    for i, term in enumerate(terms):
+        is_prefix = term.endswith("*") or (prefix and i == len(terms) - 1)
+        parts.append(f'"{term.rstrip("*")}"' + ("*" if is_prefix else ""))
+    return " ".join(parts)
+
+
+def _search(conn, match, limit, offset):
+    hits = conn.execute(f'''
+        SELECT f.rowid, b.title, b.author_id, f.author, b.average_rating, b.published_year,
+               bm25(books_fts, {TITLE_WEIGHT}, {AUTHOR_WEIGHT}, {GENRES_WEIGHT}) AS score,
+               snippet(books_fts, -1, '<b>', '</b>', '…', 12)
+        FROM books_fts f JOIN books b ON b.id = f.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset)).fetchall()
+    return hits, fetch_genres(conn, [hit[0] for hit in hits[:limit]])
+
+
+@router.get("/", response_model=List[SearchHit])
+async def search_books(
+        request: Request,
+        response: Response,
+        q: str = Query(..., min_length=1, description="Words to look for in titles, author names and genres"),
+        prefix: bool = Query(True, description="Treat the last word as a prefix"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of hits per page"),
+        offset: int = Query(0, ge=0, description="Number of ranked hits to skip")
+):
+    match = _fts_query(q, prefix)
+    if match is None:
+        return []
+
+    try:
+        hits, genres = await db_executor.run(_search, match, limit, offset)
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e}")
+
+    if len(hits) > limit:
+        hits = hits[:limit]
+        set_next_link(request, response, offset + limit, param="offset")
+    return [
+        {
+            "id": hit[0],
+            "title": hit[1],
+            "author_id": hit[2],
+            "author": hit[3],
+            "genres": genres[hit[0]],
+            "average_rating": hit[4],
+            "published_year": hit[5],
+            "score": hit[6],
+            "snippet": hit[7]
+        }
+        for hit in hits
+    ]
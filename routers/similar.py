@@ -0,0 +1,425 @@
+import itertools
+import os
+import threading
+import time
+from database import DATABASE_URL, DB_MODE, connect, table_version
+from routers.caching import VersionLag, versions
+
+try:
+    import numpy as np
+except ImportError:  # The similarity index is optional; without NumPy /similar answers 503
+    np = None
+
+# MinHash/LSH banding over each book's genre set: SIMILAR_BANDS bands of SIMILAR_ROWS hashes each. More rows per
+# band make buckets smaller and faster to scan; more bands find pairs with a lower Jaccard similarity.
+SIMILAR_INDEX = os.getenv("SIMILAR_INDEX", "1") != "0"
+SIMILAR_INDEX_ENABLED = SIMILAR_INDEX and np is not None
+SIMILAR_BANDS = int(os.getenv("SIMILAR_BANDS", "8"))
+SIMILAR_ROWS = int(os.getenv("SIMILAR_ROWS", "4"))
+
+_SEED = 1729  # Fixed so a saved index and a fresh process hash genres the same way
+_PRIME = (1 << 31) - 1
+_MIX = np.uint64(0x9E3779B97F4A7C15) if np is not None else None
+_INITIAL_CAPACITY = 1024
+# Rows written since the bands were sorted, compared one by one on every query until the bands are re-sorted
+_MAX_RECENT = 4096
+
+
+# Band keys of genre sets laid out back to back in `genres` (rows start at `starts`, none empty):
+# one uint32 per band and row, hashed from the band's SIMILAR_ROWS minimum hashes
+def _band_keys(genres, starts, multipliers, offsets):
+    hashes = len(multipliers)
+    keys = np.empty((hashes // SIMILAR_ROWS, len(starts)), dtype=np.uint32)
+    for band in range(len(keys)):
+        key = np.zeros(len(starts), dtype=np.uint64)
+        for h in range(band * SIMILAR_ROWS, (band + 1) * SIMILAR_ROWS):
+            minimum = np.minimum.reduceat((multipliers[h] * genres + offsets[h]) % _PRIME, starts)
+            key = (key * _MIX) ^ minimum.astype(np.uint64)  # Wraps around, which is what mixing wants
+        keys[band] = ((key * _MIX) >> np.uint64(32)).astype(np.uint32)
+    return keys
+
+
+def _hash_parameters():
+    rng = np.random.default_rng(_SEED)
+    count = SIMILAR_BANDS * SIMILAR_ROWS
+    return rng.integers(1, _PRIME, count, dtype=np.int64), rng.integers(0, _PRIME, count, dtype=np.int64)
+
+
+# Similar books by genre set: MinHash signatures of every book's genre ids, cut into bands whose keys are kept
+# sorted so the books sharing a band with a query are found with binary searches. Candidates are ranked by their
+# exact Jaccard similarity, then by closeness of published_year and by average_rating. When the bands turn up
+# fewer than k related books the whole catalog is scanned instead.
+#
+# The index is saved next to the database together with the books version it reflects, and reused on startup
+# when the database is still at that version. Single-book writes through the book routes update it in place;
+# any other write (bulk, import, another worker, the CLI) leaves it behind the books version, and once it has
+# trailed for INDEX_STALE_GRACE seconds a rebuild runs in the background while it keeps answering.
+class SimilarityIndex:
+    def __init__(self, path=DATABASE_URL, data_versions=versions):
+        self.path = path
+        self.versions = data_versions
+        self.index_path = os.path.splitext(path)[0] + ".similar.npz"
+        self._lock = threading.Lock()
+        self._version = None  # Data version of the books table the index reflects, None until loaded
+        self._lag = VersionLag(data_versions, "books")
+        self._loaded = False
+        self._rebuilding = False
+        self._dirty = False
+        self._size = 0
+        self.builds = 0
+        self.loads = 0
+        self.saves = 0
+        self.build_seconds = 0.0
+        self.updates = 0
+        self.queries = 0
+        self.scans = 0
+
+    # Load the saved index, or build one, in the background
+    def refresh(self):
+        if not SIMILAR_INDEX_ENABLED:
+            return
+        with self._lock:
+            self._start_rebuild(reuse_saved=True)
+
+    def _start_rebuild(self, reuse_saved=False):
+        if not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, args=(reuse_saved,), name="similarity-index", daemon=True).start()
+
+    def _rebuild(self, reuse_saved):
+        try:
+            started = time.perf_counter()
+            arrays = _load_saved(self.index_path, self.path) if reuse_saved else None
+            built = arrays is None
+            if built:
+                arrays = _build(self.path)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._set_arrays(arrays)
+                self._version = int(arrays["version"])
+                self._lag.clear()
+                self._loaded = True
+                if built:
+                    self.builds += 1
+                    self.build_seconds = elapsed
+                else:
+                    self.loads += 1
+                self._dirty = built
+            if built:
+                self.save()
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _set_arrays(self, arrays):
+        self._ids = arrays["ids"]
+        self._size = int(arrays["size"])
+        self._alive = arrays["alive"]
+        self._ratings = arrays["ratings"]
+        self._years = arrays["years"]
+        self._starts = arrays["starts"]
+        self._ends = arrays["ends"]
+        self._genres = arrays["genres"]
+        self._genres_used = int(arrays["genres_used"])
+        self._band_order = arrays["band_order"]
+        self._band_keys = arrays["band_keys"]
+        self._multipliers, self._offsets = arrays["multipliers"], arrays["offsets"]
+        self._recent = []
+        self._recent_keys = []
+
+    def _arrays(self):
+        return {
+            "size": self._size, "ids": self._ids, "alive": self._alive, "ratings": self._ratings,
+            "years": self._years, "starts": self._starts, "ends": self._ends, "genres": self._genres,
+            "genres_used": self._genres_used, "band_order": self._band_order, "band_keys": self._band_keys,
+            "multipliers": self._multipliers, "offsets": self._offsets,
+            "settings": np.array([SIMILAR_BANDS, SIMILAR_ROWS, _SEED]), "version": self._version,
+        }
+
+    # Write the index next to the database; a rename makes the new file appear whole
+    # (not for an in-memory database, which is gone with the process; beside a snapshot only if it is writable)
+    def save(self):
+        if not SIMILAR_INDEX_ENABLED or DB_MODE == "memory":
+            return
+        with self._lock:
+            if not self._loaded or not self._dirty:
+                return
+            self._sort_recent()
+            # Copied so writes applied while the file is written cannot tear it
+            arrays = {name: np.copy(value) for name, value in self._arrays().items()}
+            self._dirty = False
+        temporary = self.index_path + ".tmp"
+        try:
+            with open(temporary, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, self.index_path)
+        except OSError:
+            if DB_MODE != "snapshot":
+                raise
+            return  # Read-only replica: rebuilt on every start instead
+        self.saves += 1
+
+    # Apply a single-book change made by a write that moved the books version from before to after
+    # (`books_versions`). Only an index at exactly `before` is patched; otherwise it stays stale for a rebuild.
+    def _update(self, books_versions, change, *args):
+        if not SIMILAR_INDEX_ENABLED:
+            return
+        before, after = books_versions
+        with self._lock:
+            if not self._loaded or self._version != before:
+                return
+            if change(*args):
+                self._version = after
+                self._lag.clear()
+                self._dirty = True
+                self.updates += 1
+
+    def upsert(self, books_versions, book_id, book, genre_ids):
+        self._update(books_versions, self._upsert, book_id, book, genre_ids)
+
+    def delete(self, books_versions, book_id):
+        self._update(books_versions, self._delete, book_id)
+
+    def _position(self, book_id):
+        position = int(np.searchsorted(self._ids[:self._size], book_id))
+        return position, position < self._size and self._ids[position] == book_id
+
+    def _upsert(self, book_id, book, genre_ids):
+        position, found = self._position(book_id)
+        if not found:
+            if position < self._size:
+                return False  # An id below the newest one: leave the insert to a rebuild
+            self._append(book_id)
+        self._alive[position] = True
+        self._ratings[position] = book.average_rating if book.average_rating is not None else np.nan
+        self._years[position] = book.published_year if book.published_year is not None else np.nan
+        genres = np.unique(np.array(genre_ids, dtype=np.int64))
+        # The new genre list goes after the last one; the space of the old list is left behind until a rebuild
+        start = self._genres_used
+        if start + len(genres) > len(self._genres):
+            self._genres = _resized(self._genres, max(2 * len(self._genres), start + len(genres)))
+        self._genres[start:start + len(genres)] = genres
+        self._genres_used += len(genres)
+        self._starts[position], self._ends[position] = start, start + len(genres)
+        if len(genres):
+            self._recent.append(position)
+            self._recent_keys.append(self._keys_of(genres))
+            if len(self._recent) > _MAX_RECENT:
+                self._sort_recent()
+        return True
+
+    def _delete(self, book_id):
+        position, found = self._position(book_id)
+        if found:
+            self._alive[position] = False
+        return True
+
+    def _append(self, book_id):
+        if self._size == len(self._ids):
+            capacity = max(_INITIAL_CAPACITY, 2 * len(self._ids))
+            self._ids, self._alive, self._ratings, self._years, self._starts, self._ends = (
+                _resized(column, capacity) for column in
+                (self._ids, self._alive, self._ratings, self._years, self._starts, self._ends))
+        self._ids[self._size] = book_id
+        self._size += 1
+
+    def _keys_of(self, genres):
+        return _band_keys(genres, np.zeros(1, dtype=np.int64), self._multipliers, self._offsets)[:, 0]
+
+    # Fold the rows written since the last sort into the sorted bands
+    def _sort_recent(self):
+        if not self._recent:
+            return
+        bands = len(self._band_keys)
+        count = self._band_order.shape[1]
+        recent = np.array(self._recent, dtype=self._band_order.dtype)
+        order = np.concatenate([self._band_order, np.tile(recent, (bands, 1))], axis=1)
+        keys = np.concatenate([self._band_keys, np.array(self._recent_keys, dtype=np.uint32).T], axis=1)
+        # Drop the entries of rows that were written again since; their new keys are among the recent ones
+        stale = np.isin(order[:, :count], recent)
+        stale = np.concatenate([stale, np.zeros((bands, len(recent)), dtype=bool)], axis=1)
+        self._band_order = np.empty((bands, order.shape[1] - int(stale[0].sum())), dtype=order.dtype)
+        self._band_keys = np.empty(self._band_order.shape, dtype=np.uint32)
+        for band in range(bands):
+            band_order, band_keys = order[band][~stale[band]], keys[band][~stale[band]]
+            by_key = np.argsort(band_keys, kind="stable")
+            self._band_order[band], self._band_keys[band] = band_order[by_key], band_keys[by_key]
+        self._recent = []
+        self._recent_keys = []
+
+    # Positions of the books sharing a band key with `keys`
+    def _candidates(self, keys):
+        found = []
+        for band, key in enumerate(keys):
+            start = np.searchsorted(self._band_keys[band], key, side="left")
+            stop = np.searchsorted(self._band_keys[band], key, side="right")
+            found.append(self._band_order[band][start:stop])
+        if self._recent:
+            matches = (np.array(self._recent_keys, dtype=np.uint32) == keys).any(axis=1)
+            found.append(np.array(self._recent, dtype=np.int64)[matches])
+        return np.unique(np.concatenate(found))
+
+    # Jaccard similarity between `genres` and the genre sets of the books at `positions`
+    def _jaccard(self, positions, genres):
+        lengths = self._ends[positions] - self._starts[positions]
+        shared = np.isin(self._genres[_flat_positions(self._starts[positions], lengths)], genres)
+        intersection = np.bincount(np.repeat(np.arange(len(positions)), lengths), weights=shared,
+                                   minlength=len(positions))
+        return intersection / np.maximum(len(genres) + lengths - intersection, 1)
+
+    # Up to k (book id, similarity) pairs most similar to the given book and whether the index is at the current
+    # books version (a stale answer must not be cached as the current one), or None before the index is loaded
+    def similar(self, book_id, genre_ids, rating, year, k):
+        if not SIMILAR_INDEX_ENABLED:
+            return None
+        with self._lock:
+            if not self._loaded:
+                return None
+            current = self._version == self.versions.get(("books",))[0]
+            if current:
+                self._lag.clear()
+            elif self._lag.expired():
+                self._start_rebuild()  # Answer from the stale index meanwhile
+            self.queries += 1
+            genres = np.unique(np.array(genre_ids, dtype=np.int64))
+            if not len(genres):
+                return [], current
+            positions = self._candidates(self._keys_of(genres))
+            positions = positions[self._alive[positions] & (self._ids[positions] != book_id)]
+            scores = self._jaccard(positions, genres)
+            if np.count_nonzero(scores) < k:
+                self.scans += 1
+                positions = np.flatnonzero(self._alive[:self._size] & (self._ids[:self._size] != book_id))
+                scores = self._jaccard(positions, genres)
+            related = scores > 0
+            return self._rank(positions[related], scores[related], rating, year, k), current
+
+    def _rank(self, positions, scores, rating, year, k):
+        if len(positions) > k:
+            # Only books scoring at least the k-th best can make it; ties at that score are all ranked
+            keep = scores >= np.partition(scores, len(scores) - k)[len(scores) - k]
+            positions, scores = positions[keep], scores[keep]
+        years = self._years[positions]
+        year_gap = np.abs(years - year) if year is not None else np.zeros(len(positions))
+        ratings = self._ratings[positions]
+        order = np.lexsort((self._ids[positions], -np.nan_to_num(ratings, nan=-np.inf),
+                           np.nan_to_num(year_gap, nan=np.inf), -scores))[:k]
+        return list(zip(self._ids[positions[order]].tolist(), scores[order].tolist()))
+
+    def stats(self):
+        with self._lock:
+            arrays = {}
+            if self._loaded:
+                arrays = {
+                    "rows": self._ids.nbytes + self._alive.nbytes + self._ratings.nbytes + self._years.nbytes,
+                    "genre_lists": self._starts.nbytes + self._ends.nbytes + self._genres.nbytes,
+                    "bands": self._band_order.nbytes + self._band_keys.nbytes,
+                }
+            return {
+                "enabled": SIMILAR_INDEX_ENABLED,
+                "loaded": self._loaded,
+                "stale": self._loaded and self._version != self.versions.get(("books",))[0],
+                "rebuilding": self._rebuilding,
+                "rows": self._size,
+                "bands": SIMILAR_BANDS,
+                "rows_per_band": SIMILAR_ROWS,
+                "recent": len(self._recent) if self._loaded else 0,
+                "bytes": sum(arrays.values()),
+                "array_bytes": arrays,
+                "file_bytes": os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0,
+                "builds": self.builds,
+                "build_seconds": round(self.build_seconds, 3),
+                "loads": self.loads,
+                "saves": self.saves,
+                "updates": self.updates,
+                "queries": self.queries,
+                "scans": self.scans,
+            }
+
+
+def _resized(column, size):
+    grown = np.zeros(size, dtype=column.dtype)
+    grown[:len(column)] = column
+    return grown
+
+
+# Indexes into a flat array of the rows starting at `starts` with `lengths` elements each, back to back
+def _flat_positions(starts, lengths):
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+
+# Build every array of the index in one read transaction, so the rows, the genres and the version agree
+def _build(path):
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN")
+        version = table_version(conn, "books")
+        rows = conn.execute("SELECT id, average_rating, published_year FROM books ORDER BY id")
+        ids, ratings, years = [], [], []
+        for book_id, rating, year in rows:
+            ids.append(book_id)
+            ratings.append(rating)
+            years.append(year)
+        ids = np.array(ids, dtype=np.int64)
+        size = len(ids)
+        # (book_id, genre_id) pairs in primary key order, so every book's genres are adjacent and sorted
+        pairs = conn.execute("SELECT book_id, genre_id FROM book_genres ORDER BY book_id, genre_id")
+        pairs = np.fromiter(itertools.chain.from_iterable(pairs), dtype=np.int64).reshape(-1, 2)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    positions = np.searchsorted(ids, pairs[:, 0])
+    inside = positions < size
+    inside[inside] = ids[positions[inside]] == pairs[inside, 0]  # Skips rows left by books that no longer exist
+    positions, genres = positions[inside], pairs[inside, 1]
+    rows = np.arange(size)
+    starts = np.searchsorted(positions, rows, side="left")
+    ends = np.searchsorted(positions, rows, side="right")
+
+    multipliers, offsets = _hash_parameters()
+    tagged = np.flatnonzero(ends > starts)
+    keys = _band_keys(genres, starts[tagged], multipliers, offsets) if len(genres) else \
+        np.empty((SIMILAR_BANDS, 0), dtype=np.uint32)
+    band_order = np.argsort(keys, axis=1, kind="stable")
+    capacity = max(_INITIAL_CAPACITY, size)
+    return {
+        "version": version,
+        "size": size,
+        "ids": _resized(ids, capacity),
+        "alive": _resized(np.ones(size, dtype=bool), capacity),
+        "ratings": _resized(np.array(ratings, dtype=np.float64), capacity),  # None becomes NaN
+        "years": _resized(np.array(years, dtype=np.float64), capacity),
+        "starts": _resized(starts, capacity),
+        "ends": _resized(ends, capacity),
+        "genres": genres,
+        "genres_used": len(genres),
+        "band_order": tagged[band_order],
+        "band_keys": np.take_along_axis(keys, band_order, axis=1),
+        "multipliers": multipliers,
+        "offsets": offsets,
+    }
+
+
+# The saved index, if it was built with the current settings at the books version the database is still at
+def _load_saved(index_path, path):
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with np.load(index_path) as saved:
+            arrays = {name: saved[name] for name in saved.files}
+    except (OSError, ValueError):
+        return None  # Unreadable or half-written: rebuild
+    if arrays["settings"].tolist() != [SIMILAR_BANDS, SIMILAR_ROWS, _SEED]:
+        return None
+    conn = connect(path)
+    try:
+        if "version" not in arrays or int(arrays["version"]) != table_version(conn, "books"):
+            return None
+    finally:
+        conn.close()
+    return arrays
+
+
+similar_index = SimilarityIndex()
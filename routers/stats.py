@@ -0,0 +1,86 @@
+import json
+from typing import List
+from fastapi import APIRouter, Depends, Query, Request
+from models.stats import CatalogSummary, RatingCount, YearCount
+from routers.caching import cached_json
+from routers.filters import BookFilters
+from routers.snapshot import catalog_snapshot, mean_rating
+
+router = APIRouter()
+
+
+@router.get("/summary", response_model=CatalogSummary)
+async def get_summary(request: Request, filters: BookFilters = Depends()):
+    return await cached_json(request, ("books",), lambda conn: (_summary(conn, filters), {}))
+
+
+# Each statistic is answered from the columnar snapshot when it is current, otherwise from SQLite
+def _summary(conn, filters):
+    summary = catalog_snapshot.summary(filters)
+    if summary is not None:
+        return summary
+    filter_sql, params = filters.where(conn)
+    summary = conn.execute(f'''
+        SELECT COUNT(*), MIN(published_year), MAX(published_year),
+               MIN(average_rating), MAX(average_rating),
+               SUM(CAST(average_rating * 1000000 AS INTEGER)), COUNT(average_rating)
+        FROM books WHERE 1{filter_sql}
+    ''', params).fetchone()
+    return {
+        "book_count": summary[0],
+        "min_year": summary[1],
+        "max_year": summary[2],
+        "min_rating": summary[3],
+        "max_rating": summary[4],
+        "average_rating": mean_rating(summary[5], summary[6])  # Exactly as the snapshot averages
+    }
+
+
+@router.get("/books-by-year", response_model=List[YearCount])
+async def get_books_by_year(request: Request, filters: BookFilters = Depends()):
+    return await cached_json(request, ("books",), lambda conn: (_books_by_year(conn, filters), {}))
+
+
+def _books_by_year(conn, filters):
+    counts = catalog_snapshot.books_by_year(filters)
+    if counts is None:
+        filter_sql, params = filters.where(conn)
+        counts = conn.execute(f'''
+            SELECT published_year, COUNT(*) FROM books
+            WHERE published_year IS NOT NULL{filter_sql}
+            GROUP BY published_year ORDER BY published_year
+        ''', params).fetchall()
+    return [{"published_year": year, "count": count} for year, count in counts]
+
+
+@router.get("/books-by-rating", response_model=List[RatingCount])
+async def get_books_by_rating(
+        request: Request,
+        filters: BookFilters = Depends(),
+        bucket: float = Query(0.1, gt=0, le=5, description="Width of each rating bucket (0.01 groups exact ratings)")
+):
+    return await cached_json(request, ("books",), lambda conn: (_books_by_rating(conn, filters, bucket), {}))
+
+
+def _books_by_rating(conn, filters, bucket):
+    counts = catalog_snapshot.books_by_rating(filters, bucket)
+    if counts is not None:
+        # SQLite labels the buckets so they round exactly like the query below, which also merges buckets
+        # narrower than the rounding that end up with the same label
+        labels = conn.execute("SELECT ROUND(value * ?, 2) FROM json_each(?) ORDER BY key",
+                              (bucket, json.dumps([number for number, _ in counts]))).fetchall()
+        merged = []
+        for (label,), (_, count) in zip(labels, counts):
+            if merged and merged[-1]["average_rating"] == label:
+                merged[-1]["count"] += count
+            else:
+                merged.append({"average_rating": label, "count": count})
+        return merged
+    filter_sql, params = filters.where(conn)
+    # The small epsilon keeps ratings that sit exactly on a bucket edge (4.3 / 0.1) out of the bucket below
+    counts = conn.execute(f'''
+        SELECT ROUND(CAST(average_rating / ? + 1e-9 AS INTEGER) * ?, 2) AS bucket, COUNT(*) FROM books
+        WHERE average_rating IS NOT NULL{filter_sql}
+        GROUP BY bucket ORDER BY bucket
+    ''', [bucket, bucket] + params).fetchall()
+    return [{"average_rating": rating, "count": count} for rating, count in counts]
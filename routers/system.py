@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends
+from auth.security import get_api_key, key_registry
+from database import author_trigram_index, db_executor, db_writer, pool, stream_connections
+from routers.caching import response_cache
+from routers.changes import change_compactor, change_notifier
+from routers.similar import similar_index
+from routers.snapshot import catalog_snapshot
+
+router = APIRouter()
+
+
+# Connection pool statistics: connections checked out, waits for a free connection and time spent waiting,
+# plus the database executor, the group-commit writer (transactions vs. writes shows the batching) and the
+# connections of streaming responses
+@router.get("/pool", response_model=dict)
+async def get_pool_stats():
+    return {**pool.stats(), "executor": db_executor.stats(), "writer": db_writer.stats(),
+            "streams": stream_connections.stats()}
+
+
+# Response cache statistics: hits, misses, 304s served from the ETag alone, evictions and memory use
+@router.get("/cache", response_model=dict)
+async def get_cache_stats():
+    return response_cache.stats()
+
+
+# Columnar catalog snapshot behind the statistics endpoints: rows, memory per column and genre bitmaps,
+# rebuilds, incremental updates and queries answered from it vs. sent to SQLite while it was stale
+@router.get("/snapshot", response_model=dict)
+async def get_snapshot_stats():
+    return catalog_snapshot.stats()
+
+
+# Similar-books index: rows, memory, size of the saved file, builds vs. loads from the file, in-place updates,
+# queries and full scans for books the LSH bands found too few candidates for
+@router.get("/similar", response_model=dict)
+async def get_similar_stats():
+    return similar_index.stats()
+
+
+# Trigram postings cached for the fuzzy author lookup, and how often author writes invalidated them
+@router.get("/authors", response_model=dict)
+async def get_author_index_stats():
+    return author_trigram_index.stats()
+
+
+# Change feed: rows in the log, tombstones and the compaction horizon, requests waiting for changes
+# and the periodic compaction
+def _change_log_stats(conn):
+    rows, tombstones, head = conn.execute(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE op = 'delete'), MAX(seq) FROM changes").fetchone()
+    horizon = conn.execute("SELECT seq FROM changes_horizon WHERE id = 0").fetchone()[0]
+    return {"rows": rows, "tombstones": tombstones, "head": head or 0, "horizon": horizon}
+
+
+@router.get("/changes", response_model=dict)
+async def get_change_stats():
+    return {**await db_executor.run(_change_log_stats), "waiting": change_notifier.waiting(),
+            "compaction": change_compactor.stats()}
+
+
+# API key registry: number of keys, reloads of the key file, rejected keys and per-key request,
+# write and throttled counters (keys are identified by a fingerprint, never the key itself)
+@router.get("/keys", response_model=dict)
+async def get_key_stats(_: str = Depends(get_api_key)):
+    return key_registry.stats()
@@ -0,0 +1,32 @@
+import os
+import tempfile
+import pytest
+
+# The app reads its settings when it is imported: point it at a scratch database and key file before any test
+# imports it, so the suite never touches books.db or the developer's .env
+SCRATCH = tempfile.mkdtemp(prefix="book-tests-")
+API_KEY = "test-key"
+os.environ.update({
+    "DATABASE_URL": os.path.join(SCRATCH, "books.db"),
+    "DB_MODE": "rw",
+    "API_KEYS": API_KEY,
+    "API_KEYS_FILE": os.path.join(SCRATCH, ".env"),
+    "WRITE_RATE_LIMIT": "1000000",
+    "WRITE_RATE_BURST": "1000000",
+})
+
+
+# The app on a small generated catalog, started once for the whole run
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from benchmarks.generate import generate
+    from main import app
+    generate(os.environ["DATABASE_URL"], 300)
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def key():
+    return {"api-key": API_KEY}
@@ -0,0 +1,19 @@
+import asyncio
+
+
+# Just enough of a Starlette request for the body parsers: a content type and the body in the given chunks
+class ChunkedRequest:
+    def __init__(self, chunks, content_type="application/json"):
+        self.headers = {"content-type": content_type}
+        self._chunks = [chunk.encode("utf-8") if isinstance(chunk, str) else chunk for chunk in chunks]
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+# Everything an async generator over a ChunkedRequest yields
+def collect(iterate, chunks, content_type="application/json"):
+    async def run():
+        return [item async for item in iterate(ChunkedRequest(chunks, content_type))]
+    return asyncio.run(run())
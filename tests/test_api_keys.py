@@ -0,0 +1,74 @@
+import os
+import pytest
+from auth.security import KeyRegistry, fingerprint, key_registry
+
+
+def _write_keys(path, *keys):
+    with open(path, "w") as f:
+        f.write(f"API_KEYS={','.join(keys)}\n")
+    # Move the mtime on, so the rewrite is noticed even on file systems with a coarse mtime
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def key_file(tmp_path):
+    path = str(tmp_path / ".env")
+    _write_keys(path, "first", "second")
+    return path
+
+
+def test_every_listed_key_is_valid(key_file):
+    registry = KeyRegistry(key_file, reload_interval=0)
+    assert registry.identify("first") == fingerprint("first")
+    assert registry.identify("second") == fingerprint("second")
+    assert registry.identify("first,second") is None
+    assert registry.identify("firs") is None
+    assert registry.identify("") is None
+    assert registry.stats()["keys"] == 2
+    assert registry.stats()["rejected"] == 3
+
+
+def test_key_file_is_reloaded(key_file):
+    registry = KeyRegistry(key_file, reload_interval=0)
+    _write_keys(key_file, "second", "third")
+    assert registry.identify("third") == fingerprint("third")
+    assert registry.identify("first") is None  # Revoked
+    assert registry.identify("second") is not None
+    assert registry.stats()["reloads"] == 2
+
+
+def test_reload_waits_for_the_interval(key_file):
+    registry = KeyRegistry(key_file, reload_interval=3600)
+    registry.identify("first")
+    _write_keys(key_file, "third")
+    assert registry.identify("third") is None
+    assert registry.identify("first") is not None
+
+
+def test_write_tokens_are_per_key(key_file):
+    registry = KeyRegistry(key_file, reload_interval=0, rate=0.001, burst=2)
+    first, second = registry.identify("first"), registry.identify("second")
+    assert registry.acquire_write(first) == 0
+    assert registry.acquire_write(first) == 0
+    assert registry.acquire_write(first) > 0  # Bucket empty
+    assert registry.acquire_write(second) == 0  # The other key is unaffected
+    counters = registry.stats()["per_key"]
+    assert counters[first] == {"requests": 1, "writes": 2, "throttled": 1}
+    assert counters[second] == {"requests": 1, "writes": 1}
+
+
+def test_write_routes_answer_429_when_throttled(client, key, monkeypatch):
+    monkeypatch.setattr(key_registry, "rate", 0.001)
+    monkeypatch.setattr(key_registry, "burst", 1)
+    monkeypatch.setattr(key_registry, "_buckets", {})
+    assert client.delete("/api/books/1000000000", headers=key).status_code == 404
+    response = client.delete("/api/books/1000000000", headers=key)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/api/validate_key/", headers=key).status_code == 200  # Reads are not limited
+
+
+def test_invalid_key_is_rejected(client):
+    assert client.delete("/api/books/1", headers={"api-key": "wrong"}).status_code == 401
+    assert client.get("/api/validate_key/", headers={"api-key": "wrong"}).status_code == 401
@@ -0,0 +1,63 @@
+import uuid
+import pytest
+from database import create_database, insert_authors
+
+
+def _create(client, key, name=None):
+    response = client.post("/api/authors/", headers=key, json={"name": name or f"Author {uuid.uuid4()}"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_create_existing_name_conflicts(client, key):
+    author = _create(client, key)
+    assert client.post("/api/authors/", headers=key, json={"name": author["name"]}).status_code == 409
+
+
+def test_rename_to_existing_name_conflicts(client, key):
+    first, second = _create(client, key), _create(client, key)
+    response = client.put(f"/api/authors/{second['id']}", headers=key, json={"name": first["name"]})
+    assert response.status_code == 409
+    # The failed rename left the author as it was and the writer carries on
+    assert client.get("/api/authors/", params={"ids": second["id"]}).json() == [second]
+    renamed = client.put(f"/api/authors/{second['id']}", headers=key, json={"name": second["name"] + " Jr."})
+    assert renamed.json() == {"id": second["id"], "name": second["name"] + " Jr."}
+
+
+def test_rename_missing_author(client, key):
+    response = client.put("/api/authors/1000000000", headers=key, json={"name": f"Nobody {uuid.uuid4()}"})
+    assert response.status_code == 404
+
+
+def test_delete_author_with_books_conflicts(client, key):
+    book = client.get("/api/books/", params={"limit": 1}).json()[0]
+    assert client.delete(f"/api/authors/{book['author_id']}", headers=key).status_code == 409
+    author = _create(client, key)
+    assert client.delete(f"/api/authors/{author['id']}", headers=key).status_code == 200
+    assert client.delete(f"/api/authors/{author['id']}", headers=key).status_code == 404
+
+
+@pytest.fixture
+def cursor():
+    conn, cursor = create_database(":memory:")
+    cursor.executemany("INSERT INTO authors (name) VALUES (?)", [("Ursula K. Le Guin",), ("Terry Pratchett",)])
+    yield cursor
+    conn.close()
+
+
+def test_insert_authors_matches_similar_names(cursor):
+    existing = dict(cursor.execute("SELECT name, id FROM authors").fetchall())
+    ids = insert_authors(["Ursula K Le Guinn", "Terry Pratchet", "Iain M. Banks", "Iain M Bankss"],
+                         cursor, similarity=0.5)
+    assert ids["Ursula K Le Guinn"] == existing["Ursula K. Le Guin"]
+    assert ids["Terry Pratchet"] == existing["Terry Pratchett"]
+    # A new author is matched by the names after it in the same batch, as if they came one by one
+    assert ids["Iain M Bankss"] == ids["Iain M. Banks"] not in existing.values()
+    assert cursor.execute("SELECT name FROM authors WHERE id = ?", (ids["Iain M. Banks"],)).fetchone() == \
+        ("Iain M. Banks",)
+
+
+def test_insert_authors_exact_names_only(cursor):
+    ids = insert_authors(["Terry Pratchet", "terry pratchett"], cursor)
+    assert ids["terry pratchett"] != ids["Terry Pratchet"]
+    assert cursor.execute("SELECT COUNT(*) FROM authors").fetchone() == (3,)
@@ -0,0 +1,115 @@
+import json
+import uuid
+import pytest
+from fastapi import HTTPException
+from routers.payloads import iter_json_items
+from tests.fakes import collect
+
+
+def parse(chunks, content_type="application/json"):
+    return collect(iter_json_items, chunks, content_type)
+
+
+ARRAY = '[ {"title": "Café à Paris", "n": 12345}, 67890, "x,]y", [1, [2]], null, -1.5e3 ]'
+VALUES = [{"title": "Café à Paris", "n": 12345}, 67890, "x,]y", [1, [2]], None, -1500.0]
+
+
+def test_array_in_one_chunk():
+    assert parse([ARRAY]) == [(index, value, None) for index, value in enumerate(VALUES)]
+
+
+# Every split point, including the middle of numbers, strings and multi-byte characters
+def test_array_split_anywhere():
+    body = ARRAY.encode("utf-8")
+    expected = parse([body])
+    for cut in range(1, len(body)):
+        assert parse([body[:cut], body[cut:]]) == expected, cut
+
+
+def test_array_one_byte_at_a_time():
+    body = ARRAY.encode("utf-8")
+    assert parse([body[i:i + 1] for i in range(len(body))]) == parse([body])
+
+
+def test_empty_array():
+    assert parse(["[", " ", "]"]) == []
+
+
+@pytest.mark.parametrize("body", [
+    '{"title": "not an array"}',
+    '[1,, 2]',
+    '[1 2]',
+    '[1, 2,]',
+    '[1, 2] 3',
+    '[1, {"title": ',
+    '[1, 2',
+    '[',
+    '',
+])
+def test_malformed_or_truncated_array(body):
+    with pytest.raises(HTTPException) as error:
+        parse([body[:len(body) // 2], body[len(body) // 2:]])
+    assert error.value.status_code == 400
+
+
+def test_ndjson_split_across_chunks():
+    body = '{"a": 1}\n\n{"b": "é"}\n[3]'.encode("utf-8")
+    expected = [(0, {"a": 1}, None), (1, {"b": "é"}, None), (2, [3], None)]
+    for cut in range(1, len(body)):
+        assert parse([body[:cut], body[cut:]], "application/x-ndjson") == expected, cut
+
+
+def test_ndjson_reports_bad_lines_and_goes_on():
+    items = parse(['{"a": 1}\n{"a": \n', '{"a": 3}'], "application/x-ndjson; charset=utf-8")
+    assert [(index, item) for index, item, _ in items] == [(0, {"a": 1}), (1, None), (2, {"a": 3})]
+    assert items[1][2].startswith("Invalid JSON")
+
+
+def _book(author_id, link=None, **fields):
+    return {"title": "Bulk test", "author_id": author_id, "book_link": link or f"bulk/{uuid.uuid4()}",
+            "genres": ["Fantasy"], **fields}
+
+
+def test_bulk_books_report_each_item(client, key):
+    taken = client.get("/api/books/1").json()["book_link"]
+    body = [
+        _book(1),
+        _book(1, link=taken),  # Another book has the link
+        {"title": "No author"},
+        _book(10 ** 9),  # Unknown author
+        _book(1, average_rating="high"),
+    ]
+    response = client.post("/api/books/bulk", headers=key, json=body)
+    assert response.status_code == 200
+    statuses = [item["status"] for item in response.json()["items"]]
+    assert statuses == ["created", "conflict", "invalid", "conflict", "invalid"]
+    assert response.json()["counts"] == {"created": 1, "conflict": 2, "invalid": 2}
+    created = response.json()["items"][0]["id"]
+    assert client.get(f"/api/books/{created}").status_code == 200  # The failures did not roll it back
+
+
+def test_bulk_ndjson_body(client, key):
+    body = "".join(json.dumps(_book(1)) + "\n" for _ in range(3)) + "not json\n"
+    response = client.post("/api/books/bulk", headers={**key, "content-type": "application/x-ndjson"}, content=body)
+    assert [item["status"] for item in response.json()["items"]] == ["created", "created", "created", "invalid"]
+
+
+def test_bulk_upsert_updates_by_link(client, key):
+    link = f"bulk/{uuid.uuid4()}"
+    created = client.post("/api/books/bulk", headers=key, json=[_book(1, link=link)]).json()["items"][0]
+    updated = client.post("/api/books/bulk", headers=key, params={"mode": "upsert"},
+                          json=[_book(1, link=link, title="Renamed")]).json()["items"][0]
+    assert (updated["status"], updated["id"]) == ("updated", created["id"])
+    assert client.get(f"/api/books/{created['id']}").json()["title"] == "Renamed"
+
+
+def test_bulk_delete_reports_missing_ids(client, key):
+    created = client.post("/api/books/bulk", headers=key, json=[_book(1)]).json()["items"][0]["id"]
+    response = client.post("/api/books/bulk/delete", headers=key, json=[created, 10 ** 9, "seven"])
+    assert [item["status"] for item in response.json()["items"]] == ["deleted", "not_found", "invalid"]
+    assert client.get(f"/api/books/{created}").status_code == 404
+
+
+def test_malformed_bulk_body_is_rejected(client, key):
+    response = client.post("/api/books/bulk", headers=key, content=b'[{"title": "cut off"')
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import uuid
+
+
+def _book(**fields):
+    return {"title": "Cache test", "author_id": 1, "book_link": f"cache/{uuid.uuid4()}", "genres": ["Fantasy"],
+            **fields}
+
+
+def test_matching_etag_gets_304(client):
+    first = client.get("/api/books/", params={"limit": 3})
+    etag = first.headers["ETag"]
+    again = client.get("/api/books/", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    listed = client.get("/api/books/", params={"limit": 3}, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert listed.status_code == 304
+
+
+def test_etag_depends_on_the_url(client):
+    first = client.get("/api/books/", params={"limit": 3}).headers["ETag"]
+    other = client.get("/api/books/", params={"limit": 4}, headers={"If-None-Match": first})
+    assert other.status_code == 200
+    assert other.headers["ETag"] != first
+
+
+def test_write_changes_the_etag(client, key):
+    before = client.get("/api/stats/summary")
+    client.post("/api/books/", headers=key, json=_book())
+    after = client.get("/api/stats/summary", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json()["book_count"] == before.json()["book_count"] + 1
+
+
+def test_write_from_another_process_changes_the_etag(client):
+    book_id = client.get("/api/books/", params={"limit": 1}).json()[0]["id"]
+    before = client.get("/api/books/", params={"ids": book_id})
+    title = f"Renamed elsewhere {uuid.uuid4()}"
+    # Like a second worker or the CLI: a write on a connection of its own, which the app never hears about
+    conn = sqlite3.connect(os.environ["DATABASE_URL"])
+    with conn:
+        conn.execute("UPDATE books SET title = ? WHERE id = ?", (title, book_id))
+    conn.close()
+    after = client.get("/api/books/", params={"ids": book_id}, headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.json()[0]["title"] == title
+
+
+def test_author_write_only_invalidates_responses_with_authors(client, key):
+    plain = client.get("/api/books/", params={"limit": 2})
+    expanded = client.get("/api/books/", params={"limit": 2, "expand": "author"})
+    client.post("/api/authors/", headers=key, json={"name": f"Cache Author {uuid.uuid4()}"})
+    assert client.get("/api/books/", params={"limit": 2},
+                      headers={"If-None-Match": plain.headers["ETag"]}).status_code == 304
+    assert client.get("/api/books/", params={"limit": 2, "expand": "author"},
+                      headers={"If-None-Match": expanded.headers["ETag"]}).status_code == 200
@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import uuid
+from routers.catalog import _iter_csv_rows, _to_record
+from tests.fakes import collect
+
+CSV_BODY = ('title,author,genres\r\n'
+            '"Multi\r\nline, ""quoted"" title",Ann Example,Fantasy|Horror\r\n'
+            '\r\n'
+            'Plain,Bo Example,\r\n'
+            'Last without newline,"Cé Example",Poetry')
+CSV_ROWS = [
+    {"title": 'Multi\r\nline, "quoted" title', "author": "Ann Example", "genres": "Fantasy|Horror"},
+    {"title": "Plain", "author": "Bo Example", "genres": ""},
+    {"title": "Last without newline", "author": "Cé Example", "genres": "Poetry"},
+]
+
+
+def test_csv_rows():
+    assert collect(_iter_csv_rows, [CSV_BODY], "text/csv") == CSV_ROWS
+
+
+# Every split point, including inside quoted fields, escaped quotes, line endings and multi-byte characters
+def test_csv_split_anywhere():
+    body = CSV_BODY.encode("utf-8")
+    for cut in range(1, len(body)):
+        assert collect(_iter_csv_rows, [body[:cut], body[cut:]], "text/csv") == CSV_ROWS, cut
+
+
+def test_csv_one_byte_at_a_time():
+    body = CSV_BODY.encode("utf-8")
+    assert collect(_iter_csv_rows, [body[i:i + 1] for i in range(len(body))], "text/csv") == CSV_ROWS
+
+
+def test_record_genres():
+    row = {"title": "T", "author": "A"}
+    assert _to_record(row)["genres"] is None  # No genres column: keep what is stored
+    assert _to_record({**row, "genres": None})["genres"] is None
+    assert _to_record({**row, "genres": ""})["genres"] == []
+    assert _to_record({**row, "genres": "Fantasy|Horror"})["genres"] == ["Fantasy", "Horror"]
+    assert _to_record({**row, "genres": ["Poetry"]})["genres"] == ["Poetry"]
+
+
+def _import(client, key, fmt, body):
+    response = client.post("/api/import", headers=key, params={"format": fmt}, content=body)
+    assert response.status_code == 200
+    return response.json()
+
+
+def _create_book(client, key, genres):
+    book = {"title": "Import test", "author_id": 1, "book_link": f"import/{uuid.uuid4()}", "genres": genres}
+    return client.post("/api/books/", headers=key, json=book).json()
+
+
+def test_import_without_genres_keeps_them(client, key):
+    book = _create_book(client, key, ["Fantasy", "Horror"])
+    author = client.get(f"/api/books/{book['id']}", params={"expand": "author"}).json()["author"]["name"]
+    body = f"title,author,book_link\nRetitled,{author},{book['book_link']}\n"
+    assert _import(client, key, "csv", body)["imported"] == 1
+    stored = client.get(f"/api/books/{book['id']}").json()
+    assert (stored["title"], stored["genres"]) == ("Retitled", ["Fantasy", "Horror"])
+
+    line = json.dumps({"title": "Again", "author": author, "book_link": book["book_link"]})
+    assert _import(client, key, "ndjson", line + "\n")["imported"] == 1
+    assert client.get(f"/api/books/{book['id']}").json()["genres"] == ["Fantasy", "Horror"]
+
+
+def test_import_with_genres_replaces_them(client, key):
+    book = _create_book(client, key, ["Fantasy"])
+    author = client.get(f"/api/books/{book['id']}", params={"expand": "author"}).json()["author"]["name"]
+    body = f"title,author,book_link,genres\nT,{author},{book['book_link']},Poetry|Drama\n"
+    _import(client, key, "csv", body)
+    assert client.get(f"/api/books/{book['id']}").json()["genres"] == ["Poetry", "Drama"]
+
+
+def test_csv_export_imports_back(client, key):
+    exported = client.get("/api/export", params={"format": "csv"}).text
+    rows = list(csv.DictReader(io.StringIO(exported)))
+    result = _import(client, key, "csv", exported)
+    assert (result["imported"], result["invalid"]) == (len(rows), 0)
+    assert client.get("/api/export", params={"format": "csv"}).text == exported
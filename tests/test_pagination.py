@@ -0,0 +1,31 @@
+import json
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/api/books/", "/api/authors/"])
+def test_pages_chain_through_the_cursor(client, path):
+    first = client.get(path, params={"limit": 5})
+    assert first.status_code == 200
+    assert len(first.json()) == 5
+    after = first.headers["X-Next-Cursor"]
+    assert int(after) == first.json()[-1]["id"]
+    second = client.get(path, params={"limit": 5, "after": after}).json()
+    assert second[0]["id"] > int(after)
+
+
+@pytest.mark.parametrize("path", ["/api/books/", "/api/authors/"])
+@pytest.mark.parametrize("fmt", ["ndjson", "json"])
+def test_stream_honors_ids(client, path, fmt):
+    response = client.get(path, params={"stream": fmt, "ids": "3,1,2"})
+    assert response.status_code == 200
+    items = ([json.loads(line) for line in response.text.splitlines()] if fmt == "ndjson"
+             else json.loads(response.text))
+    assert [item["id"] for item in items] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("path", ["/api/books/", "/api/authors/"])
+def test_stream_matches_pages(client, path):
+    lines = client.get(path, params={"stream": "ndjson", "after": 10}).text.splitlines()
+    streamed = [json.loads(line)["id"] for line in lines]
+    paged = [item["id"] for item in client.get(path, params={"after": 10, "limit": 1000}).json()]
+    assert streamed == paged
@@ -0,0 +1,74 @@
+import sqlite3
+import pytest
+from benchmarks.generate import generate
+from benchmarks.plans import FULL_SCAN, check_plans
+from database import MIGRATIONS, create_database, schema_version
+
+
+# A small generated catalog, migrated to the current schema and analyzed like a real one
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("plans") / "books.db")
+    generate(path, 500)
+    conn, _ = create_database(path)
+    yield conn
+    conn.close()
+
+
+def test_database_is_migrated(conn):
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+
+
+def test_no_hot_query_scans_books(conn):
+    plans = check_plans(conn)
+    assert plans
+    assert {name: details for name, (details, scans) in plans.items() if scans} == {}
+
+
+# The year and rating ranges are read from their indexes rather than checked along a walk of every id
+def test_ranges_use_their_index(conn):
+    plans = check_plans(conn)
+    assert any("idx_books_published_year" in detail for detail in plans["books by year"][0])
+    assert any("idx_books_average_rating" in detail for detail in plans["books by rating"][0])
+
+
+def _plan(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+# The check itself must notice a scan, or the test above would pass for nothing
+def test_full_scan_is_detected(conn):
+    details = _plan(conn, "SELECT id FROM books WHERE title LIKE ?", ["%fire%"])
+    assert any(FULL_SCAN.match(detail) for detail in details)
+
+
+def test_id_walk_is_detected(conn):
+    details = _plan(conn, "SELECT id FROM books WHERE id > ? AND title LIKE ? ORDER BY id LIMIT 10", [0, "%fire%"])
+    assert details == ["SEARCH books USING INTEGER PRIMARY KEY (rowid>?)"]
+    assert FULL_SCAN.match(details[0])
+    assert not FULL_SCAN.match("SEARCH books USING INTEGER PRIMARY KEY (rowid=?)")
+
+
+# Without statistics SQLite walks the ids for the year and rating ranges, and the check says so
+def test_missing_statistics_are_detected(tmp_path):
+    path = str(tmp_path / "books.db")
+    generate(path, 500)
+    conn, _ = create_database(path)
+    conn.execute("DELETE FROM sqlite_stat1")
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    try:
+        plans = check_plans(conn)
+        assert plans["books by year"][1] and plans["books by rating"][1]
+    finally:
+        conn.close()
+
+
+def test_memory_database_has_the_same_schema():
+    memory, _ = create_database(":memory:")
+    try:
+        tables = {row[0] for row in memory.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {"books", "authors", "genres", "book_genres", "changes", "table_versions"} <= tables
+    finally:
+        memory.close()
@@ -0,0 +1,135 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from books_scraper import Fetcher, HttpCache, parse_genres, parse_shelf, scrape_books
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture(scope="module")
+def shelf():
+    return parse_shelf(read_fixture("shelf.html"))
+
+
+def test_shelf_has_every_book(shelf):
+    assert len(shelf) == 50
+    assert len({entry["link"] for entry in shelf}) == 50
+
+
+def test_shelf_entry(shelf):
+    assert shelf[0] == {
+        "title": "Fire House",
+        "author": "Noah Novak",
+        "link": "https://www.goodreads.com/book/show/7624039.fire-house",
+        "avg_rating": "4.05",
+        "published": "1904",
+    }
+
+
+def test_shelf_links_are_absolute(shelf):
+    base_url = "https://example.com/shelf/show/popular"
+    assert all(entry["link"].startswith("https://example.com/book/show/")
+               for entry in parse_shelf(read_fixture("shelf.html"), base_url=base_url))
+    assert all(entry["link"].startswith("https://www.goodreads.com/book/show/") for entry in shelf)
+
+
+def test_shelf_ratings_and_years_parse(shelf):
+    for entry in shelf:
+        assert 0 <= float(entry["avg_rating"]) <= 5
+        assert entry["published"].isdigit()
+
+
+def test_genres():
+    assert parse_genres(read_fixture("book.html")) == [
+        "Paranormal", "Young Adult", "Self Help", "Spirituality", "Travel",
+        "Novels", "Urban Fantasy", "Fiction", "Childrens", "History",
+    ]
+
+
+def test_pages_without_books_or_genres():
+    assert parse_shelf("<html><body></body></html>") == []
+    assert parse_genres("<html><body></body></html>") == []
+
+
+# Local stand-in for the site: the saved shelf at /shelf, the saved book page for every /book/show/ link,
+# /flaky failing with 503 for its first two requests and /etag answering revalidations with 304
+class StubSite(BaseHTTPRequestHandler):
+    requests = []
+    flaky_failures = 2
+
+    def do_GET(self):
+        StubSite.requests.append(self.path)
+        if self.path == "/flaky" and StubSite.flaky_failures:
+            StubSite.flaky_failures -= 1
+            return self._send(503, b"busy", {"Retry-After": "0"})
+        if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+            return self._send(304, b"")
+        if self.path == "/shelf":
+            return self._send(200, read_fixture("shelf.html").encode("utf-8"))
+        if self.path.startswith("/book/show/") or self.path in ("/flaky", "/etag"):
+            return self._send(200, read_fixture("book.html").encode("utf-8"), {"ETag": '"v1"'})
+        self._send(404, b"missing")
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    StubSite.requests, StubSite.flaky_failures = [], 2
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSite)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def fast_fetcher(**kwargs):
+    return Fetcher(rate=1000, burst=1000, backoff=0, timeout=(2, 5), **kwargs)
+
+
+def test_fetch_retries_transient_errors(site):
+    fetcher = fast_fetcher(retries=3)
+    assert parse_genres(fetcher.get(f"{site}/flaky"))
+    assert fetcher.stats.retries == 2
+    assert fetcher.stats.pages == 1
+
+
+def test_fetch_gives_up_after_the_last_retry(site):
+    fetcher = fast_fetcher(retries=1)
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(f"{site}/flaky")
+    assert fetcher.stats.errors == 1
+
+
+def test_cached_page_is_revalidated(site, tmp_path):
+    fetcher = fast_fetcher(cache=HttpCache(str(tmp_path)))
+    first = fetcher.get(f"{site}/etag")
+    assert fetcher.get(f"{site}/etag") == first
+    assert fetcher.stats.not_modified == 1
+
+
+def test_scrape_against_stub_site(site):
+    fetcher = fast_fetcher()
+    books, authors = scrape_books(fetcher, shelf_url=f"{site}/shelf")
+    assert len(books) == 50
+    assert all(book["genres"] == parse_genres(read_fixture("book.html")) for book in books.values())
+    assert all(book["link"].startswith(f"{site}/book/show/") for book in books.values())
+    assert len(authors) == len({author for _, author in books})
+    assert StubSite.requests.count("/shelf") == 1
+    assert fetcher.stats.pages == 51
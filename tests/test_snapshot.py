@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+import pytest
+from benchmarks.generate import generate
+from routers.filters import BookFilters
+
+np = pytest.importorskip("numpy")
+from routers.snapshot import CatalogSnapshot  # noqa: E402
+
+
+def _filters(genre=None, genre_match="any", year_min=None, year_max=None):
+    return BookFilters(author_id=None, year_min=year_min, year_max=year_max, rating_min=None, rating_max=None,
+                       genre=genre, genre_match=genre_match)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "books.db")
+    generate(path, 300)
+    snapshot = CatalogSnapshot(path)
+    snapshot._rebuild()
+    return snapshot
+
+
+# A single genre is answered from its cube, several from the rows; "no such genre" adds nothing to an "any"
+def _both_ways(snapshot, genre, **filters):
+    return (snapshot._summary(_filters(genre=[genre], **filters)),
+            snapshot._summary(_filters(genre=[genre, "no such genre"], **filters)))
+
+
+def test_genre_cube_matches_the_rows(snapshot):
+    year = int(snapshot._years[len(snapshot._years) // 2])
+    for genre in list(snapshot._genres)[:5]:
+        from_cube, from_rows = _both_ways(snapshot, genre)
+        assert from_cube == from_rows
+        assert from_cube["book_count"] > 0
+        assert _both_ways(snapshot, genre, year_min=year)[0] == _both_ways(snapshot, genre, year_min=year)[1]
+
+
+def test_unknown_genre_matches_nothing(snapshot):
+    assert snapshot._summary(_filters(genre=["no such genre"]))["book_count"] == 0
+
+
+def test_genre_cubes_follow_single_book_writes(snapshot):
+    genres = list(snapshot._genres)
+    year, rating = int(snapshot._years[0]), float(snapshot._ratings[-1])
+    book_ids = snapshot._ids[:snapshot._size].tolist()
+    book = SimpleNamespace(author_id=None, published_year=year, average_rating=rating)
+    assert snapshot._upsert(book_ids[0], book, [genres[0], "A brand new genre"])
+    assert snapshot._upsert(book_ids[1], book, [])
+    assert snapshot._upsert(book_ids[-1] + 1, book, [genres[1]])
+    assert snapshot._delete(book_ids[2])
+
+    alive = snapshot._alive[:snapshot._size]
+    for key, bitmap in snapshot._genres.items():
+        rows = np.unpackbits(bitmap, count=snapshot._size).view(bool)
+        assert (snapshot._genre_cubes[key] == snapshot._count_cells(np.flatnonzero(alive & rows))).all(), key
+    assert snapshot._summary(_filters(genre=["A BRAND NEW GENRE"]))["book_count"] == 1
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import pytest
+from database import DatabaseBusy, WriteQueue, db_writer
+
+
+# Makes WriteQueues of their own on the test database, with a table to write to
+@pytest.fixture
+def make_writer(client):
+    conn = sqlite3.connect(os.environ["DATABASE_URL"])
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS write_queue_test")
+        conn.execute("CREATE TABLE write_queue_test (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+    writers = []
+
+    def make(max_pending=64):
+        writers.append(WriteQueue(max_batch=64, linger=0, max_pending=max_pending))
+        return writers[-1]
+    yield make
+    for writer in writers:
+        writer.close()
+    with conn:
+        conn.execute("DROP TABLE write_queue_test")
+    conn.close()
+
+
+def _stored():
+    conn = sqlite3.connect(os.environ["DATABASE_URL"])
+    try:
+        return [row[0] for row in conn.execute("SELECT value FROM write_queue_test ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def _insert(conn, value):
+    return conn.execute("INSERT INTO write_queue_test (value) VALUES (?)", (value,)).lastrowid
+
+
+def _insert_then_fail(conn, value):
+    _insert(conn, value)
+    raise ValueError("changed my mind")
+
+
+# Holds the writer thread inside a job until released, so the jobs queued meanwhile form the next group
+class Blocker:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, conn):
+        self.started.set()
+        self.release.wait(10)
+        return "blocker"
+
+    async def wait_started(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.started.wait, 10)
+
+
+def _run_group(writer, jobs):
+    async def run():
+        blocker = Blocker()
+        first = asyncio.ensure_future(writer.write(blocker))
+        await blocker.wait_started()
+        rest = [asyncio.ensure_future(writer.write(fn, *args)) for fn, *args in jobs]
+        await asyncio.sleep(0)  # Let every job reach the queue
+        blocker.release.set()
+        return await first, await asyncio.gather(*rest, return_exceptions=True)
+    return asyncio.run(run())
+
+
+def test_queued_writes_commit_as_one_group(make_writer):
+    writer = make_writer()
+    first, results = _run_group(writer, [(_insert, f"v{i}") for i in range(20)])
+    assert first == "blocker"
+    assert len(set(results)) == 20
+    assert _stored() == [f"v{i}" for i in range(20)]
+    stats = writer.stats()
+    assert (stats["transactions"], stats["writes"], stats["largest_batch"]) == (2, 21, 20)
+
+
+def test_failed_write_is_rolled_back_alone(make_writer):
+    writer = make_writer()
+    _, results = _run_group(writer, [
+        (_insert, "a"),
+        (_insert, "a"),  # UNIQUE conflict
+        (_insert_then_fail, "b"),  # Wrote, then raised
+        (_insert, "c"),
+    ])
+    assert isinstance(results[0], int)
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert isinstance(results[2], ValueError)
+    assert isinstance(results[3], int)
+    assert _stored() == ["a", "c"]
+    assert writer.stats()["transactions"] == 2
+    assert writer.stats()["failed"] == 2
+
+
+def test_full_queue_refuses_writes(make_writer):
+    writer = make_writer(max_pending=8)
+
+    async def run():
+        blocker = Blocker()
+        first = asyncio.ensure_future(writer.write(blocker))
+        await blocker.wait_started()
+        queued = [asyncio.ensure_future(writer.write(_insert, f"q{i}")) for i in range(8)]
+        await asyncio.sleep(0)
+        with pytest.raises(DatabaseBusy):
+            await writer.write(_insert, "one too many")
+        blocker.release.set()
+        await first
+        return await asyncio.gather(*queued)
+    assert len(asyncio.run(run())) == 8
+    assert _stored() == [f"q{i}" for i in range(8)]
+
+
+def test_full_queue_answers_503(client, key, monkeypatch):
+    full = queue.Queue(1)
+    full.put(None)
+    monkeypatch.setattr(db_writer, "_jobs", full)
+    response = client.post("/api/authors/", headers=key, json={"name": "Never written"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1